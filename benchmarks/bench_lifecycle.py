@@ -0,0 +1,272 @@
+"""
+Benchmark the overhead tox-docker adds to a tox run
+
+Runs tox, with tox-docker, against a fake Docker Engine API server (see
+fake_docker.py) with controllable latencies, and reports how long starting
+and tearing down the containers took, how many API calls each phase made,
+and how long tox-docker took to notice that containers had become healthy.
+
+Since the fake daemon does no real work, the times reported are (nearly)
+all tox-docker's own overhead, plus whatever latency is configured. With
+--checkpoint, the containers are checkpointed on the first run, and later
+runs restore them (the fake daemon's checkpoints are kept between runs).
+
+Usage:
+
+    python benchmarks/bench_lifecycle.py --containers 10 --healthy-after 0.5
+
+"""
+
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from pathlib import Path
+from statistics import median
+from typing import Any, Dict, List, Mapping, Sequence, Set
+import importlib.metadata
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_docker import Call, FakeDocker
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+IMAGE = "tox-docker-bench/service"
+
+# the fake daemon doesn't write checkpoints anywhere; this just has to be
+# the same for every run
+CHECKPOINT_DIR = "/tmp/tox-docker-bench-checkpoints"
+
+
+def write_project(directory: Path, args: Namespace) -> None:
+    names = [f"svc{i}" for i in range(args.containers)]
+    sections = [
+        "[testenv:bench]",
+        "skip_install = true",
+        "package = skip",
+        "commands = python -c ''",
+        "docker =",
+        *(f"    {name}" for name in names),
+    ]
+    for i, name in enumerate(names):
+        sections += ["", f"[docker:{name}]", f"image = {IMAGE}:{i}"]
+        if args.healthcheck:
+            sections += ["healthcheck_cmd = true", "healthcheck_interval = 1"]
+        if args.checkpoint:
+            sections += ["checkpoint = true"]
+    (directory / "tox.ini").write_text("\n".join(sections) + "\n")
+
+    try:
+        importlib.metadata.distribution("tox-docker")
+    except importlib.metadata.PackageNotFoundError:
+        # load the plugin from this checkout as an inline plugin, since it
+        # isn't installed (if it were, it would be loaded twice)
+        (directory / "toxfile.py").write_text(
+            "from tox_docker.plugin import *  # noqa\n"
+        )
+
+
+def run_once(args: Namespace, checkpoints: Dict[str, Set[str]]) -> Dict[str, Any]:
+    fake = FakeDocker(
+        latency=args.latency,
+        pull_duration=args.pull_duration,
+        healthy_after=args.healthy_after,
+    )
+    fake.checkpoints = checkpoints
+    for i in range(args.containers):
+        fake.add_image(f"{IMAGE}:{i}", exposed_ports=("8000/tcp",), local=args.pulled)
+    docker_host = fake.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        write_project(directory, args)
+        report_path = directory / "report.json"
+
+        env = dict(os.environ)
+        env["DOCKER_HOST"] = docker_host
+        env["PYTHONPATH"] = os.pathsep.join(
+            filter(None, [str(REPO_ROOT), env.get("PYTHONPATH")])
+        )
+        started = time.time()
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "tox",
+                "-c",
+                str(directory / "tox.ini"),
+                "-e",
+                "bench",
+                "--docker-report",
+                str(report_path),
+                "--docker-checkpoint-dir",
+                CHECKPOINT_DIR,
+                *args.tox_args,
+            ],
+            env=env,
+            cwd=directory,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        elapsed = time.time() - started
+        if result.returncode != 0:
+            fake.stop()
+            raise SystemExit(f"tox failed:\n{result.stdout}")
+        report = json.loads(report_path.read_text())
+
+    fake.stop()
+    return measure(fake, report, elapsed)
+
+
+def measure(
+    fake: FakeDocker, report: Mapping[str, Any], elapsed: float
+) -> Dict[str, Any]:
+    timings = report["timings"]
+    startup = [t for t in timings if t["phase"] != "remove"]
+    teardown = [t for t in timings if t["phase"] == "remove"]
+
+    startup_began = min(t["started"] for t in startup)
+    startup_ended = max(t["started"] + t["duration"] for t in startup)
+    teardown_began = min((t["started"] for t in teardown), default=startup_ended)
+    # the testenv's network is removed after the containers, and isn't timed
+    teardown_ends = [t["started"] + t["duration"] for t in teardown]
+    teardown_ends.extend(c.time + c.duration for c in fake.calls)
+    teardown_ended = max(teardown_ends, default=startup_ended)
+
+    calls: Sequence[Call] = fake.calls
+    startup_calls = Counter(
+        c.endpoint for c in calls if startup_began <= c.time <= startup_ended
+    )
+    teardown_calls = Counter(c.endpoint for c in calls if c.time > startup_ended)
+
+    # how long after each container actually became healthy tox-docker
+    # noticed, and how many inspects it took while waiting
+    detection: List[float] = []
+    for timing in timings:
+        if timing["phase"] != "healthy":
+            continue
+        container = next(
+            c
+            for c in fake.containers.values()
+            if c.name.startswith(f"{timing['container']}-tox-")
+        )
+        healthy_at = container.healthy_at()
+        if healthy_at is not None:
+            noticed = timing["started"] + timing["duration"]
+            detection.append(max(noticed - healthy_at, 0.0))
+    healthy_window = [t for t in timings if t["phase"] == "healthy"]
+    polls = 0
+    if healthy_window:
+        began = min(t["started"] for t in healthy_window)
+        ended = max(t["started"] + t["duration"] for t in healthy_window)
+        polls = sum(
+            1
+            for c in calls
+            if c.endpoint == "containers.get" and began <= c.time <= ended
+        )
+
+    return {
+        "total": elapsed,
+        "startup": startup_ended - startup_began,
+        "teardown": teardown_ended - teardown_began,
+        "startup_calls": dict(startup_calls),
+        "teardown_calls": dict(teardown_calls),
+        "health_detection_delay": max(detection, default=0.0),
+        "health_polls": polls,
+        "restored": sum(1 for c in fake.containers.values() if c.restored_from),
+        "phases": report["totals"],
+    }
+
+
+def summarize(runs: Sequence[Mapping[str, Any]]) -> Dict[str, Any]:
+    def med(key: str) -> float:
+        return median(run[key] for run in runs)
+
+    def calls(key: str) -> Dict[str, float]:
+        endpoints = sorted({e for run in runs for e in run[key]})
+        return {e: median(run[key].get(e, 0) for run in runs) for e in endpoints}
+
+    return {
+        "runs": len(runs),
+        "total": med("total"),
+        "startup": med("startup"),
+        "teardown": med("teardown"),
+        "health_detection_delay": med("health_detection_delay"),
+        "health_polls": med("health_polls"),
+        "restored": med("restored"),
+        "startup_calls": calls("startup_calls"),
+        "teardown_calls": calls("teardown_calls"),
+    }
+
+
+def print_summary(summary: Mapping[str, Any], args: Namespace) -> None:
+    print(
+        f"{args.containers} containers, {summary['runs']} runs "
+        f"(latency {args.latency}s, pull {args.pull_duration}s, "
+        f"healthy after {args.healthy_after}s); medians:"
+    )
+    print(f"  tox run            {summary['total']:.3f}s")
+    print(f"  startup            {summary['startup']:.3f}s")
+    print(f"  teardown           {summary['teardown']:.3f}s")
+    print(f"  health detection   {summary['health_detection_delay']:.3f}s late")
+    print(f"  inspects while waiting for health  {summary['health_polls']:g}")
+    if args.checkpoint:
+        print(f"  restored from checkpoints  {summary['restored']:g}")
+    for key in ("startup_calls", "teardown_calls"):
+        total = sum(summary[key].values())
+        print(f"  {key.replace('_', ' ')}: {total:g}")
+        for endpoint, count in summary[key].items():
+            print(f"    {endpoint:<22} {count:g}")
+
+
+def main(argv: Sequence[str] = ()) -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--containers", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every API call"
+    )
+    parser.add_argument(
+        "--pull-duration", type=float, default=0.2, help="seconds each pull takes"
+    )
+    parser.add_argument(
+        "--pulled", action="store_true", help="start with the images already pulled"
+    )
+    parser.add_argument(
+        "--healthy-after",
+        type=float,
+        default=0.5,
+        help="seconds after starting that containers become healthy",
+    )
+    parser.add_argument(
+        "--no-healthcheck",
+        dest="healthcheck",
+        action="store_false",
+        help="don't give the containers health checks",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        help="checkpoint the containers, and restore them on later runs",
+    )
+    parser.add_argument("--json", metavar="PATH", help="also write results as JSON")
+    parser.add_argument(
+        "tox_args", nargs="*", help="extra arguments for tox (after --)"
+    )
+    args = parser.parse_args(argv or None)
+
+    checkpoints: Dict[str, Set[str]] = {}
+    runs = [run_once(args, checkpoints) for _ in range(args.runs)]
+    summary = summarize(runs)
+    print_summary(summary, args)
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump({"summary": summary, "runs": runs}, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,732 @@
+"""
+A fake Docker Engine API server, for benchmarking tox-docker
+
+It implements just enough of the Engine API for tox-docker's container
+lifecycle -- pulling images, creating, starting, inspecting and removing
+containers, health checks, networks, events, logs and (experimental)
+checkpoints -- with controllable latencies, and records every API call it
+serves.
+
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Set, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+import hashlib
+import itertools
+import json
+import re
+import struct
+import threading
+import time
+
+API_VERSION = "1.43"
+
+
+class Call(NamedTuple):
+    time: float
+    method: str
+    endpoint: str
+    duration: float
+
+
+class FakeImage(NamedTuple):
+    id: str
+    tags: List[str]
+    exposed_ports: List[str]
+    created: int
+
+
+class FakeContainer:
+    def __init__(
+        self, container_id: str, name: str, image: FakeImage, body: Mapping[str, Any]
+    ) -> None:
+        self.id = container_id
+        self.name = name
+        self.image = image
+        self.config = dict(body)
+        self.labels: Dict[str, str] = dict(body.get("Labels") or {})
+        self.started_at: Optional[float] = None
+        self.removed = False
+        self.healthy_after: Optional[float] = None
+        self.ports: Dict[str, Optional[List[Dict[str, str]]]] = {}
+        self.networks: Set[str] = set()
+        self.restored_from = ""
+        self.exit_after: Optional[float] = None
+        self.exit_code = 0
+
+    def exited(self, now: float) -> bool:
+        if self.started_at is None or self.exit_after is None:
+            return False
+        return now - self.started_at >= self.exit_after
+
+    @property
+    def has_healthcheck(self) -> bool:
+        return bool(self.config.get("Healthcheck"))
+
+    def health(self, now: float) -> str:
+        if self.exited(now):
+            return "unhealthy"
+        if self.started_at is None or self.healthy_after is None:
+            return "starting"
+        if now - self.started_at >= self.healthy_after:
+            return "healthy"
+        return "starting"
+
+    def healthy_at(self) -> Optional[float]:
+        if self.started_at is None or self.healthy_after is None:
+            return None
+        return self.started_at + self.healthy_after
+
+
+# endpoints, as (method, pattern, name); the name is what calls are recorded as
+ROUTES = [
+    ("GET", r"/version", "version"),
+    ("GET", r"/_ping", "ping"),
+    ("GET", r"/info", "info"),
+    ("GET", r"/images/json", "images.list"),
+    ("GET", r"/images/(?P<name>.+)/json", "images.get"),
+    ("POST", r"/images/create", "images.pull"),
+    ("POST", r"/containers/create", "containers.create"),
+    ("GET", r"/containers/json", "containers.list"),
+    ("GET", r"/containers/(?P<id>[^/]+)/json", "containers.get"),
+    ("POST", r"/containers/(?P<id>[^/]+)/start", "containers.start"),
+    ("POST", r"/containers/(?P<id>[^/]+)/stop", "containers.stop"),
+    ("GET", r"/containers/(?P<id>[^/]+)/logs", "containers.logs"),
+    ("GET", r"/containers/(?P<id>[^/]+)/checkpoints", "checkpoints.list"),
+    ("POST", r"/containers/(?P<id>[^/]+)/checkpoints", "checkpoints.create"),
+    (
+        "DELETE",
+        r"/containers/(?P<id>[^/]+)/checkpoints/(?P<name>[^/]+)",
+        "checkpoints.remove",
+    ),
+    ("DELETE", r"/containers/(?P<id>[^/]+)", "containers.remove"),
+    ("POST", r"/networks/create", "networks.create"),
+    ("GET", r"/networks", "networks.list"),
+    ("GET", r"/networks/(?P<id>[^/]+)", "networks.get"),
+    ("POST", r"/networks/(?P<id>[^/]+)/connect", "networks.connect"),
+    ("POST", r"/networks/(?P<id>[^/]+)/disconnect", "networks.disconnect"),
+    ("DELETE", r"/networks/(?P<id>[^/]+)", "networks.remove"),
+    ("GET", r"/events", "events"),
+]
+COMPILED_ROUTES = [
+    (method, re.compile(f"^(?:/v[0-9.]+)?{pattern}$"), name)
+    for method, pattern, name in ROUTES
+]
+
+
+def normalize_ref(ref: str) -> str:
+    if ":" not in ref.rsplit("/", 1)[-1]:
+        ref = f"{ref}:latest"
+    for prefix in ("docker.io/", "library/"):
+        if ref.startswith(prefix):
+            ref = ref.replace(prefix, "", 1)
+    return ref
+
+
+def fake_id(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class FakeDocker:
+    """
+    The state of the fake daemon, and its tunable behavior
+
+    `latency` is added to every API call; pulling an image takes
+    `pull_duration` seconds (reported as `pull_layers` layers); and a
+    container with a health check reports healthy `healthy_after` seconds
+    after it starts. The daemon claims to have `mem_total` bytes of memory.
+
+    Checkpoints are only supported if `experimental`; a container restored
+    from a checkpoint is healthy as soon as it starts. They are kept in
+    `checkpoints`, by checkpoint dir, which can be shared between fakes to
+    restore checkpoints taken by an earlier one.
+
+    A container whose name starts with a key of `crashes` exits that many
+    seconds after it starts, with exit code 1 (or the code in `exit_codes`).
+
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        pull_duration: float = 0.0,
+        pull_layers: int = 3,
+        healthy_after: float = 0.0,
+        mem_total: int = 8 << 30,
+        experimental: bool = True,
+    ) -> None:
+        self.latency = latency
+        self.pull_duration = pull_duration
+        self.pull_layers = pull_layers
+        self.healthy_after = healthy_after
+        self.mem_total = mem_total
+        self.experimental = experimental
+
+        self.lock = threading.Lock()
+        self.calls: List[Call] = []
+        self.remote_images: Dict[str, FakeImage] = {}
+        self.images: Dict[str, FakeImage] = {}
+        self.containers: Dict[str, FakeContainer] = {}
+        self.networks: Dict[str, Dict[str, Any]] = {}
+        self.checkpoints: Dict[str, Set[str]] = {}
+        self.crashes: Dict[str, float] = {}
+        self.exit_codes: Dict[str, int] = {}
+        self._ports = itertools.count(32768)
+        self._server: Optional[ThreadingHTTPServer] = None
+        # the DOCKER_HOST to reach the API at, once started
+        self.docker_host = ""
+
+    def add_image(
+        self, ref: str, exposed_ports: Tuple[str, ...] = (), local: bool = False
+    ) -> None:
+        """
+        Make `ref` available to pull, or already pulled if `local`
+        """
+        ref = normalize_ref(ref)
+        image = FakeImage(
+            id=f"sha256:{fake_id('image', ref)}",
+            tags=[ref],
+            exposed_ports=list(exposed_ports),
+            created=int(time.time()),
+        )
+        self.remote_images[ref] = image
+        if local:
+            self.images[image.id] = image
+
+    def find_image(self, ref: str) -> Optional[FakeImage]:
+        if ref in self.images:
+            return self.images[ref]
+        ref = normalize_ref(ref)
+        for image in self.images.values():
+            if ref in image.tags:
+                return image
+        return None
+
+    def find_container(self, id_or_name: str) -> Optional[FakeContainer]:
+        for container in self.containers.values():
+            if container.removed:
+                continue
+            if container.id.startswith(id_or_name) or container.name == id_or_name:
+                return container
+        return None
+
+    def record(
+        self, method: str, endpoint: str, started: float, duration: float
+    ) -> None:
+        with self.lock:
+            self.calls.append(Call(started, method, endpoint, duration))
+
+    # server lifecycle
+
+    def start(self) -> str:
+        """
+        Serve the API on a free port, and return the DOCKER_HOST for it
+        """
+        handler = type("Handler", (FakeDockerHandler,), {"fake": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.docker_host = f"tcp://127.0.0.1:{self._server.server_address[1]}"
+        return self.docker_host
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake: FakeDocker
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.dispatch("GET")
+
+    def do_POST(self) -> None:
+        self.dispatch("POST")
+
+    def do_DELETE(self) -> None:
+        self.dispatch("DELETE")
+
+    # plumbing
+
+    def dispatch(self, method: str) -> None:
+        url = urlparse(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        self.body = json.loads(raw_body) if raw_body else {}
+
+        for route_method, pattern, name in COMPILED_ROUTES:
+            match = pattern.match(unquote(url.path))
+            if route_method == method and match:
+                break
+        else:
+            self.send_json(404, {"message": f"no route for {method} {url.path}"})
+            return
+
+        started = time.time()
+        start = time.monotonic()
+        time.sleep(self.fake.latency)
+        try:
+            handler = getattr(self, "handle_" + name.replace(".", "_"))
+            handler(**match.groupdict())
+        finally:
+            self.fake.record(method, name, started, time.monotonic() - start)
+
+    def send_json(self, status: int, body: Any) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_empty(self, status: int = 204) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def start_stream(self, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def filters(self) -> Dict[str, List[str]]:
+        filters = json.loads(self.query.get("filters") or "{}")
+        return {
+            key: list(value) if isinstance(value, (list, dict)) else [value]
+            for key, value in filters.items()
+        }
+
+    # system
+
+    def handle_version(self) -> None:
+        self.send_json(
+            200,
+            {"ApiVersion": API_VERSION, "MinAPIVersion": "1.24", "Version": "fake"},
+        )
+
+    def handle_info(self) -> None:
+        with self.fake.lock:
+            containers = [c for c in self.fake.containers.values() if not c.removed]
+            running = sum(1 for container in containers if container.started_at)
+        self.send_json(
+            200,
+            {
+                "Containers": len(containers),
+                "ContainersRunning": running,
+                "MemTotal": self.fake.mem_total,
+            },
+        )
+
+    def handle_ping(self) -> None:
+        data = b"OK"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # images
+
+    def handle_images_list(self) -> None:
+        with self.fake.lock:
+            images = list(self.fake.images.values())
+        self.send_json(
+            200,
+            [
+                {"Id": image.id, "RepoTags": image.tags, "Created": image.created}
+                for image in images
+            ],
+        )
+
+    def handle_images_get(self, name: str) -> None:
+        with self.fake.lock:
+            image = self.fake.find_image(name)
+        if image is None:
+            self.send_json(404, {"message": f"No such image: {name}"})
+            return
+        self.send_json(200, self.image_attrs(image))
+
+    def image_attrs(self, image: FakeImage) -> Dict[str, Any]:
+        return {
+            "Id": image.id,
+            "RepoTags": image.tags,
+            "Created": time.strftime(
+                "%Y-%m-%dT%H:%M:%S.000000000Z", time.gmtime(image.created)
+            ),
+            "Config": {"ExposedPorts": {port: {} for port in image.exposed_ports}},
+        }
+
+    def handle_images_pull(self) -> None:
+        ref = self.query["fromImage"]
+        if self.query.get("tag"):
+            ref = f"{ref}:{self.query['tag']}"
+        image = self.fake.remote_images.get(normalize_ref(ref))
+
+        self.start_stream("application/json")
+        if image is None:
+            self.write_event({"error": f"manifest for {ref} not found"})
+            self.end_stream()
+            return
+
+        layers = [f"layer{i}" for i in range(self.fake.pull_layers)]
+        for layer in layers:
+            self.write_event({"id": layer, "status": "Pulling fs layer"})
+        for layer in layers:
+            time.sleep(self.fake.pull_duration / max(len(layers), 1))
+            detail = {"current": 1000, "total": 1000}
+            self.write_event(
+                {"id": layer, "status": "Downloading", "progressDetail": detail}
+            )
+            self.write_event({"id": layer, "status": "Download complete"})
+            self.write_event({"id": layer, "status": "Pull complete"})
+        with self.fake.lock:
+            self.fake.images[image.id] = image
+        self.write_event({"status": f"Status: Downloaded newer image for {ref}"})
+        self.end_stream()
+
+    def write_event(self, event: Mapping[str, Any]) -> None:
+        self.write_chunk(json.dumps(event).encode() + b"\r\n")
+
+    # containers
+
+    def handle_containers_create(self) -> None:
+        name = self.query.get("name", "")
+        with self.fake.lock:
+            if name and self.fake.find_container(name):
+                self.send_json(409, {"message": f"Conflict. {name!r} is in use"})
+                return
+            image = self.fake.find_image(self.body.get("Image", ""))
+            if image is None:
+                self.send_json(404, {"message": f"No such image: {self.body['Image']}"})
+                return
+            container_id = fake_id("container", name, str(len(self.fake.containers)))
+            container = FakeContainer(container_id, name, image, self.body)
+            if container.has_healthcheck:
+                container.healthy_after = self.fake.healthy_after
+            for prefix, after in self.fake.crashes.items():
+                if name.startswith(prefix):
+                    container.exit_after = after
+                    container.exit_code = self.fake.exit_codes.get(prefix, 1)
+            self.fake.containers[container_id] = container
+        self.send_json(201, {"Id": container_id, "Warnings": []})
+
+    def handle_containers_list(self) -> None:
+        labels = self.filters().get("label", [])
+        ids = self.filters().get("id", [])
+        now = time.time()
+        with self.fake.lock:
+            containers = [
+                c
+                for c in self.fake.containers.values()
+                if not c.removed
+                if all(self.has_label(c.labels, label) for label in labels)
+                if not ids or any(c.id.startswith(i) for i in ids)
+            ]
+            self.send_json(
+                200,
+                [
+                    {
+                        "Id": c.id,
+                        "Names": [f"/{c.name}"],
+                        "Labels": c.labels,
+                        "State": self.status(c, now),
+                    }
+                    for c in containers
+                ],
+            )
+
+    @staticmethod
+    def status(container: FakeContainer, now: float) -> str:
+        if container.exited(now):
+            return "exited"
+        return "running" if container.started_at else "created"
+
+    @staticmethod
+    def has_label(labels: Mapping[str, str], label: str) -> bool:
+        key, sep, value = label.partition("=")
+        if key not in labels:
+            return False
+        return not sep or labels[key] == value
+
+    def handle_containers_get(self, id: str) -> None:
+        with self.fake.lock:
+            container = self.fake.find_container(id)
+            if container is None:
+                self.send_json(404, {"message": f"No such container: {id}"})
+                return
+            now = time.time()
+            status = self.status(container, now)
+            state: Dict[str, Any] = {
+                "Status": status,
+                "Running": status == "running",
+                "OOMKilled": False,
+                "ExitCode": container.exit_code if status == "exited" else 0,
+            }
+            if container.has_healthcheck:
+                state["Health"] = {"Status": container.health(now)}
+            attrs = {
+                "Id": container.id,
+                "Name": f"/{container.name}",
+                "Image": container.image.id,
+                "State": state,
+                "Config": {
+                    "Image": container.config.get("Image"),
+                    "Labels": container.labels,
+                    "Env": container.config.get("Env") or [],
+                    "Tty": False,
+                },
+                "NetworkSettings": {
+                    "Gateway": "172.17.0.1",
+                    "Ports": container.ports,
+                    "Networks": {name: {} for name in container.networks},
+                },
+            }
+        self.send_json(200, attrs)
+
+    def handle_containers_start(self, id: str) -> None:
+        checkpoint = self.query.get("checkpoint", "")
+        if checkpoint and not self.fake.experimental:
+            self.send_experimental_only()
+            return
+        with self.fake.lock:
+            container = self.fake.find_container(id)
+            if container is None:
+                self.send_json(404, {"message": f"No such container: {id}"})
+                return
+            if checkpoint:
+                directory = self.query.get("checkpoint-dir", "")
+                if checkpoint not in self.fake.checkpoints.get(directory, ()):
+                    self.send_json(
+                        404, {"message": f"No such checkpoint: {checkpoint}"}
+                    )
+                    return
+                container.restored_from = checkpoint
+                if container.has_healthcheck:
+                    container.healthy_after = 0.0
+            host_config = container.config.get("HostConfig") or {}
+            if host_config.get("PublishAllPorts"):
+                published = container.image.exposed_ports
+            else:
+                published = list(host_config.get("PortBindings") or {})
+            for port in container.image.exposed_ports:
+                container.ports[port] = None
+            for port in published:
+                host_port = str(next(self.fake._ports))
+                container.ports[port] = [{"HostIp": "0.0.0.0", "HostPort": host_port}]
+            container.started_at = time.time()
+        self.send_empty()
+
+    def handle_containers_stop(self, id: str) -> None:
+        self.send_empty()
+
+    def handle_containers_remove(self, id: str) -> None:
+        with self.fake.lock:
+            container = self.fake.find_container(id)
+            if container is None:
+                self.send_json(404, {"message": f"No such container: {id}"})
+                return
+            container.removed = True
+            for network in self.fake.networks.values():
+                network["Containers"].pop(container.id, None)
+        self.send_empty()
+
+    # checkpoints
+
+    def send_experimental_only(self) -> None:
+        self.send_json(
+            400,
+            {
+                "message": "checkpoint is only supported on a Docker daemon "
+                "with experimental features enabled"
+            },
+        )
+
+    def handle_checkpoints_list(self, id: str) -> None:
+        if not self.fake.experimental:
+            self.send_experimental_only()
+            return
+        with self.fake.lock:
+            names = sorted(self.fake.checkpoints.get(self.query.get("dir", ""), ()))
+        self.send_json(200, [{"Name": name} for name in names])
+
+    def handle_checkpoints_create(self, id: str) -> None:
+        if not self.fake.experimental:
+            self.send_experimental_only()
+            return
+        with self.fake.lock:
+            container = self.fake.find_container(id)
+            if container is None or container.started_at is None:
+                self.send_json(404, {"message": f"No running container: {id}"})
+                return
+            directory = self.body.get("CheckpointDir", "")
+            checkpoints = self.fake.checkpoints.setdefault(directory, set())
+            checkpoints.add(self.body["CheckpointID"])
+        self.send_empty(201)
+
+    def handle_checkpoints_remove(self, id: str, name: str) -> None:
+        if not self.fake.experimental:
+            self.send_experimental_only()
+            return
+        with self.fake.lock:
+            self.fake.checkpoints.get(self.query.get("dir", ""), set()).discard(name)
+        self.send_empty()
+
+    def handle_containers_logs(self, id: str) -> None:
+        with self.fake.lock:
+            container = self.fake.find_container(id)
+        if container is None:
+            self.send_json(404, {"message": f"No such container: {id}"})
+            return
+
+        # a single line of stdout, in the multiplexed stream format
+        line = f"{container.name} started\n".encode()
+        self.start_stream("application/vnd.docker.multiplexed-stream")
+        self.write_chunk(struct.pack(">BxxxL", 1, len(line)) + line)
+        if self.query.get("follow") in ("1", "true", "True"):
+            while not container.removed:
+                time.sleep(0.05)
+        self.end_stream()
+
+    # networks
+
+    def handle_networks_create(self) -> None:
+        name = self.body["Name"]
+        with self.fake.lock:
+            if any(n["Name"] == name for n in self.fake.networks.values()):
+                self.send_json(409, {"message": f"network {name} already exists"})
+                return
+            network_id = fake_id("network", name)
+            self.fake.networks[network_id] = {
+                "Id": network_id,
+                "Name": name,
+                "Labels": dict(self.body.get("Labels") or {}),
+                "Containers": {},
+            }
+        self.send_json(201, {"Id": network_id, "Warning": ""})
+
+    def find_network(self, id: str) -> Optional[Dict[str, Any]]:
+        for network in self.fake.networks.values():
+            if network["Id"].startswith(id) or network["Name"] == id:
+                return network
+        return None
+
+    def handle_networks_list(self) -> None:
+        names = self.filters().get("name", [])
+        labels = self.filters().get("label", [])
+        with self.fake.lock:
+            networks = [
+                dict(n)
+                for n in self.fake.networks.values()
+                if not names or n["Name"] in names
+                if all(self.has_label(n["Labels"], label) for label in labels)
+            ]
+        self.send_json(200, networks)
+
+    def handle_networks_get(self, id: str) -> None:
+        with self.fake.lock:
+            network = self.find_network(id)
+            body = (
+                dict(network, Containers=dict(network["Containers"]))
+                if network
+                else None
+            )
+        if body is None:
+            self.send_json(404, {"message": f"network {id} not found"})
+            return
+        self.send_json(200, body)
+
+    def handle_networks_connect(self, id: str) -> None:
+        with self.fake.lock:
+            network = self.find_network(id)
+            container = self.fake.find_container(self.body.get("Container", ""))
+            if network is None or container is None:
+                self.send_json(404, {"message": "no such network or container"})
+                return
+            network["Containers"][container.id] = {"Name": container.name}
+            container.networks.add(network["Name"])
+        self.send_empty(200)
+
+    def handle_networks_disconnect(self, id: str) -> None:
+        with self.fake.lock:
+            network = self.find_network(id)
+            if network is not None:
+                network["Containers"].pop(self.body.get("Container", ""), None)
+        self.send_empty(200)
+
+    def handle_networks_remove(self, id: str) -> None:
+        with self.fake.lock:
+            network = self.find_network(id)
+            if network is None:
+                self.send_json(404, {"message": f"network {id} not found"})
+                return
+            del self.fake.networks[network["Id"]]
+        self.send_empty()
+
+    # events
+
+    def handle_events(self) -> None:
+        """
+        Stream health_status and die events for the containers in the filter
+
+        Only containers becoming healthy, and exiting, are reported, which is
+        all tox-docker subscribes to. The stream ends once there's nothing
+        left to report, rather than staying open like the real thing.
+
+        """
+        wanted = set(self.filters().get("container", []))
+        self.start_stream("application/json")
+        reported: Set[str] = set()
+        try:
+            while True:
+                now = time.time()
+                with self.fake.lock:
+                    containers = [
+                        c
+                        for c in self.fake.containers.values()
+                        if c.id in wanted and c.id not in reported and not c.removed
+                    ]
+                if not containers:
+                    break
+                for container in containers:
+                    if container.exited(now):
+                        action = "die"
+                    elif container.health(now) == "healthy":
+                        action = "health_status: healthy"
+                    else:
+                        continue
+                    reported.add(container.id)
+                    self.write_event(
+                        {
+                            "Type": "container",
+                            "Action": action,
+                            "status": action,
+                            "id": container.id,
+                            "Actor": {
+                                "ID": container.id,
+                                "Attributes": {"name": container.name},
+                            },
+                            "time": int(now),
+                        }
+                    )
+                pending = [c.healthy_at() for c in containers if c.id not in reported]
+                next_change = min([t for t in pending if t is not None], default=None)
+                delay = 0.05 if next_change is None else max(next_change - now, 0.001)
+                time.sleep(min(delay, 0.05))
+            self.end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
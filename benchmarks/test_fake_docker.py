@@ -0,0 +1,152 @@
+from typing import Any, Iterator, Mapping, Tuple
+import time
+
+from docker.models.containers import Container
+from fake_docker import FakeDocker
+import docker
+import pytest
+
+from tox_docker.client import get_docker_client
+from tox_docker.config import ContainerConfig, Image
+from tox_docker.plugin import (
+    checkpoint_name,
+    ContainerFailed,
+    docker_check_running_all,
+    docker_checkpoint,
+    docker_create_and_start,
+    docker_health_check_all,
+)
+
+
+@pytest.fixture
+def fake() -> Iterator[FakeDocker]:
+    fake = FakeDocker(healthy_after=0.1)
+    fake.add_image("bench/service:1", exposed_ports=("8000/tcp",))
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+def test_container_lifecycle(fake: FakeDocker) -> None:
+    client = docker.DockerClient(base_url=fake.docker_host, version="auto")
+
+    for _ in client.api.pull("bench/service", tag="1", stream=True, decode=True):
+        pass
+    image = client.images.get("bench/service:1")
+
+    container = client.containers.create(
+        image.id,
+        name="svc",
+        healthcheck={"test": ["CMD-SHELL", "true"]},
+        publish_all_ports=True,
+    )
+    container.start()
+    container.reload()
+    assert container.attrs["State"]["Health"]["Status"] == "starting"
+    assert container.attrs["NetworkSettings"]["Ports"]["8000/tcp"][0]["HostPort"]
+
+    events = client.events(
+        decode=True,
+        filters={"event": "health_status", "container": [container.id]},
+    )
+    assert next(events)["id"] == container.id
+    events.close()
+
+    container.remove(v=True, force=True)
+    assert fake.find_container("svc") is None
+
+    endpoints = [call.endpoint for call in fake.calls]
+    assert endpoints.count("containers.create") == 1
+    assert "images.pull" in endpoints
+
+
+def start(
+    fake: FakeDocker, name: str, run_options: Mapping[str, Any], **kwargs: Any
+) -> Tuple[ContainerConfig, Container]:
+    docker_host = fake.docker_host
+    fake.add_image("bench/service:1", local=True)
+
+    config = ContainerConfig(
+        name=name.split("-")[0],
+        image=Image("bench/service:1"),
+        dockerfile=None,
+        dockerfile_target="",
+        stop=True,
+        **kwargs,
+    )
+    config.docker_host = docker_host
+    config.runnable_image = get_docker_client(docker_host).images.get("bench/service:1")
+    return config, docker_create_and_start(config, name, run_options)
+
+
+HEALTHCHECK = {"healthcheck": {"test": ["CMD-SHELL", "true"]}}
+
+
+def test_checkpoint_and_restore(fake: FakeDocker) -> None:
+    checkpoint = {"checkpoint": True, "checkpoint_dir": "/checkpoints"}
+
+    config, container = start(fake, "svc-1", HEALTHCHECK, **checkpoint)
+    assert not config.restored
+    docker_checkpoint(config, container)
+    assert fake.checkpoints["/checkpoints"] == {checkpoint_name(config)}
+
+    # the next run restores it, and it's healthy as soon as it starts
+    config, container = start(fake, "svc-2", HEALTHCHECK, **checkpoint)
+    assert config.restored
+    assert container.attrs["State"]["Health"]["Status"] == "healthy"
+
+    # without experimental features, containers just start normally
+    fake.experimental = False
+    config, container = start(fake, "svc-3", HEALTHCHECK, **checkpoint)
+    assert not config.restored
+    assert container.attrs["State"]["Status"] == "running"
+    docker_checkpoint(config, container)
+    assert len(fake.checkpoints["/checkpoints"]) == 1
+
+
+def test_crashed_container_fails_the_health_check_at_once(fake: FakeDocker) -> None:
+    fake.healthy_after = 30
+    fake.crashes["crashing"] = 0.2
+    fake.exit_codes["crashing"] = 3
+    started = [
+        start(fake, "slow-1", HEALTHCHECK),
+        # no health check of its own, but watched while we wait for slow
+        start(fake, "crashing-1", {}),
+    ]
+
+    wait_started = time.monotonic()
+    with pytest.raises(ContainerFailed, match="exited with code 3") as e:
+        docker_health_check_all(started)
+
+    assert e.value.container_name == "crashing"
+    assert time.monotonic() - wait_started < 5
+
+
+def test_crashed_container_without_checks_is_noticed(fake: FakeDocker) -> None:
+    fake.crashes["crashing"] = 0
+    started = [start(fake, "crashing-1", {})]
+
+    with pytest.raises(ContainerFailed, match="exited with code 1"):
+        docker_check_running_all(started)
+
+
+def test_container_crashing_soon_after_starting_is_noticed(fake: FakeDocker) -> None:
+    fake.crashes["crashing"] = 0.3
+    started = [start(fake, "crashing-1", {}, startup_grace=2)]
+
+    wait_started = time.monotonic()
+    with pytest.raises(ContainerFailed, match="exited with code 1"):
+        docker_check_running_all(started, wait_started)
+
+    # noticed from its die event, without waiting out the grace period
+    assert time.monotonic() - wait_started < 1.5
+
+
+def test_containers_which_keep_running_wait_out_the_grace_period(
+    fake: FakeDocker,
+) -> None:
+    started = [start(fake, "svc-1", {}, startup_grace=0.3)]
+
+    wait_started = time.monotonic()
+    docker_check_running_all(started, wait_started)
+    assert time.monotonic() - wait_started >= 0.3
@@ -17,6 +17,7 @@ python tox_docker/tests/capture_containers_and_volumes.py .
 tox -e integration
 python tox_docker/tests/assert_containers_and_volumes_unchanged.py .
 
+tox -e fake-docker
 tox -e mypy
 
 echo "testing health check failure handling, an ERROR is expected:"
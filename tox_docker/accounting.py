@@ -0,0 +1,210 @@
+from logging import getLogger
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import urlparse
+import re
+import threading
+
+from tox_docker.report import format_table
+
+# upper bounds of the latency histogram's buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+API_VERSION_PREFIX = re.compile(r"^/v[0-9.]+(?=/)")
+
+# path segments which are part of an endpoint, rather than an object's ID
+# or name, when they follow the resource type (eg /containers/json)
+COLLECTION_ACTIONS = {"create", "json", "prune", "search", "load", "get"}
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """
+    Name the API endpoint a request was made to, eg "GET /containers/{id}/json"
+
+    IDs and names are replaced by placeholders, so that calls to the same
+    endpoint for different objects are counted together.
+
+    """
+    path = API_VERSION_PREFIX.sub("", urlparse(url).path)
+    parts = path.strip("/").split("/")
+    if len(parts) > 1 and parts[1] not in COLLECTION_ACTIONS:
+        if parts[0] == "images":
+            # image names may contain slashes
+            parts = parts[:1] + ["{name}"] + parts[2:][-1:]
+        else:
+            parts[1] = "{id}"
+        if len(parts) > 3 and parts[2] == "checkpoints":
+            parts[3] = "{name}"
+    return f"{method} /{'/'.join(parts)}"
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # counts per bucket of LATENCY_BUCKETS, plus one for slower calls
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(
+        self, seconds: float, bytes_sent: int, bytes_received: int, error: bool
+    ) -> None:
+        self.calls += 1
+        self.errors += error
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+
+class ApiCall(NamedTuple):
+    endpoint: str
+    seconds: float
+    bytes_sent: int
+    bytes_received: int
+    error: bool
+
+
+class ApiCallStats:
+    """
+    Counts the docker API calls tox-docker makes, and how long they take
+
+    Calls are counted per endpoint, from every thread and testenv in the
+    tox session. The latency of a call is the time until the response's
+    headers arrived, so for streaming calls (pulls, events, logs) it doesn't
+    include the time spent streaming, and their bytes received are only
+    counted if the daemon said up front how many there would be.
+
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.budget: Optional[int] = None
+        self.budget_exceeded = False
+
+    @property
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(stats.calls for stats in self.endpoints.values())
+
+    def record(self, call: ApiCall) -> None:
+        with self._lock:
+            stats = self.endpoints.setdefault(call.endpoint, EndpointStats())
+            stats.record(call.seconds, call.bytes_sent, call.bytes_received, call.error)
+            total = sum(s.calls for s in self.endpoints.values())
+            exceeded = self.budget is not None and total > self.budget
+            warn, self.budget_exceeded = (
+                exceeded and not self.budget_exceeded,
+                self.budget_exceeded or exceeded,
+            )
+        if warn:
+            getLogger().warning(
+                f"docker> more than {self.budget} docker API calls made "
+                "(see --docker-api-budget)"
+            )
+
+    def record_response(self, response: Any, *args: Any, **kwargs: Any) -> None:
+        """
+        Record an API call; a `requests` response hook
+        """
+        request = response.request
+        body = request.body or b""
+        self.record(
+            ApiCall(
+                endpoint=endpoint_name(request.method, request.url),
+                seconds=response.elapsed.total_seconds(),
+                bytes_sent=len(body),
+                bytes_received=int(response.headers.get("Content-Length") or 0),
+                error=response.status_code >= 400,
+            )
+        )
+
+    def summary(self) -> List[str]:
+        """
+        Format the calls per endpoint as a table, busiest endpoints first
+        """
+        with self._lock:
+            endpoints = sorted(
+                self.endpoints.items(), key=lambda item: (-item[1].calls, item[0])
+            )
+        if not endpoints:
+            return []
+
+        header = ["endpoint", "calls", "errors", "total", "max", "sent", "received"]
+        rows = [
+            [
+                endpoint,
+                str(stats.calls),
+                str(stats.errors),
+                f"{stats.seconds:.2f}s",
+                f"{stats.max_seconds:.3f}s",
+                str(stats.bytes_sent),
+                str(stats.bytes_received),
+            ]
+            for endpoint, stats in endpoints
+        ]
+        return format_table(header, rows)
+
+    def metrics(self, openmetrics: bool = False) -> str:
+        """
+        Format the calls as Prometheus text exposition format, or OpenMetrics
+        """
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+
+        lines = []
+        counters = [
+            ("tox_docker_api_calls", "Docker API calls made", "calls"),
+            ("tox_docker_api_errors", "Docker API calls which failed", "errors"),
+            ("tox_docker_api_sent_bytes", "Bytes sent to the Docker API", "bytes_sent"),
+            (
+                "tox_docker_api_received_bytes",
+                "Bytes received from the Docker API",
+                "bytes_received",
+            ),
+        ]
+        for name, help, attr in counters:
+            family = name if openmetrics else f"{name}_total"
+            lines.append(f"# HELP {family} {help}.")
+            lines.append(f"# TYPE {family} counter")
+            for endpoint, stats in endpoints:
+                labels = metric_labels(endpoint)
+                lines.append(f"{name}_total{{{labels}}} {getattr(stats, attr)}")
+
+        name = "tox_docker_api_call_duration_seconds"
+        lines.append(f"# HELP {name} Time until the Docker API responded.")
+        lines.append(f"# TYPE {name} histogram")
+        for endpoint, stats in endpoints:
+            labels = metric_labels(endpoint)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (None,), stats.buckets):
+                cumulative += count
+                le = "+Inf" if bound is None else repr(bound)
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {stats.seconds}")
+            lines.append(f"{name}_count{{{labels}}} {stats.calls}")
+
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path: str, openmetrics: bool = False) -> None:
+        with open(path, "w") as fp:
+            fp.write(self.metrics(openmetrics))
+
+
+def metric_labels(endpoint: str) -> str:
+    method, _, path = endpoint.partition(" ")
+    return f'method="{method}",endpoint="{path}"'
+
+
+api_calls = ApiCallStats()
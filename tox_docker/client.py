@@ -0,0 +1,62 @@
+from typing import Any, Dict, Optional
+import threading
+
+from docker import DockerClient
+from docker.utils import kwargs_from_env
+import docker as docker_module
+
+from tox_docker.accounting import api_calls
+
+_clients: Dict[str, DockerClient] = {}
+_client_lock = threading.Lock()
+_client_options: Dict[str, Any] = {}
+
+
+def configure_docker_client(
+    max_pool_size: Optional[int] = None, api_budget: Optional[int] = None
+) -> None:
+    """
+    Set options for the shared client; only effective before it's created
+    """
+    if max_pool_size:
+        _client_options["max_pool_size"] = max_pool_size
+    api_calls.budget = api_budget or None
+
+
+def get_docker_client(docker_host: str = "") -> DockerClient:
+    """
+    Return the docker client shared by the whole tox session
+
+    The client is created on first use, so we negotiate the API version with
+    the daemon once rather than for every docker operation, and its HTTP
+    connections are pooled and reused. It is shared by all the threads used
+    by tox-docker and by `tox -p`; the plugin closes it when the session
+    ends. Every API call made with it is counted in `api_calls`.
+
+    There is one such client per `docker_host` (a URL like
+    tcp://build2:2376); the default, "", is the daemon configured by the
+    DOCKER_HOST environment variable. TCP hosts use the TLS settings of
+    DOCKER_TLS_VERIFY and DOCKER_CERT_PATH, as DOCKER_HOST would.
+
+    """
+    with _client_lock:
+        client = _clients.get(docker_host)
+        if client is None:
+            if docker_host:
+                options = dict(_client_options)
+                tls = kwargs_from_env().get("tls")
+                if tls and docker_host.startswith("tcp://"):
+                    options["tls"] = tls
+                client = DockerClient(base_url=docker_host, version="auto", **options)
+            else:
+                client = docker_module.from_env(version="auto", **_client_options)
+            client.api.hooks["response"].append(api_calls.record_response)
+            _clients[docker_host] = client
+        return client
+
+
+def close_docker_client() -> None:
+    with _client_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
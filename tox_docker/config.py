@@ -1,12 +1,17 @@
 from pathlib import Path
-from typing import Collection, Dict, List, Mapping, Optional
+from typing import Any, Collection, Dict, List, Mapping, Optional, Pattern
+import copy
+import hashlib
+import json
 import os
 import os.path
 import re
+import threading
 
 from docker.models.containers import Container as DockerContainer
 from docker.models.images import Image as DockerImage
 from docker.types import Mount
+from docker.types import Ulimit as DockerUlimit
 from tox.config.sets import ConfigSet
 
 # nanoseconds in a second; named "SECOND" so that "1.5 * SECOND" makes sense
@@ -27,6 +32,20 @@ IMAGE_NAME = re.compile(
 
 ENV_VAR = re.compile("[A-Z0-9_]+")
 
+# as accepted by docker volume create
+VOLUME_NAME = re.compile("^[a-zA-Z0-9][a-zA-Z0-9_.-]+$")
+
+# a number of bytes, as docker accepts for memory and tmpfs sizes
+BYTES_SIZE = re.compile("^[0-9]+[bkmgBKMG]?$")
+
+CPUSET = re.compile("^[0-9]+(-[0-9]+)?(,[0-9]+(-[0-9]+)?)*$")
+
+PULL_POLICIES = ("always", "if-not-present", "never")
+
+# how to choose between docker_hosts: the host with the fewest running
+# containers, or the one with the most memory not reserved by mem_limit
+PLACEMENTS = ("containers", "memory")
+
 
 def runas_name(container_name: str, pid: Optional[int] = None) -> str:
     """
@@ -42,6 +61,8 @@ def runas_name(container_name: str, pid: Optional[int] = None) -> str:
 
 
 class Image:
+    __slots__ = ("name", "tag")
+
     def __init__(self, config_line: str) -> None:
         match = IMAGE_NAME.match(config_line)
         if not match:
@@ -58,6 +79,8 @@ class Image:
 
 
 class Dockerfile:
+    __slots__ = ("path", "directory", "filename")
+
     def __init__(self, config_line: str) -> None:
         self.path = Path(config_line)
         self.directory = str(self.path.parent)
@@ -68,6 +91,8 @@ class Dockerfile:
 
 
 class ExposedPort:
+    __slots__ = ("env_var", "container_port", "protocol")
+
     def __init__(self, config_line: str) -> None:
         env_var, _, container_port_proto = config_line.partition("=")
         container_port, _, protocol = container_port_proto.partition("/")
@@ -89,6 +114,8 @@ class ExposedPort:
 
 
 class HostVar:
+    __slots__ = ("host_var",)
+
     def __init__(self, config_line: str) -> None:
         if not ENV_VAR.match(config_line):
             raise ValueError(f"{config_line!r} is not a valid environment variable")
@@ -102,12 +129,15 @@ class HostVar:
 
 
 class Link:
+    __slots__ = ("name", "target", "alias")
+
     def __init__(self, config_line: str) -> None:
         target, sep, alias = config_line.partition(":")
 
         if sep and not alias:
             raise ValueError(f"Link '{target}:' missing alias")
 
+        self.name = target
         self.target = runas_name(target)
 
         # this is what the target will be known as INSIDE the
@@ -116,12 +146,26 @@ class Link:
 
 
 class Volume:
+    __slots__ = ("docker_mount",)
+
     def __init__(self, config_line: str) -> None:
+        volume_type = config_line.split(":", 1)[0]
+        if volume_type == "bind":
+            self.docker_mount = self._parse_bind(config_line)
+        elif volume_type == "volume":
+            self.docker_mount = self._parse_named(config_line)
+        elif volume_type == "tmpfs":
+            self.docker_mount = self._parse_tmpfs(config_line)
+        else:
+            raise ValueError(
+                f"Volume {config_line!r} type must be 'bind:', 'volume:' or 'tmpfs:'"
+            )
+
+    @staticmethod
+    def _parse_bind(config_line: str) -> Mount:
         parts = config_line.split(":")
         if len(parts) != 4:
             raise ValueError(f"Volume {config_line!r} is malformed")
-        if parts[0] != "bind":
-            raise ValueError(f"Volume {config_line!r} type must be 'bind:'")
         if parts[1] not in ("ro", "rw"):
             raise ValueError(f"Volume {config_line!r} options must be 'ro' or 'rw'")
 
@@ -131,15 +175,184 @@ class Volume:
         if not os.path.isabs(inside):
             raise ValueError(f"Mount point {inside!r} must be an absolute path")
 
-        self.docker_mount = Mount(
+        return Mount(
             source=outside,
             target=inside,
             type=volume_type,
             read_only=bool(mode == "ro"),
         )
 
+    @staticmethod
+    def _parse_named(config_line: str) -> Mount:
+        parts = config_line.split(":")
+        if len(parts) != 4:
+            raise ValueError(f"Volume {config_line!r} is malformed")
+
+        volume_type, options, name, inside = parts
+        flags = set(options.split(","))
+        if not flags <= {"ro", "rw", "nocopy"} or {"ro", "rw"} <= flags:
+            raise ValueError(
+                f"Volume {config_line!r} options must be 'ro' or 'rw', "
+                "optionally with 'nocopy'"
+            )
+        if not VOLUME_NAME.match(name):
+            raise ValueError(f"Volume name {name!r} is not a valid volume name")
+        if not os.path.isabs(inside):
+            raise ValueError(f"Mount point {inside!r} must be an absolute path")
+
+        return Mount(
+            source=name,
+            target=inside,
+            type=volume_type,
+            read_only="ro" in flags,
+            no_copy="nocopy" in flags,
+        )
+
+    @staticmethod
+    def _parse_tmpfs(config_line: str) -> Mount:
+        parts = config_line.split(":")
+        if len(parts) != 3:
+            raise ValueError(f"Volume {config_line!r} is malformed")
+
+        volume_type, options, inside = parts
+        if not os.path.isabs(inside):
+            raise ValueError(f"Mount point {inside!r} must be an absolute path")
+
+        size: Optional[str] = None
+        mode: Optional[int] = None
+        for option in filter(None, options.split(",")):
+            key, _, value = option.partition("=")
+            if key == "size" and BYTES_SIZE.match(value):
+                size = value
+            elif key == "mode" and re.match("^[0-7]{3,4}$", value):
+                mode = int(value, 8)
+            else:
+                raise ValueError(
+                    f"Volume {config_line!r} option {option!r} is invalid; "
+                    "tmpfs options are size=<bytes>[k|m|g] and mode=<octal>"
+                )
+
+        return Mount(
+            source=None,
+            target=inside,
+            type=volume_type,
+            tmpfs_size=size,
+            tmpfs_mode=mode,
+        )
+
+
+class Ulimit:
+    __slots__ = ("docker_ulimit",)
+
+    def __init__(self, config_line: str) -> None:
+        name, sep, limits = config_line.partition("=")
+        soft, _, hard = limits.partition(":")
+        hard = hard or soft
+
+        if not sep or not re.match("^[a-z]+$", name):
+            raise ValueError(f"Ulimit {config_line!r} must be <name>=<soft>[:<hard>]")
+        if not (soft.lstrip("-").isdigit() and hard.lstrip("-").isdigit()):
+            raise ValueError(f"Ulimit {config_line!r} limits must be integers")
+
+        self.docker_ulimit = DockerUlimit(name=name, soft=int(soft), hard=int(hard))
+
+
+class ReadinessProbe:
+    __slots__ = ("kind", "config_line", "container_port", "path", "pattern")
+
+    def __init__(self, config_line: str) -> None:
+        kind, sep, spec = config_line.partition(":")
+        if not sep or kind not in ("tcp", "udp", "http", "log"):
+            raise ValueError(
+                f"Readiness probe {config_line!r} must start with "
+                "tcp:, udp:, http: or log:"
+            )
+
+        self.kind = kind
+        self.config_line = config_line
+        self.container_port = ""
+        self.path = ""
+        self.pattern: Optional[Pattern[str]] = None
+
+        if kind == "log":
+            if not spec:
+                raise ValueError(f"Readiness probe {config_line!r} missing pattern")
+            try:
+                self.pattern = re.compile(spec)
+            except re.error as e:
+                raise ValueError(f"Readiness probe {config_line!r}: {e}")
+        else:
+            port, slash, path = spec.partition("/")
+            if not port.isdigit():
+                raise ValueError("readiness probe port must be an int")
+            if slash and kind != "http":
+                raise ValueError(f"Readiness probe {config_line!r} can't have a path")
+            self.container_port = port
+            self.path = f"/{path}"
+
+    @property
+    def container_port_proto(self) -> str:
+        protocol = "udp" if self.kind == "udp" else "tcp"
+        return f"{self.container_port}/{protocol}"
+
+    def __str__(self) -> str:
+        return self.config_line
+
+    def __repr__(self) -> str:
+        return repr(str(self))
+
 
 class ContainerConfig:
+    __slots__ = (
+        "name",
+        "runas_name",
+        "image",
+        "dockerfile",
+        "dockerfile_target",
+        "dockerfile_pull",
+        "stop",
+        "stop_timeout",
+        "reuse",
+        "scope",
+        "pull_stall_timeout",
+        "pull_retries",
+        "pull_policy",
+        "environment",
+        "expose",
+        "publish",
+        "host_var",
+        "links",
+        "mounts",
+        "healthcheck_cmd",
+        "healthcheck_interval",
+        "healthcheck_timeout",
+        "healthcheck_start_period",
+        "healthcheck_retries",
+        "ready_probes",
+        "ready_timeout",
+        "startup_grace",
+        "mem_limit",
+        "cpus",
+        "cpu_shares",
+        "cpuset_cpus",
+        "shm_size",
+        "ulimits",
+        "init_commands",
+        "snapshot",
+        "checkpoint",
+        "checkpoint_dir",
+        "docker_hosts",
+        "placement",
+        "config_hash",
+        "docker_host",
+        "pool_leases_dir",
+        "runnable_image",
+        "image_listed",
+        "created",
+        "from_snapshot",
+        "restored",
+    )
+
     def __init__(
         self,
         name: str,
@@ -157,15 +370,46 @@ class ContainerConfig:
         host_var: Optional[HostVar] = None,
         links: Optional[Collection[Link]] = None,
         volumes: Optional[Collection[Volume]] = None,
+        reuse: bool = False,
+        dockerfile_pull: bool = True,
+        pull_stall_timeout: float = 120,
+        pull_retries: int = 3,
+        scope: str = "env",
+        stop_timeout: float = 0,
+        ready_probes: Optional[Collection[ReadinessProbe]] = None,
+        ready_timeout: float = 60,
+        startup_grace: float = 0.5,
+        publish: bool = True,
+        pull_policy: str = "if-not-present",
+        mem_limit: str = "",
+        cpus: float = 0,
+        cpu_shares: int = 0,
+        cpuset_cpus: str = "",
+        shm_size: str = "",
+        ulimits: Optional[Collection[Ulimit]] = None,
+        init_commands: Optional[Collection[str]] = None,
+        snapshot: bool = False,
+        checkpoint: bool = False,
+        checkpoint_dir: str = "",
+        docker_hosts: Optional[Collection[str]] = None,
+        placement: str = "containers",
     ) -> None:
         self.name = name
         self.runas_name = runas_name(name)
         self.image = image
         self.dockerfile = dockerfile
         self.dockerfile_target = dockerfile_target
+        self.dockerfile_pull = dockerfile_pull
         self.stop = stop
+        self.stop_timeout = stop_timeout
+        self.reuse = reuse
+        self.scope = scope
+        self.pull_stall_timeout = pull_stall_timeout
+        self.pull_retries = pull_retries
+        self.pull_policy = pull_policy
         self.environment: Mapping[str, str] = environment or {}
         self.expose: Collection[ExposedPort] = expose or []
+        self.publish = publish
         self.host_var = str(host_var) if host_var else ""
         self.links: Collection[Link] = links or []
         self.mounts: Collection[Mount] = [v.docker_mount for v in volumes or ()]
@@ -182,7 +426,47 @@ class ContainerConfig:
         )
         self.healthcheck_retries = healthcheck_retries
 
+        self.ready_probes: Collection[ReadinessProbe] = ready_probes or []
+        self.ready_timeout = ready_timeout
+        self.startup_grace = startup_grace
+
+        self.mem_limit = mem_limit
+        self.cpus = cpus
+        self.cpu_shares = cpu_shares
+        self.cpuset_cpus = cpuset_cpus
+        self.shm_size = shm_size
+        self.ulimits: Collection[DockerUlimit] = [
+            u.docker_ulimit for u in ulimits or ()
+        ]
+
+        self.init_commands: Collection[str] = init_commands or []
+        self.snapshot = snapshot
+        self.checkpoint = checkpoint
+        self.checkpoint_dir = checkpoint_dir
+
+        self.docker_hosts: Collection[str] = docker_hosts or []
+        self.placement = placement
+
+        # digest of the container's settings; see config_digest()
+        self.config_hash = ""
+        # the docker daemon the container is placed on; "" is the default
+        # one, from DOCKER_HOST
+        self.docker_host = ""
+        # where this run keeps leases on pooled containers, with reuse; see
+        # PoolLeases
+        self.pool_leases_dir = ""
+
         self.runnable_image: Optional[DockerImage] = None
+        # whether the docker host's image list has been searched for the
+        # image, in which case runnable_image is set if it was there
+        self.image_listed = False
+        # set once the container is started: whether this run created it (as
+        # opposed to adopting or sharing it), whether it was created from a
+        # snapshot of an already-initialized container, and whether it was
+        # restored from a checkpoint of an already-running one
+        self.created = False
+        self.from_snapshot = False
+        self.restored = False
 
 
 class MissingRequiredSetting(Exception):
@@ -216,6 +500,24 @@ class DockerConfigSet(ConfigSet):
             default="",
             desc="Dockerfile target to build/run",
         )
+        self.add_config(
+            keys=["pull_policy"],
+            of_type=str,
+            default="if-not-present",
+            desc="when to pull the image: always, if-not-present, or never",
+        )
+        self.add_config(
+            keys=["dockerfile_pull"],
+            of_type=bool,
+            default=True,
+            desc="always pull newer versions of the Dockerfile's base images",
+        )
+        self.add_config(
+            keys=["scope"],
+            of_type=str,
+            default="env",
+            desc="share the container between testenvs (session) or not (env)",
+        )
         self.add_config(
             keys=["environment"],
             of_type=Dict[str, str],
@@ -228,6 +530,12 @@ class DockerConfigSet(ConfigSet):
             default=[],
             desc="container ports to expose to the testenv",
         )
+        self.add_config(
+            keys=["publish"],
+            of_type=bool,
+            default=True,
+            desc="publish the container's ports to the host",
+        )
         self.add_config(
             keys=["host_var"],
             of_type=Optional[HostVar],
@@ -281,8 +589,157 @@ class DockerConfigSet(ConfigSet):
             desc="docker healthcheck retry count",
         )
 
+        self.add_config(
+            keys=["ready_probes"],
+            of_type=List[ReadinessProbe],
+            default=[],
+            desc="host-side probes which must succeed before the container is ready",
+        )
+        self.add_config(
+            keys=["ready_timeout"],
+            of_type=float,
+            default=60,
+            desc="seconds to wait for all readiness probes to succeed",
+        )
+        self.add_config(
+            keys=["startup_grace"],
+            of_type=float,
+            default=0.5,
+            desc="seconds the container must keep running after it starts",
+        )
+
+        self.add_config(
+            keys=["mem_limit"],
+            of_type=str,
+            default="",
+            desc="memory limit of the container, eg 512m",
+        )
+        self.add_config(
+            keys=["cpus"],
+            of_type=float,
+            default=0,
+            desc="number of CPUs the container may use",
+        )
+        self.add_config(
+            keys=["cpu_shares"],
+            of_type=int,
+            default=0,
+            desc="relative CPU weight of the container",
+        )
+        self.add_config(
+            keys=["cpuset_cpus"],
+            of_type=str,
+            default="",
+            desc="CPUs the container may run on, eg 0-3 or 1,3",
+        )
+        self.add_config(
+            keys=["shm_size"],
+            of_type=str,
+            default="",
+            desc="size of the container's /dev/shm, eg 256m",
+        )
+        self.add_config(
+            keys=["ulimits"],
+            of_type=List[Ulimit],
+            default=[],
+            desc="ulimits of the container, as name=soft[:hard]",
+        )
+
+        self.add_config(
+            keys=["init_commands"],
+            of_type=List[str],
+            default=[],
+            desc="commands to run in the container once it is healthy",
+        )
+        self.add_config(
+            keys=["snapshot"],
+            of_type=bool,
+            default=False,
+            desc="snapshot the initialized container, and start from it next time",
+        )
+        self.add_config(
+            keys=["checkpoint"],
+            of_type=bool,
+            default=False,
+            desc="checkpoint the running container, and restore it next time",
+        )
+
+        self.add_config(
+            keys=["docker_hosts"],
+            of_type=List[str],
+            default=[],
+            desc="docker daemons to run the container on, chosen by load",
+        )
+        self.add_config(
+            keys=["placement"],
+            of_type=str,
+            default="",
+            desc="choose the docker host with the fewest containers or most memory",
+        )
+
+
+# containers already parsed this session, by config_digest()
+_parsed_configs: Dict[str, ContainerConfig] = {}
+_parsed_configs_lock = threading.Lock()
+
+
+def config_digest(docker_config: DockerConfigSet) -> str:
+    """
+    Digest the settings of a container, as written in its [docker:name]
+
+    That's the section's raw settings, before any substitutions, and the
+    command line options which are part of a ContainerConfig.
+
+    """
+    raw: Dict[str, Any] = {}
+    for loader in docker_config.loaders:
+        for key in sorted(loader.found_keys()):
+            if key not in raw:
+                raw[key] = loader.load_raw(key, docker_config._conf, None)
+
+    options = docker_config._conf.options
+    content = json.dumps(
+        {
+            "name": docker_config.name,
+            "settings": raw,
+            "options": [
+                docker_config.name in options.docker_dont_stop,
+                options.docker_stop_timeout,
+                options.docker_reuse,
+                options.docker_pull_stall_timeout,
+                options.docker_pull_retries,
+                options.docker_host,
+                options.docker_placement,
+                options.docker_checkpoint_dir,
+            ],
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
 
 def parse_container_config(docker_config: DockerConfigSet) -> ContainerConfig:
+    """
+    Return a ContainerConfig for the [docker:name] section `docker_config`
+
+    Each distinct configuration is only parsed and validated once per
+    session, however many testenvs use it; every caller gets its own copy,
+    since each testenv records its own state (its image, docker host, and
+    so on) on the config as it starts the container.
+
+    """
+    digest = config_digest(docker_config)
+    with _parsed_configs_lock:
+        parsed = _parsed_configs.get(digest)
+    if parsed is None:
+        parsed = _parse_container_config(docker_config)
+        parsed.config_hash = digest
+        with _parsed_configs_lock:
+            parsed = _parsed_configs.setdefault(digest, parsed)
+    return copy.copy(parsed)
+
+
+def _check_image(docker_config: DockerConfigSet) -> None:
     if docker_config["image"] and docker_config["dockerfile"]:
         raise ValueError(f"{docker_config.name}: specify image or dockerfile, not both")
     elif not docker_config["image"] and not docker_config["dockerfile"]:
@@ -293,19 +750,91 @@ def parse_container_config(docker_config: DockerConfigSet) -> ContainerConfig:
             f"{docker_config.name}: dockerfile_target specified, but no dockerfile"
         )
 
+    if docker_config["pull_policy"] not in PULL_POLICIES:
+        policies = ", ".join(repr(p) for p in PULL_POLICIES)
+        raise ValueError(f"{docker_config.name}: pull_policy must be one of {policies}")
+
+
+def _check_publish(docker_config: DockerConfigSet) -> None:
+    if not docker_config["publish"]:
+        if docker_config["expose"]:
+            raise ValueError(f"{docker_config.name}: expose requires publish = true")
+        if any(probe.kind != "log" for probe in docker_config["ready_probes"]):
+            raise ValueError(
+                f"{docker_config.name}: port readiness probes require publish = true"
+            )
+
+
+def _check_resources(docker_config: DockerConfigSet) -> None:
+    for key in ("mem_limit", "shm_size"):
+        if docker_config[key] and not BYTES_SIZE.match(docker_config[key]):
+            raise ValueError(
+                f"{docker_config.name}: {key} must be a number of bytes, eg 512m"
+            )
+    if docker_config["cpuset_cpus"] and not CPUSET.match(docker_config["cpuset_cpus"]):
+        raise ValueError(
+            f"{docker_config.name}: cpuset_cpus must be a list of CPUs, eg 0-3 or 1,3"
+        )
+    if docker_config["cpus"] < 0 or docker_config["cpu_shares"] < 0:
+        raise ValueError(f"{docker_config.name}: cpus and cpu_shares must be positive")
+
+
+def _resolve_placement(docker_config: DockerConfigSet) -> str:
+    placement = (
+        docker_config["placement"] or docker_config._conf.options.docker_placement
+    )
+    if placement not in PLACEMENTS:
+        placements = ", ".join(repr(p) for p in PLACEMENTS)
+        raise ValueError(f"{docker_config.name}: placement must be one of {placements}")
+    return placement
+
+
+def _parse_container_config(docker_config: DockerConfigSet) -> ContainerConfig:
+    _check_image(docker_config)
+    _check_publish(docker_config)
+    if docker_config["scope"] not in ("env", "session"):
+        raise ValueError(f"{docker_config.name}: scope must be 'env' or 'session'")
+    _check_resources(docker_config)
+    placement = _resolve_placement(docker_config)
+
     return ContainerConfig(
         name=docker_config.name,
         image=docker_config["image"],
         dockerfile=docker_config["dockerfile"],
         dockerfile_target=docker_config["dockerfile_target"],
+        dockerfile_pull=docker_config["dockerfile_pull"],
+        scope=docker_config["scope"],
         stop=docker_config.name not in docker_config._conf.options.docker_dont_stop,
+        stop_timeout=docker_config._conf.options.docker_stop_timeout,
+        reuse=docker_config._conf.options.docker_reuse,
+        pull_stall_timeout=docker_config._conf.options.docker_pull_stall_timeout,
+        pull_retries=docker_config._conf.options.docker_pull_retries,
+        pull_policy=docker_config["pull_policy"],
         environment=docker_config["environment"],
         healthcheck_cmd=docker_config["healthcheck_cmd"],
         healthcheck_interval=docker_config["healthcheck_interval"],
         healthcheck_timeout=docker_config["healthcheck_timeout"],
         healthcheck_start_period=docker_config["healthcheck_start_period"],
         healthcheck_retries=docker_config["healthcheck_retries"],
+        ready_probes=docker_config["ready_probes"],
+        ready_timeout=docker_config["ready_timeout"],
+        startup_grace=docker_config["startup_grace"],
+        mem_limit=docker_config["mem_limit"],
+        cpus=docker_config["cpus"],
+        cpu_shares=docker_config["cpu_shares"],
+        cpuset_cpus=docker_config["cpuset_cpus"],
+        shm_size=docker_config["shm_size"],
+        ulimits=docker_config["ulimits"],
+        init_commands=docker_config["init_commands"],
+        snapshot=docker_config["snapshot"],
+        checkpoint=docker_config["checkpoint"],
+        checkpoint_dir=docker_config._conf.options.docker_checkpoint_dir,
+        docker_hosts=(
+            docker_config["docker_hosts"] or docker_config._conf.options.docker_host
+        ),
+        placement=placement,
         expose=docker_config["expose"],
+        publish=docker_config["publish"],
         host_var=docker_config["host_var"],
         links=docker_config["links"],
         volumes=docker_config["volumes"],
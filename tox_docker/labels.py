@@ -0,0 +1,143 @@
+from typing import Dict, Mapping
+import os
+import socket
+import sys
+import uuid
+
+from tox_docker.config import ContainerConfig
+
+# labels on every container and network tox-docker creates, identifying the
+# tox process which created it
+SESSION_LABEL = "tox-docker.session"
+PID_LABEL = "tox-docker.pid"
+HOST_LABEL = "tox-docker.host"
+# ... which pid namespace (since which boot) the pid belongs to, and when the
+# process started, so the pid can't be mistaken for another process's
+PID_NAMESPACE_LABEL = "tox-docker.pid-namespace"
+PID_START_LABEL = "tox-docker.pid-start"
+# ... and, on containers, what it was created for
+ENV_LABEL = "tox-docker.env"
+NAME_LABEL = "tox-docker.name"
+CONFIG_HASH_LABEL = "tox-docker.config-hash"
+# containers left running on purpose, with --docker-dont-stop
+DONT_STOP_LABEL = "tox-docker.dont-stop"
+# labels which mark a container as belonging to the pool of reusable
+# containers, identify the configuration it was started with, and where
+# its leases are kept (see PoolLeases)
+POOL_LABEL = "tox-docker.pool"
+POOL_HASH_LABEL = "tox-docker.pool.hash"
+POOL_LEASES_LABEL = "tox-docker.pool.leases"
+
+# identifies this tox process's containers, even if its pid is reused later
+SESSION_ID = uuid.uuid4().hex
+
+
+def get_pid_namespace() -> str:
+    """
+    Identify the pid namespace we're in, and the boot it's from
+
+    Processes on the same host (by name) can be in different pid namespaces,
+    eg in job containers or pods sharing the host's UTS namespace; there,
+    the same pid means a different process. This is "" where there are no
+    pid namespaces, or they can't be told apart.
+
+    """
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as fp:
+            boot_id = fp.read().strip()
+        return f"{boot_id}/{os.readlink('/proc/self/ns/pid')}"
+    except OSError:
+        return ""
+
+
+PID_NAMESPACE = get_pid_namespace()
+
+
+def process_start_time(pid: int) -> str:
+    # in clock ticks since boot; "" if unknown
+    try:
+        with open(f"/proc/{pid}/stat") as fp:
+            stat = fp.read()
+    except OSError:
+        return ""
+    # starttime is the 22nd field, counting the command name (in parentheses,
+    # and possibly containing spaces) as the 2nd
+    fields = stat.rpartition(")")[2].split()
+    return fields[19] if len(fields) > 19 else ""
+
+
+def owner_labels() -> Dict[str, str]:
+    labels = {
+        SESSION_LABEL: SESSION_ID,
+        PID_LABEL: str(os.getpid()),
+        HOST_LABEL: socket.gethostname(),
+        PID_NAMESPACE_LABEL: PID_NAMESPACE,
+    }
+    started = process_start_time(os.getpid())
+    if started:
+        labels[PID_START_LABEL] = started
+    return labels
+
+
+def container_labels(
+    container_config: ContainerConfig, env_name: str
+) -> Dict[str, str]:
+    labels = owner_labels()
+    labels[ENV_LABEL] = env_name
+    labels[NAME_LABEL] = container_config.name
+    labels[CONFIG_HASH_LABEL] = container_config.config_hash
+    if not container_config.stop:
+        labels[DONT_STOP_LABEL] = "1"
+    return labels
+
+
+def is_running(pid: int) -> bool:
+    if sys.platform == "win32":
+        # os.kill() can't probe a process on Windows (it would terminate it),
+        # so assume the owner is still running
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running, as another user
+        return True
+    return True
+
+
+def is_orphaned(labels: Mapping[str, str], force: bool = False) -> bool:
+    """
+    Return whether a container (or network) was left behind by a dead process
+
+    That's one labelled with the pid of a tox process (on this host, and in
+    our pid namespace) which is no longer running, or whose pid has since
+    been reused by a process which started later. Pooled containers, for
+    --docker-reuse, are never orphaned.
+
+    Unless `force` is set, this errs on the side of keeping things: a tox
+    process in another pid namespace (or which predates the namespace
+    label) might still be running, and containers left running with
+    --docker-dont-stop are meant to stay.
+
+    """
+    if POOL_LABEL in labels:
+        return False
+    if DONT_STOP_LABEL in labels and not force:
+        return False
+    if labels.get(HOST_LABEL) != socket.gethostname():
+        return False
+    pid = labels.get(PID_LABEL, "")
+    if not pid.isdigit():
+        return False
+    same_namespace = labels.get(PID_NAMESPACE_LABEL) == PID_NAMESPACE
+    if not (same_namespace or force):
+        return False
+    if not is_running(int(pid)):
+        return True
+    # it's running, but that may be another process which has since been
+    # given the pid
+    started = labels.get(PID_START_LABEL, "")
+    if not (same_namespace and started):
+        return False
+    return process_start_time(int(pid)) not in ("", started)
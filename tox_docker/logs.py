@@ -0,0 +1,123 @@
+from collections import deque
+from pathlib import Path
+from typing import Any, BinaryIO, Deque, List, Optional
+import threading
+
+from docker.models.containers import Container
+
+# number of rotated log files kept, as <name>.log.1 ... <name>.log.N
+LOG_BACKUPS = 2
+
+# longest partial line kept for the tail, so output without newlines (eg a
+# progress bar) can't grow it without bound
+MAX_LINE_BYTES = 64 * 1024
+
+
+class ContainerLog:
+    """
+    Streams a container's output into a size-capped, rotating log file
+
+    The logs are followed on a background thread for as long as the
+    container runs, so the test commands never wait on them. When the file
+    reaches `max_bytes`, it is rotated; at most LOG_BACKUPS old files are
+    kept. The last `tail_lines` lines are also kept in memory, to show when
+    the container fails.
+
+    """
+
+    def __init__(
+        self,
+        container: Container,
+        path: Path,
+        max_bytes: int,
+        tail_lines: int,
+        since: Optional[int] = None,
+    ) -> None:
+        self.container = container
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.since = since
+        self._lines: Deque[bytes] = deque(maxlen=max(tail_lines, 0))
+        self._partial = b""
+        self._lock = threading.Lock()
+        self._stream: Any = None
+        self._closing = False
+        self._thread = threading.Thread(target=self._follow, daemon=True)
+
+    def start(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread.start()
+
+    def tail(self) -> List[str]:
+        with self._lock:
+            lines = list(self._lines)
+            if self._partial:
+                lines.append(self._partial)
+        keep = self._lines.maxlen or 0
+        lines = lines[-keep:] if keep else []
+        return [line.decode("utf-8", "replace") for line in lines]
+
+    def close(self, timeout: float = 0) -> None:
+        """
+        Stop following the logs, and wait for the file to be written
+
+        A removed container's log stream ends by itself once the rest of its
+        output has been read, so give it up to `timeout` seconds to do so
+        before closing the stream; for containers left running, there's no
+        point waiting.
+
+        """
+        self._thread.join(timeout)
+        with self._lock:
+            self._closing = True
+            stream = self._stream
+        if self._thread.is_alive() and stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+        self._thread.join(1.0)
+
+    def _follow(self) -> None:
+        fp: BinaryIO = open(self.path, "ab")
+        size = fp.tell()
+        try:
+            stream = self.container.logs(stream=True, follow=True, since=self.since)
+            with self._lock:
+                self._stream = stream
+                if self._closing:
+                    stream.close()
+            for chunk in stream:
+                if size and size + len(chunk) > self.max_bytes:
+                    fp = self._rotate(fp)
+                    size = 0
+                fp.write(chunk)
+                size += len(chunk)
+                self._remember(chunk)
+        except Exception:
+            # the stream ends with an error when we close it, or when the
+            # container is removed out from under it; either way we're done
+            pass
+        finally:
+            fp.close()
+
+    def _rotate(self, fp: BinaryIO) -> BinaryIO:
+        fp.close()
+        for i in range(LOG_BACKUPS - 1, 0, -1):
+            backup = self.backup_path(i)
+            if backup.exists():
+                backup.replace(self.backup_path(i + 1))
+        self.path.replace(self.backup_path(1))
+        return open(self.path, "ab")
+
+    def backup_path(self, i: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{i}")
+
+    def _remember(self, chunk: bytes) -> None:
+        with self._lock:
+            *lines, partial = (self._partial + chunk).split(b"\n")
+            self._lines.extend(lines)
+            if len(partial) > MAX_LINE_BYTES:
+                self._lines.append(partial)
+                partial = b""
+            self._partial = partial
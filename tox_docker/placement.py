@@ -0,0 +1,150 @@
+from typing import Dict, List, Sequence, Tuple
+from urllib.parse import urlparse
+import threading
+
+from docker.utils import parse_bytes
+
+from tox_docker.client import get_docker_client
+from tox_docker.config import ContainerConfig
+
+# memory limits of the containers placed on each docker host and not yet
+# removed, across all testenvs in the session
+_reserved_memory: Dict[str, int] = {}
+_placement_lock = threading.Lock()
+
+
+def host_address(docker_host: str) -> str:
+    """
+    Return the address at which a docker host's published ports are reached
+
+    That's the host name from a tcp://, http(s):// or ssh:// URL; for the
+    default daemon (from DOCKER_HOST), and daemons reached over a local
+    socket, it's "", meaning the usual gateway IP lookup applies.
+
+    """
+    if not docker_host:
+        return ""
+    url = urlparse(docker_host)
+    if url.scheme in ("tcp", "http", "https", "ssh"):
+        return url.hostname or ""
+    return ""
+
+
+def placement_groups(
+    container_configs: Sequence[ContainerConfig],
+) -> List[List[ContainerConfig]]:
+    """
+    Group containers which must run on the same docker host
+
+    Containers can only reach each other over a network on one docker host,
+    so containers connected by `links` (in either direction, and
+    transitively) are placed together.
+
+    """
+    by_runas_name = {c.runas_name: c for c in container_configs}
+    group_of = {c.name: i for i, c in enumerate(container_configs)}
+
+    def merge(a: str, b: str) -> None:
+        old, new = group_of[a], group_of[b]
+        for name, group in group_of.items():
+            if group == old:
+                group_of[name] = new
+
+    for container_config in container_configs:
+        for link in container_config.links:
+            target = by_runas_name.get(link.target)
+            if target is not None:
+                merge(container_config.name, target.name)
+
+    groups: Dict[int, List[ContainerConfig]] = {}
+    for container_config in container_configs:
+        groups.setdefault(group_of[container_config.name], []).append(container_config)
+    return list(groups.values())
+
+
+def candidate_hosts(group: Sequence[ContainerConfig]) -> List[str]:
+    hosts = list(group[0].docker_hosts) or [""]
+    for container_config in group[1:]:
+        allowed = list(container_config.docker_hosts) or [""]
+        hosts = [host for host in hosts if host in allowed]
+    if not hosts:
+        names = ", ".join(repr(c.name) for c in group)
+        raise ValueError(
+            f"Containers {names} are linked, so must run on the same docker host, "
+            "but their docker_hosts have none in common"
+        )
+    return hosts
+
+
+def memory_limit(container_config: ContainerConfig) -> int:
+    return parse_bytes(container_config.mem_limit) if container_config.mem_limit else 0
+
+
+def host_load(docker_host: str, strategy: str) -> float:
+    """
+    Measure how busy a docker host is; lower is better
+
+    For the "containers" strategy, that's the number of containers running
+    on it. For "memory", it's the negated memory left after subtracting the
+    `mem_limit` of every container placed on it in this session.
+
+    """
+    info = get_docker_client(docker_host).info()
+    if strategy == "memory":
+        return -(info.get("MemTotal", 0) - _reserved_memory.get(docker_host, 0))
+    return float(info.get("ContainersRunning", 0))
+
+
+def place_containers(
+    container_configs: Sequence[ContainerConfig],
+) -> List[Tuple[List[ContainerConfig], str]]:
+    """
+    Choose the docker host each of `container_configs` will run on
+
+    Each group of linked containers goes to the least loaded of the docker
+    hosts it may use (see `host_load`), which is asked once per placement;
+    the load of containers placed earlier in the same placement is added
+    on. Session-scoped containers always go to their first docker host, so
+    that every testenv sharing them agrees on where they are. Sets each
+    config's `docker_host`, and returns the groups with their hosts.
+
+    """
+    placed: List[Tuple[List[ContainerConfig], str]] = []
+    with _placement_lock:
+        loads: Dict[Tuple[str, str], float] = {}
+        for group in placement_groups(container_configs):
+            hosts = candidate_hosts(group)
+            strategy = group[0].placement
+            if len(hosts) == 1 or any(c.scope == "session" for c in group):
+                host = hosts[0]
+            else:
+                for candidate in hosts:
+                    if (candidate, strategy) not in loads:
+                        loads[candidate, strategy] = host_load(candidate, strategy)
+                host = min(hosts, key=lambda candidate: loads[candidate, strategy])
+
+            # session-scoped containers are shared, and not released with
+            # the testenv, so only the testenv's own containers are counted
+            memory = sum(memory_limit(c) for c in group if c.scope == "env")
+            _reserved_memory[host] = _reserved_memory.get(host, 0) + memory
+            if (host, "memory") in loads:
+                loads[host, "memory"] += memory
+            if (host, "containers") in loads:
+                loads[host, "containers"] += len(group)
+
+            for container_config in group:
+                container_config.docker_host = host
+            placed.append((group, host))
+    return placed
+
+
+def release_memory(container_config: ContainerConfig) -> None:
+    """
+    Forget the memory reserved for a container which has been removed
+    """
+    memory = memory_limit(container_config)
+    if not memory or container_config.scope != "env":
+        return
+    with _placement_lock:
+        host = container_config.docker_host
+        _reserved_memory[host] = max(_reserved_memory.get(host, 0) - memory, 0)
@@ -1,35 +1,106 @@
 __all__ = (
+    "tox_add_core_config",
     "tox_add_env_config",
     "tox_add_option",
     "tox_after_run_commands",
     "tox_before_run_commands",
+    "tox_env_teardown",
+    "tox_on_install",
 )
 
+from concurrent.futures import (
+    as_completed,
+    Executor,
+    Future,
+    ThreadPoolExecutor,
+)
+from contextvars import copy_context
+from functools import partial
 from logging import getLogger
-from typing import Dict, Iterable, List, Mapping, Optional, Tuple, Union
+from pathlib import Path
+from queue import Empty, Queue
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+import atexit
+import hashlib
+import json
 import os
+import re
 import socket
 import sys
+import threading
 import time
 
-from docker.errors import ImageNotFound, NotFound
+from docker.errors import APIError, DockerException, ImageNotFound, NotFound
 from docker.models.containers import Container
+from docker.models.images import Image as DockerImage
+from docker.models.networks import Network
+from docker.utils.build import exclude_paths
+from requests.exceptions import RequestException
 from tox.config.cli.parser import ToxParser
 from tox.config.loader.section import Section
-from tox.config.sets import EnvConfigSet
+from tox.config.sets import ConfigSet, EnvConfigSet
 from tox.execute.api import Outcome
 from tox.plugin import impl
 from tox.session.state import State
 from tox.tox_env.api import ToxEnv
 from tox.tox_env.errors import Fail
-import docker as docker_module
+from tox.tox_env.runner import RunToxEnv
 
+from tox_docker.accounting import api_calls
+from tox_docker.client import (
+    close_docker_client,
+    configure_docker_client,
+    get_docker_client,
+)
 from tox_docker.config import (
     ContainerConfig,
     DockerConfigSet,
     parse_container_config,
-    RunningContainers,
+    ReadinessProbe,
+    runas_name,
+)
+from tox_docker.labels import (
+    container_labels,
+    DONT_STOP_LABEL,
+    ENV_LABEL,
+    HOST_LABEL,
+    is_orphaned,
+    NAME_LABEL,
+    owner_labels,
+    PID_LABEL,
+    POOL_HASH_LABEL,
+    POOL_LABEL,
+    POOL_LEASES_LABEL,
+    SESSION_ID,
+    SESSION_LABEL,
 )
+from tox_docker.logs import ContainerLog
+from tox_docker.placement import host_address, place_containers, release_memory
+from tox_docker.pool import (
+    LEASES_DIRNAME,
+    pool_hash,
+    pool_name,
+    PoolIndex,
+    PoolLeases,
+)
+from tox_docker.probes import http_ready, tcp_ready, udp_ready, wait_until
+from tox_docker.report import current_env, timings
 
 
 def log(line: str) -> None:
@@ -37,12 +108,18 @@ def log(line: str) -> None:
 
 
 class HealthCheckFailed(Exception):
-    pass
+    def __init__(self, message: str, container_name: str = "") -> None:
+        super().__init__(message)
+        self.container_name = container_name
 
 
-def get_gateway_ip(container: Container) -> str:
+def get_gateway_ip(container: Container, docker_host: str = "") -> str:
+    address = host_address(docker_host)
     gateway = os.getenv("TOX_DOCKER_GATEWAY")
-    if gateway:
+    if address:
+        # published ports of a remote docker host are on that host
+        ip = socket.gethostbyname(address)
+    elif gateway:
         ip = socket.gethostbyname(gateway)
     elif sys.platform == "darwin":
         # https://docs.docker.com/docker-for-mac/networking/#use-cases-and-workarounds:
@@ -99,7 +176,7 @@ def get_env_vars(
                 env[env_var] = hostport
                 break
 
-    gateway_ip = get_gateway_ip(container)
+    gateway_ip = get_gateway_ip(container, container_config.docker_host)
     env_var = get_host_env_var(container_config)
     env[env_var] = gateway_ip
 
@@ -114,6 +191,20 @@ def get_port_env_var(container_config: ContainerConfig, containerport: str) -> s
     return escape_env_var(f"{container_config.name}_{containerport}_PORT")
 
 
+T = TypeVar("T")
+
+
+def submit(executor: Executor, fn: Callable[..., T], *args: Any) -> "Future[T]":
+    """
+    Submit `fn` to `executor`, running it in a copy of the current context
+
+    This way the worker knows which testenv it's working for (see
+    `current_env`), just as the submitting thread does.
+
+    """
+    return executor.submit(copy_context().run, fn, *args)
+
+
 def docker_build_or_pull(container_config: ContainerConfig) -> None:
     if container_config.image:
         docker_pull(container_config)
@@ -121,24 +212,359 @@ def docker_build_or_pull(container_config: ContainerConfig) -> None:
         docker_build(container_config)
 
 
-def docker_pull(container_config: ContainerConfig) -> None:
+def timed_build_or_pull(container_config: ContainerConfig) -> float:
+    start = time.monotonic()
+    docker_build_or_pull(container_config)
+    return time.monotonic() - start
+
+
+def docker_build_or_pull_all(
+    container_configs: Sequence[ContainerConfig], concurrency: int
+) -> None:
+    """
+    Pull or build the images for all `container_configs` concurrently
+
+    At most `concurrency` pulls or builds run at the same time. If any of
+    them fails, the ones which have not yet started are cancelled, and the
+    exception is re-raised once the ones already in flight have finished
+    (the docker API gives us no way to interrupt those).
+
+    """
+    if not container_configs:
+        return
+
+    workers = max(1, min(concurrency, len(container_configs)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures: Dict["Future[float]", ContainerConfig] = {
+            submit(executor, timed_build_or_pull, container_config): container_config
+            for container_config in container_configs
+        }
+        try:
+            for future in as_completed(futures):
+                container_config = futures[future]
+                elapsed = future.result()
+                log(f"acquired image for {container_config.name!r} in {elapsed:.2f}s")
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+class PullStalled(Exception):
+    pass
+
+
+class ImageNotPresent(Exception):
+    pass
+
+
+class PullFailed(Exception):
+    pass
+
+
+def format_bytes(num: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if num < 1000:
+            return f"{num:.1f} {unit}"
+        num /= 1000
+    return f"{num:.1f} GB"
+
+
+class PullProgress:
+    """
+    Tracks the progress of a streaming pull, layer by layer
+
+    Each layer's download is timed from its first "Downloading" event to its
+    "Download complete" event; its size is the total reported while it was
+    downloading. Layers which already exist locally are counted separately.
+
+    """
+
+    # minimum number of seconds between overall progress log lines
+    LOG_INTERVAL = 5.0
+
+    def __init__(self, container_config: ContainerConfig) -> None:
+        self.container_config = container_config
+        self.started = time.monotonic()
+        self.last_logged = self.started
+        self.layer_started: Dict[str, float] = {}
+        self.layer_bytes: Dict[str, int] = {}
+        self.layer_current: Dict[str, int] = {}
+        self.layer_durations: Dict[str, float] = {}
+        self.existing_layers: Set[str] = set()
+
+    def update(self, event: Mapping[str, Any]) -> None:
+        layer = event.get("id", "")
+        status = event.get("status", "")
+        detail = event.get("progressDetail") or {}
+        now = time.monotonic()
+
+        if status == "Downloading":
+            self.layer_started.setdefault(layer, now)
+            if detail.get("total"):
+                self.layer_bytes[layer] = detail["total"]
+            self.layer_current[layer] = detail.get("current", 0)
+        elif status == "Download complete" and layer in self.layer_started:
+            elapsed = now - self.layer_started[layer]
+            self.layer_durations[layer] = elapsed
+            self.layer_current[layer] = self.layer_bytes.get(layer, 0)
+            size = self.layer_bytes.get(layer, 0)
+            log(
+                f"pull {self.container_config.image!r} layer {layer}: "
+                f"{format_bytes(size)} in {elapsed:.1f}s"
+            )
+        elif status == "Already exists":
+            self.existing_layers.add(layer)
+
+        if now - self.last_logged >= self.LOG_INTERVAL:
+            self.last_logged = now
+            log(
+                f"pull {self.container_config.image!r}: "
+                f"{format_bytes(sum(self.layer_current.values()))} of "
+                f"{format_bytes(sum(self.layer_bytes.values()))}"
+            )
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started
+        downloaded = sum(self.layer_bytes.values())
+        rate = downloaded / elapsed if elapsed else 0
+        return (
+            f"{len(self.layer_durations)} layers, {format_bytes(downloaded)} in "
+            f"{elapsed:.1f}s ({format_bytes(rate)}/s), "
+            f"{len(self.existing_layers)} layers already present"
+        )
+
+
+def stream_pull(container_config: ContainerConfig) -> None:
+    """
+    Pull the image using the streaming API, aborting if it stalls
+
+    The stream is consumed on a background thread, so that we notice when no
+    progress has been reported for `pull_stall_timeout` seconds. The docker
+    API gives us no way to cancel a pull in flight, so a stalled pull's
+    thread is abandoned rather than stopped.
+
+    """
+    assert container_config.image
+
+    progress = PullProgress(container_config)
+    events: "Queue[Tuple[str, Any]]" = Queue()
+    stream = pull_events(container_config)
+    threading.Thread(target=forward_stream, args=(stream, events), daemon=True).start()
+    while True:
+        try:
+            kind, value = events.get(timeout=container_config.pull_stall_timeout)
+        except Empty:
+            raise PullStalled(
+                f"pull {container_config.image!r} made no progress for "
+                f"{container_config.pull_stall_timeout}s"
+            )
+        if kind == "done":
+            break
+        elif kind == "error":
+            raise value
+        elif "error" in value:
+            raise PullFailed(f"pull {container_config.image!r}: {value['error']}")
+        progress.update(value)
+
+    log(f"pulled {container_config.image!r}: {progress.summary()}")
+
+
+def normalize_ref(ref: str) -> str:
+    """
+    Return the form of an image reference which docker lists in RepoTags
+
+    Images from Docker Hub are listed without the registry or "library/"
+    prefix, and a reference without a tag means the "latest" tag.
+
+    """
+    if ":" not in ref.rsplit("/", 1)[-1]:
+        ref = f"{ref}:latest"
+    for prefix in ("docker.io/", "index.docker.io/", "library/"):
+        if ref.startswith(prefix):
+            ref = ref.replace(prefix, "", 1)
+    return ref
+
+
+def pull_events(container_config: ContainerConfig) -> Iterator[Dict[str, Any]]:
+    # a generator, so the pull only starts once the stream is first read
     assert container_config.image
+    docker = get_docker_client(container_config.docker_host)
+    yield from docker.api.pull(
+        container_config.image.name,
+        tag=container_config.image.tag,
+        stream=True,
+        decode=True,
+    )
+
+
+def forward_stream(stream: Iterable[Any], received: "Queue[Tuple[str, Any]]") -> None:
+    """
+    Put each item of `stream` on `received`, as ("event", item).
+
+    That's followed by ("done", None) when the stream ends, or ("error", e)
+    if reading it raises `e`; so a reader on another thread can wait on
+    `received` with a timeout, where it can't on the stream itself.
+
+    """
+    try:
+        for item in stream:
+            received.put(("event", item))
+    except Exception as e:
+        received.put(("error", e))
+    else:
+        received.put(("done", None))
+
+
+def docker_resolve_images(container_configs: Sequence[ContainerConfig]) -> None:
+    """
+    Resolve the images of `container_configs` which are already present
+
+    This takes a single image list call, however many images there are,
+    where inspecting them would take one call each. The `runnable_image` of
+    each config whose image was found is set; the rest are marked as
+    `image_listed`, so `docker_pull` pulls them without inspecting them
+    again. All of `container_configs` must be placed on the same docker
+    host.
+
+    """
+    to_resolve = [c for c in container_configs if c.image and c.pull_policy != "always"]
+    if not to_resolve:
+        return
+
+    docker = get_docker_client(to_resolve[0].docker_host)
 
-    docker = docker_module.from_env(version="auto")
+    started = time.time()
+    start = time.monotonic()
+    listed = docker.api.images()
+    duration = time.monotonic() - start
 
+    by_tag: Dict[str, Mapping[str, Any]] = {}
+    for summary in listed:
+        for tag in summary.get("RepoTags") or ():
+            by_tag[normalize_ref(tag)] = summary
+
+    for container_config in to_resolve:
+        timings.record(container_config.name, "resolve", started, duration)
+        summary = by_tag.get(normalize_ref(str(container_config.image)))
+        if summary is not None:
+            container_config.runnable_image = docker.images.prepare_model(summary)
+        container_config.image_listed = True
+
+
+def find_local_image(container_config: ContainerConfig) -> Optional[DockerImage]:
+    if container_config.image_listed:
+        # docker_resolve_images has already looked for it
+        return container_config.runnable_image
+
+    docker = get_docker_client(container_config.docker_host)
     try:
-        docker.images.get(str(container_config.image))
+        with timings.timed(container_config.name, "resolve"):
+            return docker.images.get(str(container_config.image))
     except ImageNotFound:
+        return None
+
+
+def docker_pull(container_config: ContainerConfig) -> None:
+    assert container_config.image
+
+    image: Optional[DockerImage] = None
+    if container_config.pull_policy != "always":
+        image = find_local_image(container_config)
+        if image is None and container_config.pull_policy == "never":
+            raise ImageNotPresent(
+                f"{container_config.image!r} is not present locally, "
+                f"and {container_config.name!r} has pull_policy = never"
+            )
+
+    if image is None:
         log(f"pull {container_config.image!r} (from {container_config.name!r})")
-        docker.images.pull(container_config.image.name, tag=container_config.image.tag)
+        with timings.timed(container_config.name, "pull"):
+            image = docker_pull_with_retries(container_config)
+
+    container_config.runnable_image = image
+
+
+def docker_pull_with_retries(container_config: ContainerConfig) -> DockerImage:
+    docker = get_docker_client(container_config.docker_host)
 
-    container_config.runnable_image = docker.images.get(str(container_config.image))
+    delay = 1.0
+    attempt = 1
+    while True:
+        try:
+            stream_pull(container_config)
+            break
+        except PullStalled as e:
+            if attempt >= container_config.pull_retries:
+                raise
+            log(f"{e}; retrying in {delay:.0f}s")
+            time.sleep(delay)
+            delay *= 2
+            attempt += 1
+    return docker.images.get(str(container_config.image))
+
+
+# label holding the build_digest() of the context an image was built from
+BUILD_DIGEST_LABEL = "tox-docker.build-digest"
+
+
+def read_dockerignore(directory: str) -> List[str]:
+    # parsed the same way as docker-py does when it creates the build context
+    try:
+        with open(os.path.join(directory, ".dockerignore")) as fp:
+            lines = [line.strip() for line in fp.read().splitlines()]
+    except FileNotFoundError:
+        return []
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def build_digest(container_config: ContainerConfig) -> str:
+    """
+    Compute a digest of everything a Dockerfile build depends on locally
+
+    This covers the Dockerfile, the build target, and the path, type, mode
+    and content of every file in the build context which isn't excluded by
+    the context's .dockerignore. Base images pulled from a registry are not
+    included, so a cached build won't notice when those change upstream.
+
+    """
+    assert container_config.dockerfile
+
+    root = os.path.abspath(container_config.dockerfile.directory)
+    filename = container_config.dockerfile.filename
+    paths = exclude_paths(root, read_dockerignore(root), dockerfile=filename)
+
+    digest = hashlib.sha256()
+    digest.update(f"{filename}\0{container_config.dockerfile_target}\0".encode())
+    for path in sorted(paths):
+        full_path = os.path.join(root, path)
+        if os.path.islink(full_path):
+            digest.update(f"l {path}\0{os.readlink(full_path)}\0".encode())
+        elif os.path.isdir(full_path):
+            digest.update(f"d {path}\0".encode())
+        else:
+            mode = os.stat(full_path).st_mode & 0o777
+            digest.update(f"f {path}\0{mode:o}\0".encode())
+            with open(full_path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(1 << 16), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
 
 
 def docker_build(container_config: ContainerConfig) -> None:
     assert container_config.dockerfile
 
-    docker = docker_module.from_env(version="auto")
+    docker = get_docker_client(container_config.docker_host)
+
+    with timings.timed(container_config.name, "resolve"):
+        digest = build_digest(container_config)
+        cached = docker.images.list(filters={"label": f"{BUILD_DIGEST_LABEL}={digest}"})
+    if cached:
+        image = cached[0]
+        log(f"build {container_config.dockerfile!r} unchanged: {image.short_id}")
+        container_config.runnable_image = image
+        return
 
     if container_config.dockerfile_target:
         log(
@@ -147,24 +573,348 @@ def docker_build(container_config: ContainerConfig) -> None:
     else:
         log(f"build {container_config.dockerfile!r}")
 
-    image, _ = docker.images.build(
-        path=container_config.dockerfile.directory,
-        dockerfile=container_config.dockerfile.filename,
-        target=container_config.dockerfile_target or None,
-        pull=True,
-        forcerm=True,
-    )
+    with timings.timed(container_config.name, "build"):
+        image, _ = docker.images.build(
+            path=container_config.dockerfile.directory,
+            dockerfile=container_config.dockerfile.filename,
+            target=container_config.dockerfile_target or None,
+            pull=container_config.dockerfile_pull,
+            forcerm=True,
+            labels={BUILD_DIGEST_LABEL: digest},
+        )
     log(f"built: {image.short_id}")
 
     container_config.runnable_image = image
 
 
-def docker_run(
+def find_cycle(links: Mapping[str, Collection[str]]) -> List[str]:
+    """
+    Return one cycle (as a list of names, first == last) in `links`
+
+    `links` maps each container name to the names of the containers it
+    links to, and must contain at least one cycle.
+
+    """
+    visiting: List[str] = []
+    done = set()
+
+    def visit(name: str) -> Optional[List[str]]:
+        if name in visiting:
+            start = visiting.index(name)
+            return visiting[start:] + [name]
+        if name in done:
+            return None
+        visiting.append(name)
+        for target in sorted(links[name]):
+            cycle = visit(target)
+            if cycle:
+                return cycle
+        visiting.pop()
+        done.add(name)
+        return None
+
+    for name in sorted(links):
+        cycle = visit(name)
+        if cycle:
+            return cycle
+    raise ValueError("no cycle found")
+
+
+class InvalidLinks(ValueError):
+    pass
+
+
+def start_order(
+    container_configs: Sequence[ContainerConfig],
+) -> List[List[ContainerConfig]]:
+    """
+    Group `container_configs` into waves which can be started concurrently
+
+    Every container's links point only to containers in earlier waves, so
+    starting the waves one after another (and the containers within each
+    wave all at once) satisfies every link. Within a wave, containers keep
+    the order they had in the docker= list.
+
+    """
+    by_runas_name = {c.runas_name: c for c in container_configs}
+    links: Dict[str, Set[str]] = {}
+    for container_config in container_configs:
+        for link in container_config.links:
+            if link.target not in by_runas_name:
+                raise InvalidLinks(
+                    f"Container {container_config.name!r} links to "
+                    f"{link.name!r}, which is not in the docker= list"
+                )
+        links[container_config.name] = {
+            by_runas_name[link.target].name for link in container_config.links
+        }
+
+    waves = []
+    started: Set[str] = set()
+    remaining = list(container_configs)
+    while remaining:
+        wave = [c for c in remaining if links[c.name] <= started]
+        if not wave:
+            unstartable = {c.name: links[c.name] for c in remaining}
+            cycle = " -> ".join(repr(name) for name in find_cycle(unstartable))
+            raise InvalidLinks(f"Containers have circular links: {cycle}")
+        waves.append(wave)
+        started.update(c.name for c in wave)
+        remaining = [c for c in remaining if c.name not in started]
+
+    return waves
+
+
+class NetworkAttachment(NamedTuple):
+    network: Network
+    aliases: List[str]
+
+
+def network_name(env_name: str) -> str:
+    safe_env_name = re.sub(r"[^a-zA-Z0-9_.-]", "_", env_name)
+    return runas_name(f"tox-docker-{safe_env_name}")
+
+
+def network_aliases(
+    container_configs: Sequence[ContainerConfig],
+) -> Dict[str, List[str]]:
+    """
+    Return the DNS aliases each container should have on the network
+
+    Every container is known by its name from tox.ini, and additionally by
+    any alias other containers give it in their `links`.
+
+    """
+    aliases = {c.runas_name: [c.name] for c in container_configs}
+    for container_config in container_configs:
+        for link in container_config.links:
+            if link.alias not in aliases[link.target]:
+                aliases[link.target].append(link.alias)
+    return aliases
+
+
+def docker_create_network(
+    env_name: str, docker_host: str = "", keep: bool = False
+) -> Network:
+    docker = get_docker_client(docker_host)
+
+    name = network_name(env_name)
+    labels = owner_labels()
+    if keep:
+        # it will outlive this run along with the containers left running
+        # on it, so the reaper should leave it alone too
+        labels[DONT_STOP_LABEL] = "1"
+    log(f"create network {name!r}")
+    try:
+        return docker.networks.create(name, driver="bridge", labels=labels)
+    except APIError as e:
+        if e.status_code != 409:
+            raise
+        return docker.networks.get(name)
+
+
+def docker_connect(container: Container, attachment: NetworkAttachment) -> None:
+    networks = container.attrs["NetworkSettings"]["Networks"] or {}
+    if attachment.network.name in networks:
+        return
+    attachment.network.connect(container, aliases=attachment.aliases)
+
+
+def docker_remove_network(network: Network, keep: Collection[str] = ()) -> bool:
+    """
+    Remove the network, unless any container in `keep` (by ID) is on it
+
+    Any other containers still on the network are disconnected first.
+    Returns whether the network was removed (or was already gone).
+
+    """
+    try:
+        network.reload()
+        if any(container.id in keep for container in network.containers):
+            return False
+        for container in network.containers:
+            network.disconnect(container, force=True)
+        network.remove()
+    except NotFound:
+        pass
+    return True
+
+
+def docker_run_all(
+    container_configs: Sequence[ContainerConfig],
+    networks: Optional[Mapping[str, Network]] = None,
+    env_name: str = "",
+) -> List[Tuple[ContainerConfig, Container]]:
+    """
+    Start all `container_configs`, wave by wave in dependency order
+
+    Containers are attached to the network in `networks` for the docker host
+    they are placed on, where each can reach the others on that host by
+    name and by their link aliases. If any container fails to start, the
+    exception is raised only after the rest of its wave has finished
+    starting; callers are responsible for cleaning up whatever containers
+    did start.
+
+    """
+    aliases = network_aliases(container_configs)
+    config_and_container: List[Tuple[ContainerConfig, Container]] = []
+    for wave in start_order(container_configs):
+        with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+            futures = [
+                submit(
+                    executor,
+                    docker_start,
+                    container_config,
+                    (
+                        NetworkAttachment(
+                            networks[container_config.docker_host],
+                            aliases[container_config.runas_name],
+                        )
+                        if networks
+                        else None
+                    ),
+                    env_name,
+                )
+                for container_config in wave
+            ]
+        # wait for the whole wave, so every container which started is known
+        # (and can be cleaned up) even if another one in the wave failed
+        for container_config, future in zip(wave, futures):
+            container = future.result()
+            config_and_container.append((container_config, container))
+
+    return config_and_container
+
+
+class SharedContainer:
+    """
+    A session-scoped container, and the testenvs which use it
+
+    The container is started by the first testenv which needs it, and is
+    stopped once no testenv is using it and every testenv in the session
+    which lists it has finished (if we can't tell which testenvs those are,
+    as soon as no testenv is using it).
+
+    """
+
+    def __init__(self, expected_users: Set[str]) -> None:
+        self.lock = threading.Lock()
+        self.config: Optional[ContainerConfig] = None
+        self.container: Optional[Container] = None
+        # the testenv which started the container, and so holds its lease
+        # if it's pooled
+        self.started_by = ""
+        self.expected_users = expected_users
+        self.users: Set[str] = set()
+        self.finished: Set[str] = set()
+
+
+_session_state: Optional[State] = None
+_shared_containers: Dict[str, SharedContainer] = {}
+_shared_containers_lock = threading.Lock()
+
+
+def expected_users(container_name: str) -> Set[str]:
+    if _session_state is None:
+        return set()
+
+    users = set()
+    try:
+        for env_name in _session_state.envs.iter(only_active=True):
+            docker_confs = _session_state.envs[env_name].conf.load("docker")
+            if any(conf.name == container_name for conf in docker_confs):
+                users.add(env_name)
+    except Exception:
+        # we only use this to keep the container around between testenvs,
+        # so fall back to plain reference counting rather than failing
+        return set()
+    return users
+
+
+def get_shared_container(container_name: str) -> SharedContainer:
+    with _shared_containers_lock:
+        if container_name not in _shared_containers:
+            _shared_containers[container_name] = SharedContainer(
+                expected_users(container_name)
+            )
+        return _shared_containers[container_name]
+
+
+def acquire_shared_container(
+    container_config: ContainerConfig,
+    attachment: Optional[NetworkAttachment],
+    env_name: str,
+) -> Container:
+    shared = get_shared_container(container_config.name)
+    with shared.lock:
+        if shared.container is None:
+            if container_config.runnable_image is None:
+                docker_build_or_pull(container_config)
+            shared.container = docker_run(container_config, attachment)
+            shared.config = container_config
+            shared.started_by = env_name
+        else:
+            log(f"share '{shared.container.short_id}' (from {container_config.name!r})")
+            if attachment:
+                docker_connect(shared.container, attachment)
+        shared.users.add(env_name)
+        return shared.container
+
+
+def release_shared_container(
+    container_config: ContainerConfig, env_name: str
+) -> Optional[Container]:
+    """
+    Record that `env_name` has finished with the container
+
+    Returns the container if it should now be stopped, or None if it's still
+    needed by another testenv (or isn't running at all).
+
+    """
+    shared = get_shared_container(container_config.name)
+    with shared.lock:
+        shared.users.discard(env_name)
+        shared.finished.add(env_name)
+        if shared.users or not shared.finished >= shared.expected_users:
+            return None
+        container, shared.container = shared.container, None
+        return container
+
+
+def is_shared_container_running(container_config: ContainerConfig) -> bool:
+    with _shared_containers_lock:
+        shared = _shared_containers.get(container_config.name)
+    return shared is not None and shared.container is not None
+
+
+def stop_shared_containers() -> None:
+    # any shared containers still running at exit belong to testenvs which
+    # never got to clean up after themselves
+    containers = []
+    with _shared_containers_lock:
+        for shared in _shared_containers.values():
+            container, shared.container = shared.container, None
+            if container and shared.config:
+                containers.append((shared.config, container))
+                if shared.config.reuse:
+                    release_pool_lease(shared.config, container, shared.started_by)
+    stop_containers(containers)
+
+
+def docker_start(
     container_config: ContainerConfig,
-    running_containers: RunningContainers,
+    attachment: Optional[NetworkAttachment],
+    env_name: str,
 ) -> Container:
-    docker = docker_module.from_env(version="auto")
+    if container_config.scope == "session":
+        return acquire_shared_container(container_config, attachment, env_name)
+    return docker_run(container_config, attachment)
 
+
+def docker_run(
+    container_config: ContainerConfig,
+    attachment: Optional[NetworkAttachment] = None,
+) -> Container:
     healthcheck: Dict[str, Union[List[str], int]] = {}
     if container_config.healthcheck_cmd:
         healthcheck["test"] = ["CMD-SHELL", container_config.healthcheck_cmd]
@@ -179,163 +929,1533 @@ def docker_run(
 
     ports = {p.container_port_proto: 0 for p in container_config.expose}
 
-    links = {}
-    for link in container_config.links:
-        if link.target not in running_containers:
-            raise ValueError(
-                f"Container {link.target!r} not running; it must come before {container_config.name!r} in the docker= list"
-            )
-        other_container = running_containers[link.target]
-        links[other_container.id] = link.alias
-
-    for mount in container_config.mounts:
-        source = mount["Source"]
-        if not os.path.exists(source):
-            raise ValueError(f"Volume source {source!r} does not exist")
+    # bind mount sources on a remote docker host are paths on that host,
+    # which we can't check from here
+    if not host_address(container_config.docker_host):
+        for mount in container_config.mounts:
+            source = mount["Source"]
+            if mount["Type"] == "bind" and not os.path.exists(source):
+                raise ValueError(f"Volume source {source!r} does not exist")
 
     assert container_config.runnable_image
     image_name = container_config.image or container_config.runnable_image.short_id
-    log(f"run {image_name!r} (from {container_config.name!r})")
 
-    container = docker.containers.run(
-        container_config.runnable_image.id,
-        name=container_config.runas_name,
-        detach=True,
+    run_options = dict(
         environment=container_config.environment,
         healthcheck=healthcheck or None,
-        links=links,
-        ports=ports,
-        publish_all_ports=len(ports) == 0,
+        ports=ports if container_config.publish else {},
+        publish_all_ports=container_config.publish and len(ports) == 0,
         mounts=container_config.mounts,
+        **resource_limits(container_config),
     )
-    container.reload()  # TODO: why do we need this?
-    return container
 
+    if container_config.reuse:
+        return docker_run_pooled(container_config, run_options, attachment)
 
-def docker_health_check(
-    container_config: ContainerConfig, container: Container
-) -> None:
-    docker = docker_module.from_env(version="auto")
+    log(f"run {image_name!r} (from {container_config.name!r})")
+    return docker_create_and_start(
+        container_config, container_config.runas_name, run_options, attachment
+    )
 
-    if "Health" in container.attrs["State"]:
-        log(f"health check {container_config.name!r}")
-        while True:
-            container.reload()
-            health = container.attrs["State"]["Health"]["Status"]
-            if health == "healthy":
-                break
-            elif health == "starting":
-                time.sleep(0.1)
-            elif health == "unhealthy":
-                # the health check failed after its own timeout
-                msg = f"{container_config.image!r} (from {container_config.name!r}) failed health check"
-                raise HealthCheckFailed(msg)
 
+def resource_limits(container_config: ContainerConfig) -> Dict[str, Any]:
+    # only the limits which are set, so that unlimited containers are created
+    # (and hashed, for --docker-reuse) just as they were before limits existed
+    limits: Dict[str, Any] = {}
+    if container_config.mem_limit:
+        limits["mem_limit"] = container_config.mem_limit
+    if container_config.cpus:
+        # in billionths of a CPU
+        limits["nano_cpus"] = int(container_config.cpus * 1e9)
+    if container_config.cpu_shares:
+        limits["cpu_shares"] = container_config.cpu_shares
+    if container_config.cpuset_cpus:
+        limits["cpuset_cpus"] = container_config.cpuset_cpus
+    if container_config.shm_size:
+        limits["shm_size"] = container_config.shm_size
+    if container_config.ulimits:
+        limits["ulimits"] = list(container_config.ulimits)
+    return limits
+
+
+def docker_create_and_start(
+    container_config: ContainerConfig,
+    name: str,
+    run_options: Mapping[str, Any],
+    attachment: Optional[NetworkAttachment] = None,
+    labels: Optional[Mapping[str, str]] = None,
+) -> Container:
+    docker = get_docker_client(container_config.docker_host)
 
-def docker_stop(container_config: ContainerConfig, container: Container) -> None:
-    if container_config.stop:
-        log(f"remove '{container.short_id}' (from {container_config.name!r})")
-        container.remove(v=True, force=True)
-    else:
-        log(f"leave '{container.short_id}' (from {container_config.name!r}) running")
+    assert container_config.runnable_image
+    with timings.timed(container_config.name, "create"):
+        container = docker.containers.create(
+            container_config.runnable_image.id,
+            name=name,
+            labels={
+                **container_labels(container_config, current_env.get()),
+                **(labels or {}),
+            },
+            **run_options,
+        )
+    if attachment:
+        # connect before starting, so the network is there from the start
+        attachment.network.connect(container, aliases=attachment.aliases)
+    with timings.timed(container_config.name, "start"):
+        restored = container_config.checkpoint and docker_restore(
+            container_config, container
+        )
+        if not restored:
+            container.start()
+    container.reload()  # fetch the ports assigned on start
+    container_config.created = True
+    return container
 
 
-def docker_get(container_config: ContainerConfig) -> Optional[Container]:
-    docker = docker_module.from_env(version="auto")
-    try:
-        return docker.containers.get(container_config.runas_name)
-    except NotFound:
-        return None
+def is_adoptable(container: Container) -> bool:
+    state = container.attrs["State"]
+    if state["Status"] != "running":
+        return False
+    return state.get("Health", {}).get("Status", "healthy") == "healthy"
 
 
-def stop_containers(containers: Iterable[Tuple[ContainerConfig, Container]]) -> None:
-    for container_config, container in containers:
-        docker_stop(container_config, container)
+def lease_owner(env_name: str = "") -> Dict[str, str]:
+    return {**owner_labels(), ENV_LABEL: env_name or current_env.get()}
 
 
-@impl
-def tox_add_env_config(env_conf: EnvConfigSet, state: State) -> None:
-    def build_docker_config_set(container_name: object) -> DockerConfigSet:
-        assert isinstance(container_name, str)
-        docker_conf = state.conf.get_section_config(
-            section=Section("docker", container_name),
-            base=[],
-            of_type=DockerConfigSet,
-            for_env=None,
-        )
-        if not docker_conf.loaders:
-            raise ValueError(f"Missing [docker:{container_name}] in tox.ini")
-        return docker_conf
+def pool_leases(container: Optional[Container], default: PoolLeases) -> PoolLeases:
+    """
+    Return where the leases on a pooled container are kept
 
-    env_conf.add_config(
-        keys=["docker"],
-        of_type=List[DockerConfigSet],
-        default=[],
-        desc="docker image configs to load",
-        factory=build_docker_config_set,  # type: ignore
-    )
+    That's where the tox run which created it keeps its leases, which may
+    be another project's work dir; or `default`, for a container which
+    doesn't exist yet.
+
+    """
+    directory = container.labels.get(POOL_LEASES_LABEL) if container else None
+    return PoolLeases(directory) if directory else default
 
 
-@impl
-def tox_before_run_commands(tox_env: ToxEnv) -> None:
-    docker_confs = tox_env.conf.load("docker")
+def docker_run_pooled(
+    container_config: ContainerConfig,
+    run_options: Mapping[str, Any],
+    attachment: Optional[NetworkAttachment] = None,
+) -> Container:
+    """
+    Adopt a healthy pooled container matching this config, or start one
 
-    container_configs = [
-        parse_container_config(docker_conf) for docker_conf in docker_confs
-    ]
+    Pooled containers are named and labelled by a hash of their complete
+    configuration (including the image ID), and are left running after the
+    test run, so that a later run can adopt them instead of waiting for a
+    fresh container to start up and become healthy.
 
-    seen = set()
-    for container_config in container_configs:
-        if container_config.name in seen:
-            raise ValueError(
-                f"Container {container_config.name!r} specified more than once"
-            )
-        seen.add(container_config.name)
+    Each is leased to one testenv at a time (see PoolLeases): one which is
+    in use by another testenv is neither adopted nor removed, and if all
+    of them are in use, another one is started.
 
-    for container_config in container_configs:
-        docker_build_or_pull(container_config)
+    """
+    docker = get_docker_client(container_config.docker_host)
 
-    config_and_container = []
-    running_containers: RunningContainers = {}
-    for container_config in container_configs:
-        container = docker_run(container_config, running_containers)
-        config_and_container.append((container_config, container))
-        running_containers[container_config.runas_name] = container
+    assert container_config.runnable_image
+    digest = pool_hash(container_config.runnable_image.id, run_options)
+    matching = docker.containers.list(
+        all=True, filters={"label": f"{POOL_HASH_LABEL}={digest}"}
+    )
+    by_name = {container.name: container for container in matching}
+    own_leases = PoolLeases(container_config.pool_leases_dir)
+    owner = lease_owner()
+
+    n = 0
+    while True:
+        name = pool_name(container_config.name, digest, n)
+        n += 1
+        container = by_name.get(name)
+        leases = pool_leases(container, own_leases)
+        if not leases.acquire(name, owner):
+            log(f"skip {name!r} (from {container_config.name!r}), in use")
+            continue
 
-    for container_config, container in config_and_container:
+        if container is not None:
+            if is_adoptable(container):
+                log(f"reuse '{container.short_id}' (from {container_config.name!r})")
+                if attachment:
+                    docker_connect(container, attachment)
+                return container
+            log(
+                f"remove stale '{container.short_id}' "
+                f"(from {container_config.name!r})"
+            )
+            container.remove(v=True, force=True)
+
+        log(f"run {name!r} (from {container_config.name!r}) for reuse")
+        labels = {
+            POOL_LABEL: "1",
+            POOL_HASH_LABEL: digest,
+            POOL_LEASES_LABEL: str(own_leases.directory.resolve()),
+        }
         try:
-            docker_health_check(container_config, container)
-        except HealthCheckFailed:
-            tox_env.interrupt()
-            clean_up_containers(tox_env)
-            raise Fail(
-                f"{container_config.image!r} (from {container_config.name!r}) failed health check"
+            return docker_create_and_start(
+                container_config, name, run_options, attachment, labels=labels
             )
-
-        tox_env.conf["set_env"].update(get_env_vars(container_config, container))
+        except APIError as e:
+            leases.release(name, owner)
+            if e.status_code != 409:
+                raise
+            # another tox run created a pooled container of this name just
+            # after we listed them; it's theirs, so try the next name
 
 
-@impl
-def tox_after_run_commands(
-    tox_env: ToxEnv, exit_code: int, outcomes: List[Outcome]
+def maintain_pool(
+    index: PoolIndex, ttl: float, prune: bool, docker_host: str = ""
 ) -> None:
-    clean_up_containers(tox_env)
+    """
+    Remove pooled containers idle for longer than `ttl` seconds
 
+    Only containers on `docker_host` recorded in `index` are considered for
+    idle eviction, along with any pooled container which is no longer
+    running. If `prune` is set, every pooled container is removed
+    regardless of its age. Containers leased by a testenv (see PoolLeases)
+    are in use, and are never removed.
 
-def clean_up_containers(tox_env: ToxEnv) -> None:
+    """
+    docker = get_docker_client(docker_host)
+
+    last_used = index.load()
+    now = time.time()
+    own_leases = PoolLeases(index.path.parent / LEASES_DIRNAME)
+    owner = lease_owner()
+    pooled = docker.containers.list(all=True, filters={"label": POOL_LABEL})
+    evict = []
+    for container in pooled:
+        if prune:
+            reason = "prune"
+        elif container.attrs["State"]["Status"] != "running":
+            reason = "not running"
+        elif container.id in last_used and now - last_used[container.id] > ttl:
+            reason = "idle"
+        else:
+            continue
+        # lease it, so no other run adopts it while it's being removed
+        if not pool_leases(container, own_leases).acquire(container.name, owner):
+            log(f"keep pooled '{container.short_id}' ({reason}), in use")
+            continue
+        log(f"remove pooled '{container.short_id}' ({reason})")
+        evict.append(container)
+
+    docker_remove_all(evict)
+    for container in evict:
+        pool_leases(container, own_leases).release(container.name, owner)
+
+    # forget evicted containers, and any removed by other means (the index
+    # is shared by all docker hosts, but container IDs are unique anyway)
+    remaining = {c.id for c in pooled} - {c.id for c in evict}
+    index.forget([cid for cid in last_used if cid not in remaining])
+
+
+# most containers removed at once by docker_remove_all
+MAX_CONCURRENT_REMOVALS = 16
+
+
+def docker_remove_all(containers: Sequence[Container]) -> None:
+    def remove(container: Container) -> None:
+        try:
+            container.remove(v=True, force=True)
+        except NotFound:
+            pass
+
+    if containers:
+        workers = min(len(containers), MAX_CONCURRENT_REMOVALS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(remove, containers))
+
+
+def docker_reap(docker_host: str = "", force: bool = False) -> None:
+    """
+    Remove containers and networks left behind by tox processes which died
+
+    Everything tox-docker creates is labelled with the pid of the tox
+    process which created it, and the host (and pid namespace) that process
+    ran in. Containers whose tox process on this host is no longer running
+    were left behind when it crashed or was killed before it could clean up
+    (see is_orphaned, which `force` makes less cautious); they are all found
+    with one request, and removed concurrently, followed by their networks.
+
+    """
+    docker = get_docker_client(docker_host)
+
+    filters = {"label": f"{HOST_LABEL}={socket.gethostname()}"}
+    orphans = [
+        container
+        for container in docker.containers.list(all=True, sparse=True, filters=filters)
+        if is_orphaned(container.attrs.get("Labels") or {}, force)
+    ]
+    for container in orphans:
+        labels = container.attrs["Labels"]
+        log(
+            f"reap '{container.short_id}' (from {labels.get(NAME_LABEL)!r}, "
+            f"left by pid {labels[PID_LABEL]})"
+        )
+    docker_remove_all(orphans)
+
+    for network in docker.networks.list(filters=filters):
+        if not is_orphaned(network.attrs.get("Labels") or {}, force):
+            continue
+        try:
+            network.remove()
+        except APIError:
+            # still in use, eg by a container left running on purpose
+            pass
+
+
+# bounds for the delay between inspects when we can't use the events stream
+POLL_MIN_DELAY = 0.05
+POLL_MAX_DELAY = 1.0
+
+PendingHealthChecks = Dict[str, Tuple[ContainerConfig, Container]]
+
+
+class ContainerFailed(HealthCheckFailed):
+    pass
+
+
+class StartupAborted(Exception):
+    """
+    Another container failed, so we've stopped waiting for this one
+    """
+
+
+def check_running(container_config: ContainerConfig, container: Container) -> None:
+    """
+    Fail if the container has exited, been OOM killed, or is restarting
+
+    A container which crashes while starting up will never become healthy
+    or ready, so there's no point waiting for it to.
+
+    """
+    state = container.attrs["State"]
+    exit_code = state.get("ExitCode", 0)
+    name = f"{container_config.image!r} (from {container_config.name!r})"
+    if state.get("OOMKilled"):
+        msg = f"{name} ran out of memory and was killed (exit code {exit_code})"
+    elif state.get("Restarting") or state.get("Status") == "restarting":
+        msg = f"{name} is restarting after it exited with code {exit_code}"
+    elif state.get("Status") in ("exited", "dead"):
+        msg = f"{name} exited with code {exit_code}"
+    else:
+        return
+    raise ContainerFailed(msg, container_config.name)
+
+
+def is_healthy(container_config: ContainerConfig, status: str) -> bool:
+    if status == "healthy":
+        return True
+    elif status == "unhealthy":
+        # the health check failed after its own timeout
+        msg = f"{container_config.image!r} (from {container_config.name!r}) failed health check"
+        raise HealthCheckFailed(msg, container_config.name)
+    return False
+
+
+def record_healthy(container_config: ContainerConfig, wait_started: float) -> None:
+    timings.record(
+        container_config.name, "healthy", wait_started, time.time() - wait_started
+    )
+
+
+def poll_health(pending: PendingHealthChecks, wait_started: float) -> None:
+    """
+    Wait for all `pending` containers to become healthy by inspecting them
+
+    The delay between rounds of inspects starts short, so fast-starting
+    containers aren't held up, and backs off exponentially to keep the load
+    on the docker daemon down for slow-starting ones.
+
+    """
+    delay = POLL_MIN_DELAY
+    while pending:
+        inspect_health(pending, pending, wait_started)
+        if pending:
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_DELAY)
+
+
+def inspect_health(
+    pending: PendingHealthChecks, watched: PendingHealthChecks, wait_started: float
+) -> None:
+    """
+    Inspect each `watched` container once, failing if any has failed (see
+    check_running), and removing those which are healthy from `pending`
+
+    """
+    for container_id, (container_config, container) in list(watched.items()):
+        container.reload()
+        check_running(container_config, container)
+        if container_id in pending and is_healthy(
+            container_config, container.attrs["State"]["Health"]["Status"]
+        ):
+            record_healthy(container_config, wait_started)
+            del pending[container_id]
+
+
+def docker_health_check_all(
+    config_and_container: Iterable[Tuple[ContainerConfig, Container]],
+) -> None:
+    """
+    Wait for all containers which have a health check to become healthy
+
+    We subscribe once (per docker host) to the docker events stream for
+    `health_status` events of just these containers, then inspect each
+    container once to catch any that became healthy before we subscribed.
+    If the events stream isn't available, or breaks while we're waiting, we
+    fall back to polling.
+
+    Meanwhile, we watch every container on the docker host (with or without
+    a health check) for `die` events, and fail as soon as one has exited,
+    been OOM killed or is restarting (see check_running). With several
+    docker hosts, the first failure is raised without waiting for the
+    other hosts' containers, which are left to be removed.
+
+    """
+    by_host: Dict[str, PendingHealthChecks] = {}
+    watched_by_host: Dict[str, PendingHealthChecks] = {}
+    for container_config, container in config_and_container:
+        watched = watched_by_host.setdefault(container_config.docker_host, {})
+        watched[container.id] = (container_config, container)
+        if "Health" in container.attrs["State"]:
+            pending = by_host.setdefault(container_config.docker_host, {})
+            pending[container.id] = (container_config, container)
+    if not by_host:
+        return
+
+    for pending in by_host.values():
+        for container_config, _ in pending.values():
+            log(f"health check {container_config.name!r}")
+    wait_started = time.time()
+
+    if len(by_host) == 1:
+        [(docker_host, pending)] = by_host.items()
+        wait_for_health(
+            docker_host, pending, wait_started, watched_by_host[docker_host]
+        )
+        return
+
+    executor = ThreadPoolExecutor(max_workers=len(by_host))
+    try:
+        futures = [
+            submit(
+                executor,
+                wait_for_health,
+                docker_host,
+                pending,
+                wait_started,
+                watched_by_host[docker_host],
+            )
+            for docker_host, pending in by_host.items()
+        ]
+        for future in as_completed(futures):
+            future.result()
+    finally:
+        executor.shutdown(wait=False)
+
+
+def wait_for_health(
+    docker_host: str,
+    pending: PendingHealthChecks,
+    wait_started: float,
+    watched: Optional[PendingHealthChecks] = None,
+) -> None:
+    """
+    Wait for all `pending` containers to become healthy, from the events
+    stream of `docker_host`, failing if any `watched` container fails
+
+    The stream is read on a background thread, so that we never wait on it
+    for longer than POLL_MAX_DELAY: if no event has arrived by then, the
+    containers are inspected again, in case an event went missing.
+
+    """
+    watched = watched or pending
+    docker = get_docker_client(docker_host)
+    try:
+        events = docker.events(
+            decode=True,
+            filters={
+                "type": "container",
+                "event": ["health_status", "die"],
+                "container": list(watched),
+            },
+        )
+    except (DockerException, RequestException):
+        poll_health(pending, wait_started)
+        return
+
+    received: "Queue[Tuple[str, Any]]" = Queue()
+    threading.Thread(
+        target=forward_stream, args=(events, received), daemon=True
+    ).start()
+    try:
+        inspect_health(pending, watched, wait_started)
+        while pending:
+            try:
+                kind, event = received.get(timeout=POLL_MAX_DELAY)
+            except Empty:
+                inspect_health(pending, watched, wait_started)
+                continue
+            if kind != "event":
+                # the stream broke, or ended
+                poll_health(pending, wait_started)
+                return
+            handle_health_event(event, pending, watched, wait_started)
+    finally:
+        events.close()
+
+
+def handle_health_event(
+    event: Mapping[str, Any],
+    pending: PendingHealthChecks,
+    watched: PendingHealthChecks,
+    wait_started: float,
+) -> None:
+    container_id = event.get("Actor", {}).get("ID")
+    if container_id not in watched:
+        return
+    container_config, container = watched[container_id]
+    # the action looks like "health_status: healthy", or "die"
+    action = event.get("Action", "")
+    if action == "die":
+        container.reload()
+        check_running(container_config, container)
+    elif container_id in pending:
+        _, _, status = action.partition(": ")
+        if is_healthy(container_config, status.strip()):
+            record_healthy(container_config, wait_started)
+            del pending[container_id]
+
+
+class ReadinessProbeFailed(HealthCheckFailed):
+    pass
+
+
+def get_host_port(container: Container, container_port_proto: str) -> int:
+    ports = container.attrs["NetworkSettings"]["Ports"].get(container_port_proto)
+    for spec in ports or ():
+        if spec["HostIp"] == "0.0.0.0":
+            return int(spec["HostPort"])
+    raise ValueError(f"Port {container_port_proto} is not published to the host")
+
+
+def log_matches(
+    container: Container,
+    probe: ReadinessProbe,
+    timeout: float,
+    watch: Optional[Callable[[], None]] = None,
+) -> bool:
+    """
+    Follow the container's logs until a line matches the probe's pattern
+
+    Following happens on a background thread, which is abandoned (it ends
+    when the container does) if nothing matches within `timeout` seconds,
+    or if `watch` (called every so often while we wait) raises.
+
+    """
+    assert probe.pattern
+    pattern = probe.pattern
+    matched = threading.Event()
+
+    def follow() -> None:
+        buffer = b""
+        for chunk in container.logs(stream=True, follow=True):
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if pattern.search(line.decode("utf-8", "replace")):
+                    matched.set()
+                    return
+
+    threading.Thread(target=follow, daemon=True).start()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if watch:
+            watch()
+        if matched.wait(max(min(deadline - time.monotonic(), POLL_MAX_DELAY), 0)):
+            return True
+    return matched.is_set()
+
+
+def watch_container(
+    container_config: ContainerConfig, container: Container, abort: threading.Event
+) -> Callable[[], None]:
+    """
+    Make a check, for a readiness probe to call while it waits, which raises
+    if the container has failed (see check_running), or if `abort` is set
+
+    The container is inspected at most once every POLL_MAX_DELAY seconds.
+
+    """
+    last_checked = time.monotonic()
+
+    def watch() -> None:
+        nonlocal last_checked
+        if abort.is_set():
+            raise StartupAborted()
+        if time.monotonic() - last_checked >= POLL_MAX_DELAY:
+            last_checked = time.monotonic()
+            container.reload()
+            check_running(container_config, container)
+
+    return watch
+
+
+def wait_for_probe(
+    container_config: ContainerConfig,
+    container: Container,
+    probe: ReadinessProbe,
+    abort: Optional[threading.Event] = None,
+) -> None:
+    wait_started = time.time()
+    timeout = container_config.ready_timeout
+    watch = watch_container(container_config, container, abort or threading.Event())
+
+    if probe.kind == "log":
+        ready = log_matches(container, probe, timeout, watch)
+    else:
+        host = get_gateway_ip(container, container_config.docker_host)
+        port = get_host_port(container, probe.container_port_proto)
+        if probe.kind == "tcp":
+            ready = wait_until(lambda: tcp_ready(host, port), timeout, watch)
+        elif probe.kind == "udp":
+            ready = wait_until(lambda: udp_ready(host, port), timeout, watch)
+        else:
+            ready = wait_until(
+                lambda: http_ready(host, port, probe.path), timeout, watch
+            )
+
+    if not ready:
+        raise ReadinessProbeFailed(
+            f"{container_config.image!r} (from {container_config.name!r}) "
+            f"failed readiness probe {probe}",
+            container_config.name,
+        )
+    timings.record(
+        container_config.name, "ready", wait_started, time.time() - wait_started
+    )
+
+
+def docker_wait_for_ready_all(
+    config_and_container: Iterable[Tuple[ContainerConfig, Container]],
+) -> None:
+    """
+    Run every container's readiness probes concurrently, until all succeed
+
+    Probes also watch their container's state (see watch_container). The
+    first probe to fail, or container to fail, stops the others.
+
+    """
+    probes = [
+        (container_config, container, probe)
+        for container_config, container in config_and_container
+        for probe in container_config.ready_probes
+    ]
+    if not probes:
+        return
+
+    for container_config, _, probe in probes:
+        log(f"readiness probe {probe} {container_config.name!r}")
+
+    abort = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(probes))
+    try:
+        futures = [submit(executor, wait_for_probe, *args, abort) for args in probes]
+        for future in as_completed(futures):
+            future.result()
+    finally:
+        abort.set()
+        executor.shutdown(wait=False)
+
+
+def docker_check_running_all(
+    config_and_container: Sequence[Tuple[ContainerConfig, Container]],
+    wait_started: Optional[float] = None,
+) -> None:
+    """
+    Fail if any container has crashed while we waited for the others
+
+    That includes containers with no health check or readiness probe, which
+    are otherwise never waited on: until each container's `startup_grace`
+    has passed since `wait_started` (a time.monotonic() from before the
+    health checks), we watch for any of them exiting (see watch_for_exit).
+    Then the containers on each docker host are listed with one request,
+    and only those not running are inspected.
+
+    """
+    by_host: Dict[str, PendingHealthChecks] = {}
+    for container_config, container in config_and_container:
+        containers = by_host.setdefault(container_config.docker_host, {})
+        containers[container.id] = (container_config, container)
+
+    if wait_started is not None:
+        grace = max((c.startup_grace for c, _ in config_and_container), default=0)
+        for docker_host, containers in by_host.items():
+            watch_for_exit(docker_host, containers, wait_started + grace)
+
+    for docker_host, containers in by_host.items():
+        docker = get_docker_client(docker_host)
+        listed = docker.containers.list(
+            all=True, sparse=True, filters={"id": list(containers)}
+        )
+        for summary in listed:
+            if summary.attrs.get("State") == "running":
+                continue
+            container_config, container = containers[summary.id]
+            container.reload()
+            check_running(container_config, container)
+
+
+def watch_for_exit(
+    docker_host: str, watched: PendingHealthChecks, deadline: float
+) -> None:
+    """
+    Fail as soon as any `watched` container exits, until `deadline` (a
+    time.monotonic()), from the events stream of `docker_host`
+
+    If the events stream isn't available, or breaks, we just wait out the
+    deadline; containers which exited meanwhile are found by listing them.
+
+    """
+    if deadline <= time.monotonic():
+        return
+    docker = get_docker_client(docker_host)
+    try:
+        events = docker.events(
+            decode=True,
+            filters={"type": "container", "event": ["die"], "container": list(watched)},
+        )
+    except (DockerException, RequestException):
+        time.sleep(max(deadline - time.monotonic(), 0))
+        return
+
+    received: "Queue[Tuple[str, Any]]" = Queue()
+    threading.Thread(
+        target=forward_stream, args=(events, received), daemon=True
+    ).start()
+    try:
+        while time.monotonic() < deadline:
+            try:
+                kind, event = received.get(timeout=max(deadline - time.monotonic(), 0))
+            except Empty:
+                return
+            if kind != "event":
+                time.sleep(max(deadline - time.monotonic(), 0))
+                return
+            handle_health_event(event, {}, watched, 0)
+    finally:
+        events.close()
+
+
+def docker_health_check(
+    container_config: ContainerConfig, container: Container
+) -> None:
+    docker_health_check_all([(container_config, container)])
+
+
+# snapshots are tagged SNAPSHOT_REPOSITORY:<container name>-<snapshot digest>
+SNAPSHOT_REPOSITORY = "tox-docker-snapshot"
+
+
+class InitCommandFailed(HealthCheckFailed):
+    pass
+
+
+def snapshot_tag(container_config: ContainerConfig) -> str:
+    """
+    Tag a snapshot with a digest of everything its initialization depends on
+
+    That is the image the container was started from, its environment, and
+    the init commands run in it; a change to any of these means the next
+    run starts from a new snapshot.
+
+    """
+    assert container_config.runnable_image
+
+    content = json.dumps(
+        {
+            "image": container_config.runnable_image.id,
+            "environment": container_config.environment,
+            "init_commands": list(container_config.init_commands),
+        },
+        sort_keys=True,
+    )
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return f"{container_config.name}-{digest[:16]}"
+
+
+def docker_find_snapshot(container_config: ContainerConfig) -> None:
+    """
+    Start the container from a snapshot of an earlier run, if there is one
+    """
+    if not container_config.snapshot:
+        return
+
+    docker = get_docker_client(container_config.docker_host)
+
+    tag = snapshot_tag(container_config)
+    try:
+        with timings.timed(container_config.name, "resolve"):
+            image = docker.images.get(f"{SNAPSHOT_REPOSITORY}:{tag}")
+    except ImageNotFound:
+        return
+
+    log(f"start {container_config.name!r} from snapshot {image.short_id}")
+    container_config.runnable_image = image
+    container_config.from_snapshot = True
+
+
+def docker_initialize(container_config: ContainerConfig, container: Container) -> None:
+    """
+    Run the container's init commands, and snapshot it if configured
+
+    This only happens for containers this run created from their original
+    image, not for ones it adopted, shared, started from a snapshot or
+    restored from a checkpoint, which have already been initialized.
+
+    """
+    if not container_config.created or container_config.from_snapshot:
+        return
+    if container_config.restored:
+        return
+    if not container_config.init_commands and not container_config.snapshot:
+        return
+
+    with timings.timed(container_config.name, "init"):
+        for command in container_config.init_commands:
+            log(f"init {container_config.name!r}: {command}")
+            exit_code, output = container.exec_run(["sh", "-c", command])
+            if exit_code != 0:
+                lines = output.decode("utf-8", "replace").splitlines()[-10:]
+                raise InitCommandFailed(
+                    f"{container_config.name!r} init command {command!r} exited "
+                    f"with {exit_code}:\n" + "\n".join(lines),
+                    container_config.name,
+                )
+
+    if container_config.snapshot:
+        tag = snapshot_tag(container_config)
+        with timings.timed(container_config.name, "commit"):
+            image = container.commit(repository=SNAPSHOT_REPOSITORY, tag=tag)
+        log(f"snapshot {container_config.name!r} as {image.short_id} ({tag})")
+        docker_remove_stale_snapshots(container_config, tag)
+
+
+def docker_remove_stale_snapshots(container_config: ContainerConfig, tag: str) -> None:
+    """
+    Remove the container's snapshots other than `tag`
+
+    Those were taken with an older image, environment or init commands, so
+    no later run will start from them. Snapshots still in use by a container
+    can't be removed, and are left for a later run to remove.
+
+    """
+    docker = get_docker_client(container_config.docker_host)
+    stale = re.compile(
+        re.escape(f"{SNAPSHOT_REPOSITORY}:{container_config.name}-") + "[0-9a-f]{16}"
+    )
+    current = f"{SNAPSHOT_REPOSITORY}:{tag}"
+    for summary in docker.api.images(name=SNAPSHOT_REPOSITORY):
+        for old in summary.get("RepoTags") or ():
+            if old == current or not stale.fullmatch(old):
+                continue
+            try:
+                docker.api.remove_image(old)
+            except APIError as e:
+                log(f"can't remove snapshot {old}: {e.explanation}")
+                continue
+            log(f"remove snapshot {old}")
+
+
+def docker_initialize_all(
+    config_and_container: Sequence[Tuple[ContainerConfig, Container]],
+) -> None:
+    with ThreadPoolExecutor(max_workers=max(1, len(config_and_container))) as executor:
+        futures = [
+            submit(executor, docker_initialize, container_config, container)
+            for container_config, container in config_and_container
+        ]
+    for future in futures:
+        future.result()
+
+
+def checkpoint_name(container_config: ContainerConfig) -> str:
+    """
+    Name a checkpoint by the image and configuration it was taken with
+
+    A checkpoint can only be restored into a container just like the one
+    it was taken from; a change to either means the next run starts the
+    container normally, and checkpoints it again.
+
+    """
+    assert container_config.runnable_image
+
+    content = f"{container_config.runnable_image.id}\n{container_config.config_hash}"
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return f"{container_config.name}-{digest[:16]}"
+
+
+def checkpoint_request(
+    container: Container, method: str, path: str, *args: str, **kwargs: Any
+) -> Any:
+    # docker-py has no API for checkpoints, which are still experimental in
+    # docker, so we call the docker API directly, as docker-py itself would
+    api = container.client.api
+    url = api._url(path, container.id, *args)
+    response = api.request(method, url, timeout=api.timeout, **kwargs)
+    return api._result(response, json=method == "GET")
+
+
+def docker_restore(container_config: ContainerConfig, container: Container) -> bool:
+    """
+    Start `container` from a checkpoint of an earlier run, if there is one
+
+    Returns whether it was restored. If the docker daemon can't restore
+    checkpoints (that needs CRIU, and docker's experimental features), the
+    container is left to be started normally.
+
+    """
+    name = checkpoint_name(container_config)
+    directory = container_config.checkpoint_dir
+    try:
+        checkpoints = checkpoint_request(
+            container,
+            "GET",
+            "/containers/{0}/checkpoints",
+            params={"dir": directory},
+        )
+        if name not in {c.get("Name") for c in checkpoints or ()}:
+            return False
+        checkpoint_request(
+            container,
+            "POST",
+            "/containers/{0}/start",
+            params={"checkpoint": name, "checkpoint-dir": directory},
+        )
+    except APIError as e:
+        log(
+            f"can't restore {container_config.name!r} from a checkpoint, "
+            f"starting it normally: {e.explanation}"
+        )
+        return False
+
+    log(f"restore {container_config.name!r} from checkpoint {name}")
+    container_config.restored = True
+    return True
+
+
+def docker_checkpoint(container_config: ContainerConfig, container: Container) -> None:
+    """
+    Checkpoint the healthy, initialized container, to restore next time
+
+    Like docker_initialize, this only happens for containers this run
+    created (and didn't restore). The container keeps running. Checkpoints
+    of the same container with an older image or configuration are removed.
+
+    """
+    if not container_config.checkpoint or not container_config.created:
+        return
+    if container_config.restored:
+        return
+
+    name = checkpoint_name(container_config)
+    directory = container_config.checkpoint_dir
+    stale = re.compile(re.escape(container_config.name) + "-[0-9a-f]{16}")
+    try:
+        with timings.timed(container_config.name, "checkpoint"):
+            checkpoint_request(
+                container,
+                "POST",
+                "/containers/{0}/checkpoints",
+                json={"CheckpointID": name, "CheckpointDir": directory, "Exit": False},
+            )
+        checkpoints = checkpoint_request(
+            container,
+            "GET",
+            "/containers/{0}/checkpoints",
+            params={"dir": directory},
+        )
+        for checkpoint in checkpoints or ():
+            old = checkpoint.get("Name", "")
+            if old != name and stale.fullmatch(old):
+                checkpoint_request(
+                    container,
+                    "DELETE",
+                    "/containers/{0}/checkpoints/{1}",
+                    old,
+                    params={"dir": directory},
+                )
+    except APIError as e:
+        log(f"can't checkpoint {container_config.name!r}: {e.explanation}")
+        return
+
+    log(f"checkpoint {container_config.name!r} as {name}")
+
+
+def docker_checkpoint_all(
+    config_and_container: Sequence[Tuple[ContainerConfig, Container]],
+) -> None:
+    with ThreadPoolExecutor(max_workers=max(1, len(config_and_container))) as executor:
+        futures = [
+            submit(executor, docker_checkpoint, container_config, container)
+            for container_config, container in config_and_container
+        ]
+    for future in futures:
+        future.result()
+
+
+def docker_stop(container_config: ContainerConfig, container: Container) -> None:
+    if container_config.reuse:
+        log(f"leave '{container.short_id}' (from {container_config.name!r}) for reuse")
+    elif container_config.stop:
+        log(f"remove '{container.short_id}' (from {container_config.name!r})")
+        with timings.timed(container_config.name, "remove"):
+            if container_config.stop_timeout:
+                # give the container a chance to shut down cleanly first
+                try:
+                    container.stop(timeout=container_config.stop_timeout)
+                except APIError:
+                    pass
+            container.remove(v=True, force=True)
+        release_memory(container_config)
+    else:
+        log(f"leave '{container.short_id}' (from {container_config.name!r}) running")
+
+
+def release_pool_lease(
+    container_config: ContainerConfig, container: Container, env_name: str
+) -> None:
+    # the container is left running for the next run to adopt
+    own_leases = PoolLeases(container_config.pool_leases_dir)
+    pool_leases(container, own_leases).release(container.name, lease_owner(env_name))
+
+
+def docker_find_containers(
+    container_configs: Sequence[ContainerConfig], env_name: str
+) -> Dict[Tuple[str, str], Container]:
+    """
+    Find the containers this session created for testenv `env_name`
+
+    That's one request per docker host, for containers labelled with this
+    session and testenv; they're returned by docker host and container name.
+
+    """
+    found = {}
+    for docker_host in sorted({c.docker_host for c in container_configs}):
+        docker = get_docker_client(docker_host)
+        filters = {
+            "label": [f"{SESSION_LABEL}={SESSION_ID}", f"{ENV_LABEL}={env_name}"]
+        }
+        for container in docker.containers.list(all=True, sparse=True, filters=filters):
+            name = (container.attrs.get("Labels") or {}).get(NAME_LABEL, "")
+            found[docker_host, name] = container
+    return found
+
+
+def stop_containers(containers: Iterable[Tuple[ContainerConfig, Container]]) -> None:
+    containers = list(containers)
+    if not containers:
+        return
+
+    with ThreadPoolExecutor(max_workers=len(containers)) as executor:
+        futures = [
+            submit(executor, docker_stop, container_config, container)
+            for container_config, container in containers
+        ]
+    for future in futures:
+        try:
+            future.result()
+        except NotFound:
+            # already gone, which is what we wanted anyway
+            pass
+
+
+class EnvState:
+    """
+    What a testenv's startup learned, for its teardown to use
+
+    That's the parsed configs (with the docker host each was placed on),
+    the containers started, once they are all known, their logs, and the
+    networks created for them; so teardown reuses the configs and the
+    container and network handles rather than parsing and looking them up
+    again.
+
+    """
+
+    __slots__ = ("container_configs", "containers", "logs", "networks")
+
+    def __init__(self, container_configs: Sequence[ContainerConfig]) -> None:
+        self.container_configs = container_configs
+        self.containers: Optional[List[Tuple[ContainerConfig, Container]]] = None
+        self.logs: Dict[str, ContainerLog] = {}
+        self.networks: List[Network] = []
+
+
+_env_states: Dict[str, EnvState] = {}
+_env_states_lock = threading.Lock()
+
+# how long to wait at teardown for a removed container's remaining output
+LOG_DRAIN_TIMEOUT = 1.0
+
+
+def start_container_logs(
+    config_and_container: Iterable[Tuple[ContainerConfig, Container]],
+    log_dir: Path,
+    max_bytes: int,
+    tail_lines: int,
+) -> Dict[str, ContainerLog]:
+    since = int(time.time())
+    logs = {}
+    for container_config, container in config_and_container:
+        container_log = ContainerLog(
+            container,
+            Path(log_dir) / f"docker-{container_config.name}.log",
+            max_bytes=max_bytes,
+            tail_lines=tail_lines,
+            # only this run's output of a container adopted or shared from
+            # elsewhere, not everything it has logged since it started
+            since=None if container_config.created else since,
+        )
+        container_log.start()
+        logs[container_config.name] = container_log
+    return logs
+
+
+def log_tail(env_name: str, container_name: str, drain: bool = False) -> None:
+    with _env_states_lock:
+        state = _env_states.get(env_name)
+        container_log = state.logs.get(container_name) if state else None
+    if container_log and drain:
+        container_log.close(timeout=LOG_DRAIN_TIMEOUT)
+    lines = container_log.tail() if container_log else []
+    if lines:
+        log(f"last {len(lines)} log lines of {container_name!r}:")
+        for line in lines:
+            log(f"  {line}")
+
+
+_reaper: Optional[ThreadPoolExecutor] = None
+_reaper_lock = threading.Lock()
+
+
+def get_reaper() -> ThreadPoolExecutor:
+    """
+    Return the executor used to remove containers in the background
+
+    Work submitted to it is finished before the interpreter exits, so
+    containers are still cleaned up even though tox doesn't wait for them.
+
+    """
+    global _reaper
+
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = ThreadPoolExecutor(thread_name_prefix="tox-docker-reaper")
+        return _reaper
+
+
+def end_session(report_path: str, metrics_path: str, metrics_format: str) -> None:
+    stop_shared_containers()
+    report_timings(report_path)
+    report_api_calls(metrics_path, metrics_format)
+
+
+def report_timings(report_path: str) -> None:
+    lines = timings.summary()
+    if lines:
+        log("timings:")
+        for line in lines:
+            log(f"  {line}")
+    if report_path:
+        timings.write(report_path)
+
+
+def report_api_calls(metrics_path: str, metrics_format: str) -> None:
+    lines = api_calls.summary()
+    if lines:
+        log(f"{api_calls.total_calls} API calls:")
+        for line in lines:
+            log(f"  {line}")
+    if api_calls.budget_exceeded:
+        log(
+            f"made {api_calls.total_calls} API calls, more than the budget "
+            f"of {api_calls.budget}"
+        )
+    if metrics_path:
+        api_calls.write_metrics(metrics_path, metrics_format == "openmetrics")
+
+
+@impl
+def tox_add_core_config(core_conf: ConfigSet, state: State) -> None:
+    global _session_state
+
+    _session_state = state
+    # atexit handlers run in reverse order: close the client last
+    atexit.register(close_docker_client)
+    options = state.conf.options
+    atexit.register(
+        end_session,
+        options.docker_report,
+        options.docker_metrics,
+        options.docker_metrics_format,
+    )
+    configure_docker_client(
+        max_pool_size=options.docker_max_pool_size,
+        api_budget=options.docker_api_budget,
+    )
+
+
+@impl
+def tox_add_env_config(env_conf: EnvConfigSet, state: State) -> None:
+    def build_docker_config_set(container_name: object) -> DockerConfigSet:
+        assert isinstance(container_name, str)
+        docker_conf = state.conf.get_section_config(
+            section=Section("docker", container_name),
+            base=[],
+            of_type=DockerConfigSet,
+            for_env=None,
+        )
+        if not docker_conf.loaders:
+            raise ValueError(f"Missing [docker:{container_name}] in tox.ini")
+        return docker_conf
+
+    env_conf.add_config(
+        keys=["docker"],
+        of_type=List[DockerConfigSet],
+        default=[],
+        desc="docker image configs to load",
+        factory=build_docker_config_set,  # type: ignore
+    )
+
+
+_pool_maintained: Set[str] = set()
+_pool_lock = threading.Lock()
+_reaped: Set[str] = set()
+_reap_lock = threading.Lock()
+
+
+def reap_once(tox_env: ToxEnv, docker_hosts: Iterable[str]) -> None:
+    with _reap_lock:
+        for docker_host in docker_hosts:
+            if docker_host in _reaped:
+                continue
+            docker_reap(docker_host, force=tox_env.options.docker_reap)
+            _reaped.add(docker_host)
+
+
+def maintain_pool_once(tox_env: ToxEnv, docker_hosts: Iterable[str]) -> None:
+    options = tox_env.options
+    if not (options.docker_reuse or options.docker_prune_pool):
+        return
+
+    with _pool_lock:
+        for docker_host in docker_hosts:
+            if docker_host in _pool_maintained:
+                continue
+            maintain_pool(
+                PoolIndex(tox_env.core["work_dir"]),
+                ttl=options.docker_pool_ttl,
+                prune=options.docker_prune_pool,
+                docker_host=docker_host,
+            )
+            _pool_maintained.add(docker_host)
+
+
+@impl
+def tox_before_run_commands(tox_env: ToxEnv) -> None:
+    current_env.set(tox_env.name)
+    with _prewarm_lock:
+        prewarm = _prewarms.pop(tox_env.name, None)
+    try:
+        if prewarm is not None:
+            started = time.monotonic()
+            state = prewarm.result()
+            waited = time.monotonic() - started
+            log(f"waited {waited:.2f}s for containers started during install")
+        else:
+            state = start_containers(tox_env, load_container_configs(tox_env))
+    except (ImageNotPresent, PullFailed, PullStalled, InvalidLinks) as e:
+        # an image couldn't be pulled (or wasn't there to run), or the links
+        # can't be satisfied: that's the user's to fix, not an internal error
+        tox_env.interrupt()
+        clean_up_containers(tox_env)
+        raise Fail(str(e))
+    assert state.containers is not None
+    config_and_container = state.containers
+
+    with _env_states_lock:
+        state.logs = start_container_logs(
+            config_and_container,
+            tox_env.env_log_dir,
+            max_bytes=tox_env.options.docker_log_max_size,
+            tail_lines=tox_env.options.docker_log_tail,
+        )
+
+    wait_started = time.monotonic()
+    try:
+        docker_health_check_all(config_and_container)
+        docker_wait_for_ready_all(config_and_container)
+        docker_check_running_all(config_and_container, wait_started)
+        docker_initialize_all(config_and_container)
+        docker_checkpoint_all(config_and_container)
+    except HealthCheckFailed as e:
+        # a container which exited has written all its logs; wait for them
+        drain = isinstance(e, ContainerFailed)
+        log_tail(tox_env.name, e.container_name, drain)
+        tox_env.interrupt()
+        clean_up_containers(tox_env)
+        raise Fail(str(e))
+
+    pooled = [c.id for config, c in config_and_container if config.reuse]
+    if pooled:
+        PoolIndex(tox_env.core["work_dir"]).touch(pooled)
+
+    for container_config, container in config_and_container:
+        with timings.timed(container_config.name, "export"):
+            env_vars = get_env_vars(container_config, container)
+            tox_env.conf["set_env"].update(env_vars)
+
+
+# containers being started in the background, by testenv (see tox_on_install)
+_prewarms: Dict[str, "Future[EnvState]"] = {}
+_prewarm_lock = threading.Lock()
+_prewarmer: Optional[ThreadPoolExecutor] = None
+
+
+@impl
+def tox_on_install(tox_env: ToxEnv, arguments: Any, section: str, of_type: str) -> None:
+    """
+    With --docker-prewarm, start the testenv's containers while it installs
+
+    The first install command (of deps or the package) starts pulling,
+    building and starting the containers on a background thread; waiting
+    for them to become healthy and exporting their environment variables
+    is left to tox_before_run_commands, as usual. Configs are parsed here
+    rather than in the background, since tox's config isn't thread safe.
+
+    """
+    global _prewarmer
+
+    if not tox_env.options.docker_prewarm or not isinstance(tox_env, RunToxEnv):
+        return
+
+    current_env.set(tox_env.name)
+    with _prewarm_lock:
+        if tox_env.name in _prewarms:
+            return
+        container_configs = load_container_configs(tox_env)
+        if _prewarmer is None:
+            _prewarmer = ThreadPoolExecutor(thread_name_prefix="tox-docker-prewarm")
+        _prewarms[tox_env.name] = submit(
+            _prewarmer, start_containers, tox_env, container_configs
+        )
+
+
+@impl
+def tox_env_teardown(tox_env: ToxEnv) -> None:
+    # if the testenv failed to install, or to start its containers, its
+    # commands never ran: clean up any containers started for it
+    with _prewarm_lock:
+        prewarm = _prewarms.pop(tox_env.name, None)
+    if prewarm is not None:
+        try:
+            prewarm.result()
+        except Exception:
+            pass
+    clean_up_containers(tox_env)
+
+
+def load_container_configs(tox_env: ToxEnv) -> List[ContainerConfig]:
     docker_confs = tox_env.conf.load("docker")
 
     container_configs = [
         parse_container_config(docker_conf) for docker_conf in docker_confs
     ]
 
+    seen = set()
+    for container_config in container_configs:
+        if container_config.name in seen:
+            raise ValueError(
+                f"Container {container_config.name!r} specified more than once"
+            )
+        seen.add(container_config.name)
+
+    session_scoped = {c.runas_name for c in container_configs if c.scope == "session"}
+    for container_config in container_configs:
+        if container_config.scope != "session":
+            continue
+        for link in container_config.links:
+            if link.target not in session_scoped:
+                raise ValueError(
+                    f"Container {container_config.name!r} has scope = session, "
+                    f"so it can only link to containers which do too, not {link.name!r}"
+                )
+
+    return container_configs
+
+
+def acquire_images(
+    container_configs: Sequence[ContainerConfig], concurrency: int
+) -> None:
+    """
+    Resolve, pull or build the image of each of `container_configs`
+
+    Session containers which are already running need no image; the rest
+    are resolved in bulk on each of their docker hosts, and only those not
+    found there are pulled or built.
+
+    """
+    to_acquire = [c for c in container_configs if not is_shared_container_running(c)]
+    for docker_host in sorted({c.docker_host for c in to_acquire}):
+        docker_resolve_images([c for c in to_acquire if c.docker_host == docker_host])
+    to_pull = [c for c in to_acquire if c.runnable_image is None]
+    docker_build_or_pull_all(to_pull, concurrency=concurrency)
+    for container_config in to_acquire:
+        docker_find_snapshot(container_config)
+
+
+def start_containers(
+    tox_env: ToxEnv, container_configs: Sequence[ContainerConfig]
+) -> EnvState:
+    """
+    Acquire the images of `container_configs`, and start the containers
+
+    The containers are left for the caller to wait on. Whatever this
+    learns along the way is recorded as the testenv's EnvState, so the
+    containers are cleaned up even if starting them fails part way.
+
+    """
+    docker_hosts = {h for c in container_configs for h in c.docker_hosts or [""]}
+    reap_once(tox_env, sorted(docker_hosts))
+    maintain_pool_once(tox_env, sorted(docker_hosts))
+
+    state = EnvState(container_configs)
+    for group, docker_host in place_containers(container_configs):
+        if len(set(group[0].docker_hosts)) > 1:
+            names = ", ".join(repr(c.name) for c in group)
+            log(f"place {names} on {docker_host!r}")
+    placed_on = sorted({c.docker_host for c in container_configs})
+    for container_config in container_configs:
+        if container_config.checkpoint and not container_config.checkpoint_dir:
+            container_config.checkpoint_dir = str(
+                Path(tox_env.core["work_dir"]) / ".docker-checkpoints"
+            )
+        if container_config.reuse:
+            container_config.pool_leases_dir = str(
+                Path(tox_env.core["work_dir"]) / LEASES_DIRNAME
+            )
+    with _env_states_lock:
+        _env_states[tox_env.name] = state
+
+    acquire_images(container_configs, tox_env.options.docker_pull_concurrency)
+
+    networks: Dict[str, Network] = {}
+    for docker_host in placed_on:
+        keep = any(
+            not c.stop for c in container_configs if c.docker_host == docker_host
+        )
+        networks[docker_host] = docker_create_network(tox_env.name, docker_host, keep)
+        with _env_states_lock:
+            state.networks.append(networks[docker_host])
+    try:
+        config_and_container = docker_run_all(container_configs, networks, tox_env.name)
+    except Exception:
+        clean_up_containers(tox_env)
+        raise
+
+    with _env_states_lock:
+        state.containers = config_and_container
+    return state
+
+
+@impl
+def tox_after_run_commands(
+    tox_env: ToxEnv, exit_code: int, outcomes: List[Outcome]
+) -> None:
+    clean_up_containers(tox_env)
+
+
+def clean_up_containers(tox_env: ToxEnv) -> None:
+    current_env.set(tox_env.name)
+    with _env_states_lock:
+        state = _env_states.pop(tox_env.name, None)
+    if state is None:
+        # startup never got as far as placing any containers, or we've
+        # already cleaned up
+        return
+
+    started: Sequence[Tuple[ContainerConfig, Optional[Container]]]
+    if state.containers is not None:
+        started = state.containers
+    else:
+        # we failed before we knew which containers were started, so look
+        # for any of this testenv's containers by their labels
+        found = docker_find_containers(state.container_configs, tox_env.name)
+        started = [
+            (config, found.get((config.docker_host, config.name)))
+            for config in state.container_configs
+        ]
+
     configs_and_containers = []
-    for config in container_configs:
-        container = docker_get(config)
+    for config, container in started:
+        lease_env = tox_env.name
+        if config.scope == "session":
+            container = release_shared_container(config, tox_env.name)
+            lease_env = get_shared_container(config.name).started_by
+        if container and config.reuse:
+            release_pool_lease(config, container, lease_env)
         if container:
             configs_and_containers.append((config, container))
 
-    stop_containers(configs_and_containers)
+    logs = list(state.logs.values())
+    args = (configs_and_containers, logs, state.networks)
+    if tox_env.options.docker_background_teardown:
+        future = submit(get_reaper(), tear_down, *args)
+        future.add_done_callback(partial(log_teardown_failure, tox_env.name))
+    else:
+        tear_down(*args)
+
+
+def log_teardown_failure(env_name: str, future: "Future[None]") -> None:
+    # nothing waits on a background teardown, so it's up to us to say if
+    # it went wrong, and left containers behind
+    e = future.exception()
+    if e is not None:
+        log(f"tearing down {env_name!r} failed: {e}")
+
+
+def tear_down(
+    containers: Sequence[Tuple[ContainerConfig, Container]],
+    logs: Iterable[ContainerLog] = (),
+    networks: Iterable[Network] = (),
+) -> None:
+    stop_containers(containers)
+
+    removed = {
+        container.id
+        for config, container in containers
+        if config.stop and not config.reuse
+    }
+    for container_log in logs:
+        if container_log.container.id in removed:
+            container_log.close(timeout=LOG_DRAIN_TIMEOUT)
+        else:
+            container_log.close()
+
+    # remove the networks created at startup by their handles: looking them
+    # up by name could match another run's networks too, as the daemon
+    # filters names by substring. Networks with containers left running on
+    # them are kept, so those containers can still reach each other
+    kept = {container.id for config, container in containers if not config.stop}
+    for network in networks:
+        if docker_remove_network(network, kept):
+            log(f"remove network {network.name!r}")
+        else:
+            log(f"leave network {network.name!r} running")
 
 
 @impl
@@ -351,3 +2471,186 @@ def tox_add_option(parser: ToxParser) -> None:
             "Can be specified multiple times."
         ),
     )
+    parser.add_argument(
+        "--docker-report",
+        default="",
+        metavar="PATH",
+        help=(
+            "Write a JSON report of how long each phase of each container's "
+            "lifecycle took to PATH."
+        ),
+    )
+    parser.add_argument(
+        "--docker-metrics",
+        default="",
+        metavar="PATH",
+        help=(
+            "Write counts, latency histograms and bytes transferred for each "
+            "docker API endpoint called to PATH."
+        ),
+    )
+    parser.add_argument(
+        "--docker-metrics-format",
+        default="prometheus",
+        choices=["prometheus", "openmetrics"],
+        help=(
+            "Write --docker-metrics in Prometheus text format or OpenMetrics "
+            "(default: prometheus)."
+        ),
+    )
+    parser.add_argument(
+        "--docker-host",
+        default=[],
+        action="append",
+        metavar="URL",
+        help=(
+            "Run containers on the docker daemon at URL (eg tcp://build2:2376) "
+            "instead of the one in DOCKER_HOST. Can be specified multiple times, "
+            "to spread containers across several daemons."
+        ),
+    )
+    parser.add_argument(
+        "--docker-placement",
+        default="containers",
+        choices=["containers", "memory"],
+        help=(
+            "Place containers on the docker host with the fewest running "
+            "containers, or with the most memory (default: containers)."
+        ),
+    )
+    parser.add_argument(
+        "--docker-api-budget",
+        default=0,
+        type=int,
+        metavar="N",
+        help="Warn if tox-docker makes more than N docker API calls in the run.",
+    )
+    parser.add_argument(
+        "--docker-prewarm",
+        default=False,
+        action="store_true",
+        help=(
+            "Start pulling, building and starting containers in the background "
+            "while the testenv installs its dependencies."
+        ),
+    )
+    parser.add_argument(
+        "--docker-checkpoint-dir",
+        default="",
+        metavar="PATH",
+        help=(
+            "Keep the checkpoints of containers with checkpoint = true in PATH on "
+            "the docker host (default: .docker-checkpoints in tox's work dir)."
+        ),
+    )
+    parser.add_argument(
+        "--docker-stop-timeout",
+        default=0,
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Give containers SECONDS to shut down cleanly before they are killed "
+            "and removed (default: 0, kill immediately)."
+        ),
+    )
+    parser.add_argument(
+        "--docker-background-teardown",
+        default=False,
+        action="store_true",
+        help=(
+            "Remove containers in the background, without waiting for them before "
+            "reporting the testenv's result. tox still waits for them before exiting."
+        ),
+    )
+    parser.add_argument(
+        "--docker-reuse",
+        default=False,
+        action="store_true",
+        help=(
+            "Leave containers running after the test run, and reuse a matching "
+            "healthy container left by an earlier run instead of starting a new one."
+        ),
+    )
+    parser.add_argument(
+        "--docker-pool-ttl",
+        default=3600,
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "With --docker-reuse, remove reusable containers which have not been "
+            "used for SECONDS (default: 3600)."
+        ),
+    )
+    parser.add_argument(
+        "--docker-prune-pool",
+        default=False,
+        action="store_true",
+        help="Remove all reusable containers left running by --docker-reuse.",
+    )
+    parser.add_argument(
+        "--docker-reap",
+        default=False,
+        action="store_true",
+        help=(
+            "Also remove containers left behind by tox processes which have "
+            "since exited in another pid namespace on a host of the same name, "
+            "or which were left running with --docker-dont-stop."
+        ),
+    )
+    parser.add_argument(
+        "--docker-pull-stall-timeout",
+        default=120,
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Abort an image pull which reports no progress for SECONDS, and "
+            "retry it (default: 120)."
+        ),
+    )
+    parser.add_argument(
+        "--docker-pull-retries",
+        default=3,
+        type=int,
+        metavar="N",
+        help="Attempt a stalled image pull at most N times (default: 3).",
+    )
+    parser.add_argument(
+        "--docker-max-pool-size",
+        default=0,
+        type=int,
+        metavar="N",
+        help=(
+            "Maximum number of HTTP connections to the docker daemon to keep open "
+            "for reuse (default: docker-py's default of 10)."
+        ),
+    )
+    parser.add_argument(
+        "--docker-log-max-size",
+        default=10_000_000,
+        type=int,
+        metavar="BYTES",
+        help=(
+            "Rotate each container's log file in the testenv's log dir when it "
+            "reaches BYTES (default: 10000000)."
+        ),
+    )
+    parser.add_argument(
+        "--docker-log-tail",
+        default=20,
+        type=int,
+        metavar="N",
+        help=(
+            "Show the last N lines of a container's logs when it fails its health "
+            "check (default: 20)."
+        ),
+    )
+    parser.add_argument(
+        "--docker-pull-concurrency",
+        default=4,
+        type=int,
+        metavar="N",
+        help=(
+            "Maximum number of images tox-docker will pull or build at the same "
+            "time (default: 4)."
+        ),
+    )
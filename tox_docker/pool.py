@@ -0,0 +1,150 @@
+from pathlib import Path
+from typing import Any, Dict, Iterable, Mapping, Optional, Union
+import hashlib
+import json
+import os
+import threading
+import time
+
+from tox_docker.labels import is_orphaned
+
+INDEX_FILENAME = ".docker-pool.json"
+LEASES_DIRNAME = ".docker-pool-leases"
+
+# parallel tox envs share one index file, so serialize access to it
+_index_lock = threading.Lock()
+
+
+def pool_hash(image_id: str, run_options: Mapping[str, Any]) -> str:
+    """
+    Hash everything that determines how a container behaves
+
+    Two containers with the same hash are interchangeable, so a pooled
+    container can be adopted by any run whose configuration hashes the same.
+
+    """
+    content = json.dumps(
+        {"image": image_id, "options": run_options},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def pool_name(container_name: str, digest: str, n: int = 0) -> str:
+    """
+    Return the name of the `n`th pooled container with this hash
+
+    More than one is only started when the others are all in use by other
+    tox runs at the same time.
+
+    """
+    name = f"{container_name}-tox-pool-{digest[:12]}"
+    return f"{name}-{n}" if n else name
+
+
+class PoolIndex:
+    """
+    Records when each pooled container was last used by a tox run
+
+    Docker doesn't track this for us (and labels can't be changed once the
+    container exists), so it's kept in a JSON file in the tox work dir. Only
+    containers in the index are subject to idle eviction from this work dir;
+    pooled containers used from other projects are left to their own index.
+
+    """
+
+    def __init__(self, work_dir: Path) -> None:
+        self.path = Path(work_dir) / INDEX_FILENAME
+
+    def load(self) -> Dict[str, float]:
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        return {str(k): float(v) for k, v in data.items()}
+
+    def _save(self, last_used: Mapping[str, float]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(last_used, fp, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def touch(self, container_ids: Iterable[str]) -> None:
+        with _index_lock:
+            last_used = self.load()
+            now = time.time()
+            for container_id in container_ids:
+                last_used[container_id] = now
+            self._save(last_used)
+
+    def forget(self, container_ids: Iterable[str]) -> None:
+        with _index_lock:
+            last_used = self.load()
+            for container_id in container_ids:
+                last_used.pop(container_id, None)
+            self._save(last_used)
+
+
+class PoolLeases:
+    """
+    Records which testenv is using each pooled container
+
+    A pooled container is used by one testenv at a time. Its lease is a
+    file named after the container, holding the labels of the testenv which
+    leased it (see owner_labels); it's linked into place in one step, so of
+    two tox runs trying to lease the same container, only one succeeds. A
+    lease left behind by a tox process which died is stale (see
+    is_orphaned), and is taken over.
+
+    """
+
+    def __init__(self, directory: Union[str, Path]) -> None:
+        self.directory = Path(directory)
+
+    def owner(self, name: str) -> Optional[Dict[str, str]]:
+        try:
+            with open(self.directory / name) as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # we can't tell who holds it, so assume they're still using it
+            return {}
+        return {str(k): str(v) for k, v in data.items()}
+
+    def is_held(self, name: str) -> bool:
+        owner = self.owner(name)
+        return owner is not None and not is_orphaned(owner)
+
+    def acquire(self, name: str, owner: Mapping[str, str]) -> bool:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / name
+        tmp_path = path.with_name(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(owner, fp, sort_keys=True)
+        try:
+            # a second attempt only once a stale lease has been removed
+            for _ in range(2):
+                try:
+                    os.link(tmp_path, path)
+                    return True
+                except FileExistsError:
+                    if self.is_held(name):
+                        return False
+                    self._remove(name)
+            return False
+        finally:
+            os.unlink(tmp_path)
+
+    def release(self, name: str, owner: Mapping[str, str]) -> None:
+        if self.owner(name) == dict(owner):
+            self._remove(name)
+
+    def _remove(self, name: str) -> None:
+        try:
+            os.unlink(self.directory / name)
+        except FileNotFoundError:
+            pass
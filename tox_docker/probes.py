@@ -0,0 +1,85 @@
+from typing import Callable, Optional
+from urllib.request import urlopen
+import socket
+import time
+
+# bounds for the delay between attempts of a readiness probe; we want to
+# notice a service becoming ready within milliseconds
+PROBE_MIN_DELAY = 0.005
+PROBE_MAX_DELAY = 0.25
+
+# how long a single attempt may take before it counts as a failure
+ATTEMPT_TIMEOUT = 1.0
+
+
+def tcp_ready(host: str, port: int) -> bool:
+    """
+    Check that a TCP connection to the service is accepted and kept open
+
+    Docker's userland proxy accepts connections to a published port even
+    when nothing in the container is listening, and then closes them, so a
+    connection which is closed straight away doesn't count.
+
+    """
+    try:
+        with socket.create_connection((host, port), timeout=ATTEMPT_TIMEOUT) as sock:
+            sock.settimeout(PROBE_MAX_DELAY)
+            try:
+                return sock.recv(1) != b""
+            except socket.timeout:
+                # connected, and the service is waiting for us to talk
+                return True
+    except OSError:
+        return False
+
+
+def udp_ready(host: str, port: int) -> bool:
+    """
+    Check that the service replies to a datagram (eg an echo service)
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(PROBE_MAX_DELAY)
+        try:
+            sock.sendto(b"\n", (host, port))
+            sock.recvfrom(1024)
+        except OSError:
+            return False
+    return True
+
+
+def http_ready(host: str, port: int, path: str) -> bool:
+    """
+    Check that a GET of `path` succeeds (with a status below 400)
+    """
+    try:
+        with urlopen(f"http://{host}:{port}{path}", timeout=ATTEMPT_TIMEOUT) as resp:
+            return bool(resp.status < 400)
+    except OSError:
+        # includes HTTPError, raised for statuses of 400 and above
+        return False
+
+
+def wait_until(
+    check: Callable[[], bool],
+    timeout: float,
+    watch: Optional[Callable[[], None]] = None,
+) -> bool:
+    """
+    Call `check` until it returns True, or until `timeout` seconds pass
+
+    The delay between attempts starts at a few milliseconds and backs off
+    exponentially. Returns whether `check` succeeded in time. If given,
+    `watch` is called before each attempt, and may raise to give up early.
+
+    """
+    deadline = time.monotonic() + timeout
+    delay = PROBE_MIN_DELAY
+    while True:
+        if watch:
+            watch()
+        if check():
+            return True
+        if time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, PROBE_MAX_DELAY)
@@ -0,0 +1,127 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import json
+import threading
+import time
+
+# the phases of a container's lifecycle we time, in the order they happen
+PHASES = (
+    "resolve",
+    "pull",
+    "build",
+    "create",
+    "start",
+    "healthy",
+    "ready",
+    "init",
+    "commit",
+    "checkpoint",
+    "export",
+    "remove",
+)
+
+# the testenv on whose behalf the current thread is working; tox-docker's
+# worker threads run with a copy of the submitting thread's context
+current_env: ContextVar[str] = ContextVar("current_env", default="")
+
+
+class Timing(NamedTuple):
+    env: str
+    container: str
+    phase: str
+    started: float
+    duration: float
+
+
+class TimingReport:
+    """
+    Collects how long each phase of each container's lifecycle takes
+
+    The timings of a whole tox session are gathered here, from all testenvs
+    and threads, and reported at the end of the session.
+
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.timings: List[Timing] = []
+
+    def record(
+        self, container: str, phase: str, started: float, duration: float
+    ) -> None:
+        timing = Timing(current_env.get(), container, phase, started, duration)
+        with self._lock:
+            self.timings.append(timing)
+
+    @contextmanager
+    def timed(self, container: str, phase: str) -> Iterator[None]:
+        started = time.time()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(container, phase, started, time.monotonic() - start)
+
+    def totals(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """
+        Return the total time spent in each phase, by (env, container)
+        """
+        totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+        with self._lock:
+            timings = list(self.timings)
+        for timing in timings:
+            phases = totals.setdefault((timing.env, timing.container), {})
+            phases[timing.phase] = phases.get(timing.phase, 0) + timing.duration
+        return totals
+
+    def as_json(self) -> Dict[str, Any]:
+        with self._lock:
+            timings = list(self.timings)
+        return {
+            "timings": [timing._asdict() for timing in timings],
+            "totals": [
+                {"env": env, "container": container, "phases": phases}
+                for (env, container), phases in sorted(self.totals().items())
+            ],
+        }
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as fp:
+            json.dump(self.as_json(), fp, indent=2)
+
+    def summary(self) -> List[str]:
+        """
+        Format the totals as a table, one line per container
+        """
+        totals = self.totals()
+        if not totals:
+            return []
+
+        phases = [p for p in PHASES if any(p in t for t in totals.values())]
+        header = ["env", "container"] + phases
+        rows = []
+        for env, container in sorted(totals):
+            seconds = [totals[env, container].get(p) for p in phases]
+            rows.append([env, container] + [format_seconds(s) for s in seconds])
+        return format_table(header, rows)
+
+
+def format_table(header: List[str], rows: List[List[str]]) -> List[str]:
+    """
+    Format `rows` under `header` as lines of left-aligned columns
+    """
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    return [
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in [header] + rows
+    ]
+
+
+def format_seconds(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    return f"{seconds:.2f}s"
+
+
+timings = TimingReport()
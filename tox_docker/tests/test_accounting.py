@@ -0,0 +1,126 @@
+from datetime import timedelta
+from typing import Any
+from unittest.mock import MagicMock
+import logging
+
+import pytest
+
+from tox_docker.accounting import ApiCall, ApiCallStats, endpoint_name
+
+
+@pytest.mark.parametrize(
+    "method,url,expected",
+    [
+        (
+            "GET",
+            "http+docker://localhost/v1.45/containers/json",
+            "GET /containers/json",
+        ),
+        (
+            "GET",
+            "http+docker://localhost/v1.45/containers/c0ffee/json",
+            "GET /containers/{id}/json",
+        ),
+        (
+            "DELETE",
+            "http+docker://localhost/v1.45/containers/c0ffee?v=True&force=True",
+            "DELETE /containers/{id}",
+        ),
+        (
+            "GET",
+            "http+docker://localhost/v1.45/images/library/postgres:16/json",
+            "GET /images/{name}/json",
+        ),
+        (
+            "DELETE",
+            "http+docker://localhost/v1.45/containers/c0ffee/checkpoints/tox-docker-1",
+            "DELETE /containers/{id}/checkpoints/{name}",
+        ),
+        ("POST", "http+docker://localhost/v1.45/images/create", "POST /images/create"),
+        ("GET", "http+docker://localhost/version", "GET /version"),
+    ],
+)
+def test_endpoint_names_replace_ids(method: str, url: str, expected: str) -> None:
+    assert endpoint_name(method, url) == expected
+
+
+def make_response(
+    method: str, url: str, seconds: float, body: Any, length: str, status: int
+) -> Any:
+    response = MagicMock()
+    response.request.method = method
+    response.request.url = url
+    response.request.body = body
+    response.elapsed = timedelta(seconds=seconds)
+    response.headers = {"Content-Length": length} if length else {}
+    response.status_code = status
+    return response
+
+
+def test_responses_are_counted_per_endpoint() -> None:
+    stats = ApiCallStats()
+    url = "http+docker://localhost/v1.45/containers/{}/json"
+    stats.record_response(make_response("GET", url.format("a"), 0.02, None, "10", 200))
+    stats.record_response(make_response("GET", url.format("b"), 0.2, None, "5", 404))
+    stats.record_response(
+        make_response(
+            "POST",
+            "http+docker://localhost/v1.45/containers/create",
+            0.1,
+            b"{}",
+            "",
+            201,
+        )
+    )
+
+    containers = stats.endpoints["GET /containers/{id}/json"]
+    assert containers.calls == 2
+    assert containers.errors == 1
+    assert containers.max_seconds == 0.2
+    assert containers.bytes_received == 15
+    assert stats.endpoints["POST /containers/create"].bytes_sent == 2
+    assert stats.total_calls == 3
+    assert stats.summary()[0].split() == [
+        "endpoint",
+        "calls",
+        "errors",
+        "total",
+        "max",
+        "sent",
+        "received",
+    ]
+    assert stats.summary()[1].startswith("GET /containers/{id}/json  2")
+
+
+def test_metrics_have_cumulative_histogram_buckets() -> None:
+    stats = ApiCallStats()
+    for seconds in (0.001, 0.03, 20.0):
+        stats.record(ApiCall("GET /_ping", seconds, 0, 2, False))
+
+    metrics = stats.metrics().splitlines()
+    bucket = (
+        'tox_docker_api_call_duration_seconds_bucket{method="GET",endpoint="/_ping"'
+    )
+    assert f'{bucket},le="0.005"}} 1' in metrics
+    assert f'{bucket},le="0.05"}} 2' in metrics
+    assert f'{bucket},le="10.0"}} 2' in metrics
+    assert f'{bucket},le="+Inf"}} 3' in metrics
+    assert "# TYPE tox_docker_api_calls_total counter" in metrics
+    assert 'tox_docker_api_calls_total{method="GET",endpoint="/_ping"} 3' in metrics
+    assert metrics[-1] != "# EOF"
+
+    openmetrics = stats.metrics(openmetrics=True).splitlines()
+    assert "# TYPE tox_docker_api_calls counter" in openmetrics
+    assert openmetrics[-1] == "# EOF"
+
+
+def test_budget_warns_once(caplog: pytest.LogCaptureFixture) -> None:
+    stats = ApiCallStats()
+    stats.budget = 2
+    with caplog.at_level(logging.WARNING):
+        for _ in range(4):
+            stats.record(ApiCall("GET /_ping", 0.001, 0, 2, False))
+
+    assert stats.budget_exceeded
+    warnings = [r for r in caplog.records if "--docker-api-budget" in r.getMessage()]
+    assert len(warnings) == 1
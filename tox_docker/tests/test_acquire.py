@@ -0,0 +1,41 @@
+from typing import List
+from unittest.mock import patch
+import threading
+import time
+
+import pytest
+
+from tox_docker.config import ContainerConfig
+from tox_docker.plugin import docker_build_or_pull_all
+from tox_docker.tests.util import make_config
+
+
+def test_images_are_acquired_concurrently() -> None:
+    configs = [make_config(f"image{i}") for i in range(3)]
+    barrier = threading.Barrier(len(configs), timeout=5)
+
+    def fake_build_or_pull(container_config: ContainerConfig) -> None:
+        # deadlocks (and times out) unless all three run at the same time
+        barrier.wait()
+
+    with patch("tox_docker.plugin.docker_build_or_pull", fake_build_or_pull):
+        docker_build_or_pull_all(configs, concurrency=3)
+
+
+def test_a_failure_cancels_pending_acquisitions() -> None:
+    configs = [make_config(f"image{i}") for i in range(4)]
+    acquired: List[str] = []
+
+    def fake_build_or_pull(container_config: ContainerConfig) -> None:
+        if container_config.name == "image0":
+            raise RuntimeError("pull failed")
+        time.sleep(0.1)
+        acquired.append(container_config.name)
+
+    with patch("tox_docker.plugin.docker_build_or_pull", fake_build_or_pull):
+        with pytest.raises(RuntimeError):
+            docker_build_or_pull_all(configs, concurrency=1)
+
+    # the single worker may have picked up the next job before the failure
+    # was noticed, but everything after that must have been cancelled
+    assert len(acquired) <= 1
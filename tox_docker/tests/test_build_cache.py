@@ -0,0 +1,53 @@
+from pathlib import Path
+
+from tox_docker.config import ContainerConfig, Dockerfile
+from tox_docker.plugin import build_digest
+from tox_docker.tests.util import make_config
+
+
+def build_config(context: Path, target: str = "") -> ContainerConfig:
+    return make_config(
+        "app",
+        image=None,
+        dockerfile=Dockerfile(str(context / "Dockerfile")),
+        dockerfile_target=target,
+    )
+
+
+def make_context(tmp_path: Path) -> Path:
+    (tmp_path / "Dockerfile").write_text("FROM alpine\nCOPY app.py /\n")
+    (tmp_path / "app.py").write_text("print('hello')\n")
+    (tmp_path / "notes.txt").write_text("not part of the image\n")
+    (tmp_path / ".dockerignore").write_text("# comment\nnotes.txt\n")
+    return tmp_path
+
+
+def test_build_digest_is_stable(tmp_path: Path) -> None:
+    context = make_context(tmp_path)
+    assert build_digest(build_config(context)) == build_digest(build_config(context))
+
+
+def test_build_digest_changes_with_context_files(tmp_path: Path) -> None:
+    context = make_context(tmp_path)
+    before = build_digest(build_config(context))
+
+    (context / "app.py").write_text("print('goodbye')\n")
+    assert build_digest(build_config(context)) != before
+
+
+def test_build_digest_changes_with_dockerfile_and_target(tmp_path: Path) -> None:
+    context = make_context(tmp_path)
+    before = build_digest(build_config(context))
+
+    assert build_digest(build_config(context, target="test")) != before
+
+    (context / "Dockerfile").write_text("FROM alpine:3\nCOPY app.py /\n")
+    assert build_digest(build_config(context)) != before
+
+
+def test_build_digest_ignores_dockerignored_files(tmp_path: Path) -> None:
+    context = make_context(tmp_path)
+    before = build_digest(build_config(context))
+
+    (context / "notes.txt").write_text("changed, but still ignored\n")
+    assert build_digest(build_config(context)) == before
@@ -0,0 +1,46 @@
+from unittest.mock import MagicMock
+
+from tox_docker.config import ContainerConfig
+from tox_docker.plugin import (
+    checkpoint_name,
+    docker_checkpoint,
+    docker_initialize,
+)
+from tox_docker.tests.util import make_config
+
+
+def kafka_config(
+    image_id: str = "sha256:aaa", config_hash: str = "c0ffee"
+) -> ContainerConfig:
+    config = make_config(
+        "kafka",
+        "apache/kafka:3.7.0",
+        init_commands=["create-topics"],
+        checkpoint=True,
+        checkpoint_dir="/var/tmp/checkpoints",
+    )
+    config.runnable_image = MagicMock(id=image_id)
+    config.config_hash = config_hash
+    return config
+
+
+def test_checkpoint_name_depends_on_image_and_config() -> None:
+    name = checkpoint_name(kafka_config())
+
+    assert name == checkpoint_name(kafka_config())
+    assert name != checkpoint_name(kafka_config(image_id="sha256:bbb"))
+    assert name != checkpoint_name(kafka_config(config_hash="decaf"))
+    assert name.startswith("kafka-")
+
+
+def test_restored_containers_are_not_initialized_or_checkpointed_again() -> None:
+    config = kafka_config()
+    config.created = True
+    config.restored = True
+    container = MagicMock()
+
+    docker_initialize(config, container)
+    docker_checkpoint(config, container)
+
+    container.exec_run.assert_not_called()
+    container.client.api.request.assert_not_called()
@@ -0,0 +1,61 @@
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+import threading
+
+import pytest
+
+from tox_docker.client import close_docker_client, get_docker_client
+
+
+def test_client_is_created_once_and_shared_between_threads() -> None:
+    close_docker_client()
+    clients = []
+
+    with patch("docker.from_env", return_value=MagicMock()) as from_env:
+        threads = [
+            threading.Thread(target=lambda: clients.append(get_docker_client()))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert from_env.call_count == 1
+        assert all(client is clients[0] for client in clients)
+        close_docker_client()
+
+    clients[0].close.assert_called_once_with()
+
+
+def test_closed_client_is_recreated_on_next_use() -> None:
+    close_docker_client()
+
+    with patch("docker.from_env", side_effect=[MagicMock(), MagicMock()]):
+        first = get_docker_client()
+        close_docker_client()
+        second = get_docker_client()
+        close_docker_client()
+
+    assert first is not second
+
+
+def test_tcp_hosts_use_tls_settings_from_the_environment(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.setenv("DOCKER_TLS_VERIFY", "1")
+    monkeypatch.setenv("DOCKER_CERT_PATH", str(tmp_path))
+    for name in ("ca.pem", "cert.pem", "key.pem"):
+        (tmp_path / name).touch()
+    close_docker_client()
+
+    with patch("tox_docker.client.DockerClient") as docker_client:
+        get_docker_client("tcp://build2:2376")
+        get_docker_client("ssh://build3")
+        close_docker_client()
+
+    tcp, ssh = docker_client.call_args_list
+    tls = tcp.kwargs["tls"]
+    assert tls.ca_cert == str(tmp_path / "ca.pem")
+    assert tls.cert == (str(tmp_path / "cert.pem"), str(tmp_path / "key.pem"))
+    assert "tls" not in ssh.kwargs
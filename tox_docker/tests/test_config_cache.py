@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Set
+
+from tox_docker.config import Image, parse_container_config
+
+DEFAULTS: Dict[str, Any] = {
+    "dockerfile": None,
+    "dockerfile_target": "",
+    "dockerfile_pull": True,
+    "pull_policy": "if-not-present",
+    "scope": "env",
+    "environment": {},
+    "expose": [],
+    "publish": True,
+    "host_var": None,
+    "links": [],
+    "volumes": [],
+    "healthcheck_cmd": "",
+    "healthcheck_interval": 0,
+    "healthcheck_timeout": 0,
+    "healthcheck_start_period": 0,
+    "healthcheck_retries": 0,
+    "ready_probes": [],
+    "ready_timeout": 60,
+    "startup_grace": 0.5,
+    "mem_limit": "",
+    "cpus": 0,
+    "cpu_shares": 0,
+    "cpuset_cpus": "",
+    "shm_size": "",
+    "ulimits": [],
+    "init_commands": [],
+    "snapshot": False,
+    "checkpoint": False,
+    "docker_hosts": [],
+    "placement": "",
+}
+
+OPTIONS = SimpleNamespace(
+    docker_dont_stop=[],
+    docker_stop_timeout=0,
+    docker_reuse=False,
+    docker_pull_stall_timeout=120,
+    docker_pull_retries=3,
+    docker_host=[],
+    docker_placement="containers",
+    docker_checkpoint_dir="",
+)
+
+
+class NotARealLoader(object):
+    def __init__(self, raw: Dict[str, str]) -> None:
+        self.raw = raw
+
+    def found_keys(self) -> Set[str]:
+        return set(self.raw)
+
+    def load_raw(self, key: str, conf: Any, env_name: Optional[str]) -> str:
+        return self.raw[key]
+
+
+class NotARealDockerConfigSet(object):
+    def __init__(self, name: str, image: str) -> None:
+        self.name = name
+        self.loaders = [NotARealLoader({"image": image})]
+        self._conf = SimpleNamespace(options=OPTIONS)
+        self.values = dict(DEFAULTS, image=Image(image))
+        self.loaded: List[str] = []
+
+    def __getitem__(self, key: str) -> Any:
+        self.loaded.append(key)
+        return self.values[key]
+
+
+def test_each_configuration_is_parsed_once() -> None:
+    first = NotARealDockerConfigSet("db", "postgres:16")
+    second = NotARealDockerConfigSet("db", "postgres:16")
+
+    one: Any = parse_container_config(first)  # type: ignore
+    two: Any = parse_container_config(second)  # type: ignore
+
+    assert first.loaded
+    assert not second.loaded
+    assert one.config_hash == two.config_hash
+    assert str(two.image) == "postgres:16"
+
+    # but each testenv gets its own copy to record its state on
+    one.created = True
+    assert two is not one
+    assert not two.created
+
+
+def test_changed_configuration_is_parsed_again() -> None:
+    old = parse_container_config(
+        NotARealDockerConfigSet("cache", "redis:6")  # type: ignore
+    )
+    new = parse_container_config(
+        NotARealDockerConfigSet("cache", "redis:7")  # type: ignore
+    )
+
+    assert old.config_hash != new.config_hash
+    assert str(new.image) == "redis:7"
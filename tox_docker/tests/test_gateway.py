@@ -48,3 +48,12 @@ def test_gateway_ip_is_looked_up_from_hostname(sys_platform: str) -> None:
     with sys_platform_as(sys_platform):
         with patch.dict("os.environ", {"TOX_DOCKER_GATEWAY": "localhost"}):
             assert get_gateway_ip(container) in {"127.0.0.1", "::1"}
+
+
+@pytest.mark.parametrize("sys_platform", ["linux2", "darwin"])
+def test_gateway_ip_is_the_remote_docker_hosts_address(sys_platform: str) -> None:
+    container = NotARealContainer()
+    with sys_platform_as(sys_platform):
+        with patch.dict("os.environ", {"TOX_DOCKER_GATEWAY": "192.168.1.1"}):
+            ip = get_gateway_ip(container, "tcp://localhost:2376")
+    assert ip in {"127.0.0.1", "::1"}
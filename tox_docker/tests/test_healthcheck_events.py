@@ -0,0 +1,180 @@
+from typing import Any, Dict, Iterator, List, Optional
+from unittest.mock import patch
+import threading
+
+import pytest
+
+from tox_docker.plugin import (
+    check_running,
+    ContainerFailed,
+    docker_health_check_all,
+    HealthCheckFailed,
+)
+from tox_docker.tests.util import make_config
+
+
+class NotARealContainer(object):
+    def __init__(
+        self, id: str, statuses: List[str], exit_code: Optional[int] = None
+    ) -> None:
+        self.id = id
+        self.statuses = statuses
+        self.exit_code = exit_code
+        self.reloads = 0
+        self.attrs: Dict[str, Any] = {"State": {"Health": {"Status": "starting"}}}
+
+    def reload(self) -> None:
+        status = self.statuses[min(self.reloads, len(self.statuses) - 1)]
+        if "Health" in self.attrs["State"]:
+            self.attrs["State"]["Health"]["Status"] = status
+        self.reloads += 1
+        if self.exit_code is not None and self.reloads == len(self.statuses):
+            self.attrs["State"].update(Status="exited", ExitCode=self.exit_code)
+
+
+class NotARealEventStream(object):
+    def __init__(self, events: List[Dict[str, Any]], block: bool = False) -> None:
+        self.events = iter(events)
+        # whether, once out of events, to wait for more until closed
+        self.block = block
+        self._closed = threading.Event()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        try:
+            return next(self.events)
+        except StopIteration:
+            if self.block:
+                self._closed.wait()
+            raise
+
+    def close(self) -> None:
+        self._closed.set()
+
+
+class NotARealDockerClient(object):
+    def __init__(self, stream: NotARealEventStream) -> None:
+        self.stream = stream
+        self.filters: Dict[str, Any] = {}
+
+    def events(self, decode: bool, filters: Dict[str, Any]) -> NotARealEventStream:
+        self.filters = filters
+        return self.stream
+
+
+def event(container_id: str, action: str) -> Dict[str, Any]:
+    return {"Type": "container", "Action": action, "Actor": {"ID": container_id}}
+
+
+def health_event(container_id: str, status: str) -> Dict[str, Any]:
+    return event(container_id, f"health_status: {status}")
+
+
+def test_health_is_awaited_from_the_events_stream() -> None:
+    one = NotARealContainer("one", ["starting"])
+    two = NotARealContainer("two", ["healthy"])
+    stream = NotARealEventStream(
+        [
+            health_event("someone-else", "unhealthy"),
+            health_event("one", "healthy"),
+        ]
+    )
+    client = NotARealDockerClient(stream)
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=client):
+        docker_health_check_all([(make_config("one"), one), (make_config("two"), two)])
+
+    assert client.filters["container"] == ["one", "two"]
+    assert one.reloads == 1
+    assert two.reloads == 1
+    assert stream.closed
+
+
+def test_unhealthy_event_fails_the_health_check() -> None:
+    one = NotARealContainer("one", ["starting"])
+    client = NotARealDockerClient(
+        NotARealEventStream([health_event("one", "unhealthy")])
+    )
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=client):
+        with pytest.raises(HealthCheckFailed):
+            docker_health_check_all([(make_config("one"), one)])
+
+
+def test_health_falls_back_to_polling_when_events_stream_ends() -> None:
+    one = NotARealContainer("one", ["starting", "starting", "starting", "healthy"])
+    client = NotARealDockerClient(NotARealEventStream([]))
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=client):
+        docker_health_check_all([(make_config("one"), one)])
+
+    assert one.reloads == 4
+
+
+def test_a_quiet_events_stream_is_not_waited_on_forever() -> None:
+    one = NotARealContainer("one", ["starting", "starting", "healthy"])
+    stream = NotARealEventStream([], block=True)
+    client = NotARealDockerClient(stream)
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=client), patch(
+        "tox_docker.plugin.POLL_MAX_DELAY", 0.01
+    ):
+        docker_health_check_all([(make_config("one"), one)])
+
+    assert one.reloads == 3
+    assert stream.closed
+
+
+def test_container_which_dies_fails_without_waiting_for_health() -> None:
+    one = NotARealContainer("one", ["starting", "starting"], exit_code=137)
+    stream = NotARealEventStream([event("one", "die"), health_event("one", "healthy")])
+    client = NotARealDockerClient(stream)
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=client):
+        with pytest.raises(ContainerFailed, match="exited with code 137"):
+            docker_health_check_all([(make_config("one"), one)])
+
+    assert client.filters["event"] == ["health_status", "die"]
+
+
+def test_containers_without_health_checks_are_watched_too() -> None:
+    one = NotARealContainer("one", ["starting"])
+    two = NotARealContainer("two", ["starting"], exit_code=1)
+    del two.attrs["State"]["Health"]
+    client = NotARealDockerClient(NotARealEventStream([]))
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=client):
+        with pytest.raises(ContainerFailed, match="exited with code 1"):
+            docker_health_check_all(
+                [(make_config("one"), one), (make_config("two"), two)]
+            )
+
+    assert client.filters["container"] == ["one", "two"]
+
+
+@pytest.mark.parametrize(
+    "state,message",
+    [
+        ({"Status": "exited", "ExitCode": 1}, "exited with code 1"),
+        ({"Status": "exited", "ExitCode": 137, "OOMKilled": True}, "out of memory"),
+        ({"Status": "restarting", "ExitCode": 2}, "is restarting"),
+    ],
+)
+def test_failed_containers(state: Dict[str, Any], message: str) -> None:
+    container = NotARealContainer("one", ["starting"])
+    container.attrs["State"] = state
+
+    with pytest.raises(ContainerFailed, match=message):
+        check_running(make_config("one"), container)  # type: ignore
+
+
+def test_running_containers_have_not_failed() -> None:
+    container = NotARealContainer("one", ["starting"])
+    container.attrs["State"]["Status"] = "running"
+    check_running(make_config("one"), container)  # type: ignore
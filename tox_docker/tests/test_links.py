@@ -1,7 +1,13 @@
 import pytest
 
-from tox_docker.config import Link, runas_name
-from tox_docker.tests.util import find_container
+from tox_docker.config import ContainerConfig, Link, runas_name
+from tox_docker.plugin import (
+    InvalidLinks,
+    network_aliases,
+    network_name,
+    start_order,
+)
+from tox_docker.tests.util import find_container, make_config
 
 
 def test_linked_containers_can_communicate() -> None:
@@ -23,3 +29,59 @@ def test_link_parsing() -> None:
 def test_link_parsing_rejects_trailing_colon() -> None:
     with pytest.raises(ValueError):
         Link("httpd:")
+
+
+def linking(name: str, *links: str) -> ContainerConfig:
+    return make_config(name, links=[Link(link) for link in links])
+
+
+def test_start_order_groups_independent_containers_into_waves() -> None:
+    configs = [
+        linking("app", "db", "cache:redis"),
+        linking("db"),
+        linking("cache"),
+        linking("proxy", "app"),
+    ]
+
+    waves = [[c.name for c in wave] for wave in start_order(configs)]
+    assert waves == [["db", "cache"], ["app"], ["proxy"]]
+
+
+def test_start_order_rejects_links_to_unlisted_containers() -> None:
+    with pytest.raises(InvalidLinks, match="'db', which is not in the docker= list"):
+        start_order([linking("app", "db")])
+
+
+def test_start_order_reports_circular_links() -> None:
+    configs = [
+        linking("one", "three"),
+        linking("two", "one"),
+        linking("three", "two"),
+        linking("four"),
+    ]
+
+    with pytest.raises(InvalidLinks) as excinfo:
+        start_order(configs)
+
+    assert str(excinfo.value) == (
+        "Containers have circular links: 'one' -> 'three' -> 'two' -> 'one'"
+    )
+
+
+def test_network_aliases_include_name_and_link_aliases() -> None:
+    configs = [
+        linking("app", "db", "cache:redis"),
+        linking("worker", "db:database", "cache:redis"),
+        linking("db"),
+        linking("cache"),
+    ]
+
+    aliases = network_aliases(configs)
+    assert aliases[runas_name("app")] == ["app"]
+    assert aliases[runas_name("db")] == ["db", "database"]
+    assert aliases[runas_name("cache")] == ["cache", "redis"]
+
+
+def test_network_name_is_safe_for_docker() -> None:
+    name = network_name("py311-django{3,4}")
+    assert name.startswith("tox-docker-py311-django_3_4_")
@@ -0,0 +1,80 @@
+from pathlib import Path
+from typing import Any, Iterator, List, Optional
+import threading
+
+from tox_docker.logs import ContainerLog, LOG_BACKUPS
+
+
+class NotARealStream(object):
+    def __init__(self, chunks: List[bytes], hang: bool = False) -> None:
+        self.chunks = chunks
+        self.closed = threading.Event()
+        self.hang = hang
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self.chunks
+        if self.hang:
+            # like following a container which keeps running
+            self.closed.wait()
+            raise OSError("stream closed")
+
+    def close(self) -> None:
+        self.closed.set()
+
+
+class NotARealContainer(object):
+    id = "c0ffee"
+
+    def __init__(self, stream: NotARealStream) -> None:
+        self.stream = stream
+        self.since: Optional[int] = None
+
+    def logs(self, stream: bool, follow: bool, since: Optional[int]) -> Any:
+        self.since = since
+        return self.stream
+
+
+def make_log(
+    tmp_path: Path, stream: NotARealStream, max_bytes: int = 1000, tail: int = 3
+) -> ContainerLog:
+    container: Any = NotARealContainer(stream)
+    return ContainerLog(container, tmp_path / "docker-db.log", max_bytes, tail)
+
+
+def test_logs_are_written_to_file(tmp_path: Path) -> None:
+    container_log = make_log(tmp_path, NotARealStream([b"starting\n", b"ready\n"]))
+    container_log.start()
+    container_log.close(timeout=5)
+
+    assert (tmp_path / "docker-db.log").read_bytes() == b"starting\nready\n"
+
+
+def test_tail_keeps_only_the_last_lines(tmp_path: Path) -> None:
+    chunks = [f"line {i}\n".encode() for i in range(100)] + [b"partial"]
+    container_log = make_log(tmp_path, NotARealStream(chunks))
+    container_log.start()
+    container_log.close(timeout=5)
+
+    assert container_log.tail() == ["line 98", "line 99", "partial"]
+
+
+def test_log_files_are_rotated(tmp_path: Path) -> None:
+    chunks = [bytes([ord("a") + i]) * 40 for i in range(6)]
+    container_log = make_log(tmp_path, NotARealStream(chunks), max_bytes=100)
+    container_log.start()
+    container_log.close(timeout=5)
+
+    assert (tmp_path / "docker-db.log").read_bytes() == b"e" * 40 + b"f" * 40
+    assert (tmp_path / "docker-db.log.1").read_bytes() == b"c" * 40 + b"d" * 40
+    assert (tmp_path / "docker-db.log.2").read_bytes() == b"a" * 40 + b"b" * 40
+    assert not (tmp_path / f"docker-db.log.{LOG_BACKUPS + 1}").exists()
+
+
+def test_close_stops_following_running_containers(tmp_path: Path) -> None:
+    stream = NotARealStream([b"still running\n"], hang=True)
+    container_log = make_log(tmp_path, stream)
+    container_log.start()
+    container_log.close()
+
+    assert stream.closed.is_set()
+    assert (tmp_path / "docker-db.log").read_bytes() == b"still running\n"
@@ -0,0 +1,125 @@
+from typing import Any, Dict, List, Mapping
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from tox_docker.config import ContainerConfig, Link, Volume
+from tox_docker.placement import host_address, place_containers, release_memory
+from tox_docker.plugin import docker_run
+from tox_docker.tests.util import make_config
+
+HOST_A = "tcp://build1:2376"
+HOST_B = "tcp://build2:2376"
+BOTH = [HOST_A, HOST_B]
+
+
+def fake_hosts(info: Mapping[str, Dict[str, Any]]) -> Any:
+    clients: Dict[str, MagicMock] = {}
+    for docker_host, host_info in info.items():
+        clients[docker_host] = MagicMock()
+        clients[docker_host].info.return_value = host_info
+    return patch(
+        "tox_docker.placement.get_docker_client",
+        side_effect=lambda docker_host: clients[docker_host],
+    )
+
+
+def placed(configs: List[ContainerConfig]) -> Dict[str, str]:
+    return {c.name: c.docker_host for c in configs}
+
+
+def test_containers_go_to_the_host_with_fewest_running() -> None:
+    configs = [
+        make_config("db", docker_hosts=BOTH),
+        make_config("cache", docker_hosts=BOTH),
+        make_config("queue", docker_hosts=BOTH),
+    ]
+    info = {HOST_A: {"ContainersRunning": 2}, HOST_B: {"ContainersRunning": 0}}
+    with fake_hosts(info):
+        place_containers(configs)
+
+    # build2 is less busy until it has two containers too
+    assert placed(configs) == {"db": HOST_B, "cache": HOST_B, "queue": HOST_A}
+
+
+def test_containers_go_to_the_host_with_most_memory() -> None:
+    configs = [
+        make_config("db", placement="memory", mem_limit="3g", docker_hosts=BOTH),
+        make_config("cache", placement="memory", mem_limit="1g", docker_hosts=BOTH),
+    ]
+    info = {HOST_A: {"MemTotal": 4 << 30}, HOST_B: {"MemTotal": 2 << 30}}
+    with fake_hosts(info):
+        place_containers(configs)
+    for config in configs:
+        release_memory(config)
+
+    assert placed(configs) == {"db": HOST_A, "cache": HOST_B}
+
+
+def test_linked_containers_are_placed_together() -> None:
+    configs = [
+        make_config("app", links=[Link("db")], docker_hosts=BOTH),
+        make_config("db", docker_hosts=[HOST_B]),
+    ]
+    with fake_hosts({}):
+        place_containers(configs)
+
+    assert placed(configs) == {"app": HOST_B, "db": HOST_B}
+
+
+def test_linked_containers_need_a_host_in_common() -> None:
+    configs = [
+        make_config("app", links=[Link("db")], docker_hosts=[HOST_A]),
+        make_config("db", docker_hosts=[HOST_B]),
+    ]
+    with pytest.raises(ValueError, match="none in common"):
+        place_containers(configs)
+
+
+def test_session_containers_always_use_their_first_host() -> None:
+    configs = [make_config("db", scope="session", docker_hosts=BOTH)]
+    info = {HOST_A: {"ContainersRunning": 9}, HOST_B: {"ContainersRunning": 0}}
+    with fake_hosts(info) as get_docker_client:
+        place_containers(configs)
+
+    assert placed(configs) == {"db": HOST_A}
+    get_docker_client.assert_not_called()
+
+
+def test_default_docker_host_needs_no_placement() -> None:
+    configs = [make_config("db", docker_hosts=[])]
+    with fake_hosts({}) as get_docker_client:
+        place_containers(configs)
+
+    assert placed(configs) == {"db": ""}
+    get_docker_client.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "docker_host,address",
+    [
+        ("", ""),
+        ("unix:///var/run/docker.sock", ""),
+        ("tcp://build1:2376", "build1"),
+        ("ssh://ci@build2", "build2"),
+    ],
+)
+def test_host_address(docker_host: str, address: str) -> None:
+    assert host_address(docker_host) == address
+
+
+@pytest.mark.parametrize("docker_host,checked", [("", True), (HOST_A, False)])
+def test_bind_mount_sources_are_only_checked_on_local_hosts(
+    docker_host: str, checked: bool
+) -> None:
+    config = make_config("db", volumes=[Volume("bind:ro:/no/such/dir:/data")])
+    config.docker_host = docker_host
+    config.runnable_image = MagicMock()
+
+    with patch("tox_docker.plugin.docker_create_and_start") as create:
+        if checked:
+            with pytest.raises(ValueError, match="does not exist"):
+                docker_run(config)
+        else:
+            docker_run(config)
+            create.assert_called_once()
@@ -0,0 +1,156 @@
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+import subprocess
+import sys
+
+import pytest
+
+from tox_docker.labels import ENV_LABEL, owner_labels, PID_LABEL
+from tox_docker.plugin import docker_run_pooled, maintain_pool
+from tox_docker.pool import (
+    LEASES_DIRNAME,
+    pool_hash,
+    pool_name,
+    PoolIndex,
+    PoolLeases,
+)
+from tox_docker.tests.util import make_config
+
+
+def test_pool_hash_is_independent_of_option_order() -> None:
+    one = pool_hash("sha256:abc", {"environment": {"A": "1", "B": "2"}, "ports": {}})
+    two = pool_hash("sha256:abc", {"ports": {}, "environment": {"B": "2", "A": "1"}})
+    assert one == two
+
+
+def test_pool_hash_changes_with_image_and_options() -> None:
+    base = pool_hash("sha256:abc", {"environment": {"A": "1"}})
+    assert base != pool_hash("sha256:def", {"environment": {"A": "1"}})
+    assert base != pool_hash("sha256:abc", {"environment": {"A": "2"}})
+
+
+def test_pool_name_includes_container_name_and_hash_prefix() -> None:
+    digest = pool_hash("sha256:abc", {})
+    assert pool_name("db", digest) == f"db-tox-pool-{digest[:12]}"
+
+
+def test_pool_index_records_and_forgets_containers(tmp_path: Path) -> None:
+    index = PoolIndex(tmp_path)
+    assert index.load() == {}
+
+    index.touch(["one", "two"])
+    assert set(index.load()) == {"one", "two"}
+
+    index.forget(["one", "three"])
+    assert set(index.load()) == {"two"}
+
+
+@pytest.fixture(scope="module")
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+def test_a_lease_is_held_by_one_owner_at_a_time(tmp_path: Path) -> None:
+    leases = PoolLeases(tmp_path)
+    one = {**owner_labels(), ENV_LABEL: "py1"}
+    two = {**owner_labels(), ENV_LABEL: "py2"}
+
+    assert leases.acquire("db-tox-pool-abc", one)
+    assert leases.is_held("db-tox-pool-abc")
+    assert not leases.acquire("db-tox-pool-abc", two)
+
+    # only its owner releases it
+    leases.release("db-tox-pool-abc", two)
+    assert not leases.acquire("db-tox-pool-abc", two)
+    leases.release("db-tox-pool-abc", one)
+    assert leases.acquire("db-tox-pool-abc", two)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="pids aren't probed on Windows")
+def test_a_lease_left_by_a_dead_process_is_taken_over(
+    tmp_path: Path, dead_pid: int
+) -> None:
+    leases = PoolLeases(tmp_path)
+    assert leases.acquire(
+        "db-tox-pool-abc", {**owner_labels(), PID_LABEL: str(dead_pid)}
+    )
+
+    assert not leases.is_held("db-tox-pool-abc")
+    assert leases.acquire("db-tox-pool-abc", owner_labels())
+
+
+DIGEST = pool_hash("sha256:aaa", {})
+
+
+def pooled(n: int = 0, status: str = "running") -> MagicMock:
+    container = MagicMock()
+    container.name = pool_name("db", DIGEST, n)
+    container.labels = {}
+    container.attrs = {"State": {"Status": status}}
+    return container
+
+
+def run_pooled(tmp_path: Path, *existing: MagicMock) -> MagicMock:
+    config = make_config("db", reuse=True)
+    config.runnable_image = MagicMock(id="sha256:aaa")
+    config.pool_leases_dir = str(tmp_path)
+
+    docker = MagicMock()
+    docker.containers.list.return_value = list(existing)
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker), patch(
+        "tox_docker.plugin.docker_create_and_start"
+    ) as create:
+        container = docker_run_pooled(config, {})
+    if create.called:
+        assert container is create.return_value
+        return create.call_args[0][1]  # type: ignore
+    return container  # type: ignore
+
+
+def test_a_healthy_pooled_container_is_adopted(tmp_path: Path) -> None:
+    container = pooled()
+    assert run_pooled(tmp_path, container) is container
+    assert PoolLeases(tmp_path).is_held(container.name)
+    container.remove.assert_not_called()
+
+
+def test_a_pooled_container_in_use_is_neither_adopted_nor_removed(
+    tmp_path: Path,
+) -> None:
+    in_use = pooled(status="exited")
+    PoolLeases(tmp_path).acquire(in_use.name, {**owner_labels(), ENV_LABEL: "py2"})
+
+    # another one is started alongside it
+    assert run_pooled(tmp_path, in_use) == pool_name("db", DIGEST, 1)
+    in_use.remove.assert_not_called()
+
+
+def test_a_stale_pooled_container_is_replaced(tmp_path: Path) -> None:
+    stale = pooled(status="exited")
+    assert run_pooled(tmp_path, stale) == stale.name
+    stale.remove.assert_called_once_with(v=True, force=True)
+
+
+def test_idle_pooled_containers_are_evicted_unless_in_use(tmp_path: Path) -> None:
+    idle, in_use, other = pooled(0), pooled(1), pooled(2)
+    for container in (idle, in_use, other):
+        container.id = container.name
+    index = PoolIndex(tmp_path)
+    # last used long ago; `other` was only used from another project
+    index._save({idle.id: 0.0, in_use.id: 0.0})
+    PoolLeases(tmp_path / LEASES_DIRNAME).acquire(
+        in_use.name, {**owner_labels(), ENV_LABEL: "py2"}
+    )
+
+    docker = MagicMock()
+    docker.containers.list.return_value = [idle, in_use, other]
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        maintain_pool(index, ttl=3600, prune=False)
+
+    idle.remove.assert_called_once_with(v=True, force=True)
+    in_use.remove.assert_not_called()
+    other.remove.assert_not_called()
+    assert set(index.load()) == {in_use.id}
+    assert not PoolLeases(tmp_path / LEASES_DIRNAME).is_held(idle.name)
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import MagicMock, patch
+import threading
+
+from tox.tox_env.runner import RunToxEnv
+
+from tox_docker.plugin import _prewarms, tox_env_teardown, tox_on_install
+
+
+def make_tox_env(name: str, prewarm: bool = True) -> Any:
+    tox_env = MagicMock(spec=RunToxEnv)
+    tox_env.name = name
+    tox_env.options = SimpleNamespace(docker_prewarm=prewarm)
+    return tox_env
+
+
+def test_containers_start_in_the_background_once_per_env() -> None:
+    tox_env = make_tox_env("prewarm")
+    main_thread = threading.current_thread()
+    threads = []
+
+    def start_containers(tox_env: Any, container_configs: Any) -> str:
+        threads.append(threading.current_thread())
+        return "state"
+
+    with patch("tox_docker.plugin.load_container_configs", return_value=[]):
+        with patch("tox_docker.plugin.start_containers", side_effect=start_containers):
+            tox_on_install(tox_env, [], "deps", "deps")
+            tox_on_install(tox_env, [], "package", "package")
+            assert _prewarms["prewarm"].result() == "state"
+
+    assert len(threads) == 1
+    assert threads[0] is not main_thread
+
+    with patch("tox_docker.plugin.clean_up_containers") as clean_up_containers:
+        tox_env_teardown(tox_env)
+    clean_up_containers.assert_called_once_with(tox_env)
+    assert "prewarm" not in _prewarms
+
+
+def test_containers_are_not_prewarmed_unless_asked() -> None:
+    tox_env = make_tox_env("no-prewarm", prewarm=False)
+
+    with patch("tox_docker.plugin.start_containers") as start_containers:
+        tox_on_install(tox_env, [], "deps", "deps")
+
+    start_containers.assert_not_called()
+    assert "no-prewarm" not in _prewarms
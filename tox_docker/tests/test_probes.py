@@ -0,0 +1,123 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Iterator
+import socket
+import threading
+
+import pytest
+
+from tox_docker.config import ReadinessProbe
+from tox_docker.probes import http_ready, tcp_ready, udp_ready, wait_until
+
+
+def test_probe_parsing() -> None:
+    tcp = ReadinessProbe("tcp:5432")
+    assert tcp.kind == "tcp"
+    assert tcp.container_port_proto == "5432/tcp"
+
+    udp = ReadinessProbe("udp:5678")
+    assert udp.container_port_proto == "5678/udp"
+
+    http = ReadinessProbe("http:8000/healthy")
+    assert http.container_port_proto == "8000/tcp"
+    assert http.path == "/healthy"
+    assert ReadinessProbe("http:8000").path == "/"
+
+    log = ReadinessProbe("log:ready to accept connections")
+    assert log.pattern and log.pattern.search("... ready to accept connections")
+
+
+@pytest.mark.parametrize(
+    "config_line", ["ping:80", "tcp:http", "tcp:80/path", "log:", "log:(", "8000"]
+)
+def test_probe_parsing_rejects_invalid_probes(config_line: str) -> None:
+    with pytest.raises(ValueError):
+        ReadinessProbe(config_line)
+
+
+@pytest.fixture
+def unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def test_tcp_probe(unused_port: int) -> None:
+    assert not tcp_ready("127.0.0.1", unused_port)
+
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        assert tcp_ready("127.0.0.1", server.getsockname()[1])
+
+
+def test_tcp_probe_rejects_connections_closed_straight_away() -> None:
+    # like docker's userland proxy when nothing in the container listens
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+
+        def accept_and_close() -> None:
+            conn, _ = server.accept()
+            conn.close()
+
+        thread = threading.Thread(target=accept_and_close)
+        thread.start()
+        assert not tcp_ready("127.0.0.1", server.getsockname()[1])
+        thread.join()
+
+
+def test_udp_probe() -> None:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+        server.bind(("127.0.0.1", 0))
+
+        def echo() -> None:
+            data, addr = server.recvfrom(1024)
+            server.sendto(data, addr)
+
+        thread = threading.Thread(target=echo)
+        thread.start()
+        assert udp_ready("127.0.0.1", server.getsockname()[1])
+        thread.join()
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        self.send_response(200 if self.path == "/healthy" else 503)
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def http_port() -> Iterator[int]:
+    server = HTTPServer(("127.0.0.1", 0), StatusHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_http_probe(http_port: int, unused_port: int) -> None:
+    assert http_ready("127.0.0.1", http_port, "/healthy")
+    assert not http_ready("127.0.0.1", http_port, "/starting")
+    assert not http_ready("127.0.0.1", unused_port, "/healthy")
+
+
+def test_wait_until_retries_until_check_succeeds() -> None:
+    attempts = iter([False, False, True])
+    assert wait_until(lambda: next(attempts), timeout=5)
+
+
+def test_wait_until_gives_up_after_timeout() -> None:
+    assert not wait_until(lambda: False, timeout=0.05)
+
+
+def test_wait_until_gives_up_when_watch_raises() -> None:
+    def watch() -> None:
+        raise RuntimeError("container exited")
+
+    with pytest.raises(RuntimeError):
+        wait_until(lambda: False, timeout=5, watch=watch)
@@ -0,0 +1,88 @@
+from typing import Any, Dict, Iterator, List, Optional
+from unittest.mock import patch
+import threading
+
+import pytest
+
+from tox_docker.plugin import (
+    PullFailed,
+    PullProgress,
+    PullStalled,
+    stream_pull,
+)
+from tox_docker.tests.util import make_config
+
+
+class NotARealAPIClient(object):
+    def __init__(
+        self, events: List[Dict[str, Any]], hang: Optional[threading.Event] = None
+    ) -> None:
+        self.events = events
+        self.hang = hang
+
+    def pull(
+        self, name: str, tag: Optional[str], stream: bool, decode: bool
+    ) -> Iterator[Dict[str, Any]]:
+        yield from self.events
+        if self.hang:
+            self.hang.wait()
+
+
+class NotARealDockerClient(object):
+    def __init__(self, api: NotARealAPIClient) -> None:
+        self.api = api
+
+
+def layer_events(layer: str, size: int) -> List[Dict[str, Any]]:
+    return [
+        {"id": layer, "status": "Pulling fs layer", "progressDetail": {}},
+        {
+            "id": layer,
+            "status": "Downloading",
+            "progressDetail": {"current": size // 2, "total": size},
+        },
+        {"id": layer, "status": "Download complete", "progressDetail": {}},
+        {"id": layer, "status": "Pull complete", "progressDetail": {}},
+    ]
+
+
+def test_progress_tracks_layers() -> None:
+    progress = PullProgress(make_config("db", "postgres:16", pull_stall_timeout=0.2))
+    for event in layer_events("aaa", 1000) + layer_events("bbb", 3000):
+        progress.update(event)
+    progress.update({"id": "ccc", "status": "Already exists"})
+
+    assert set(progress.layer_durations) == {"aaa", "bbb"}
+    assert sum(progress.layer_bytes.values()) == 4000
+    assert progress.existing_layers == {"ccc"}
+
+
+def test_stream_pull_consumes_the_whole_stream() -> None:
+    api = NotARealAPIClient(layer_events("aaa", 1000))
+    with patch(
+        "tox_docker.plugin.get_docker_client", return_value=NotARealDockerClient(api)
+    ):
+        stream_pull(make_config("db", "postgres:16", pull_stall_timeout=0.2))
+
+
+def test_stream_pull_raises_errors_from_the_stream() -> None:
+    api = NotARealAPIClient([{"error": "manifest unknown"}])
+    with patch(
+        "tox_docker.plugin.get_docker_client", return_value=NotARealDockerClient(api)
+    ):
+        with pytest.raises(PullFailed, match="manifest unknown"):
+            stream_pull(make_config("db", "postgres:16", pull_stall_timeout=0.2))
+
+
+def test_stream_pull_aborts_when_the_stream_stalls() -> None:
+    hang = threading.Event()
+    api = NotARealAPIClient(layer_events("aaa", 1000)[:2], hang=hang)
+    try:
+        with patch(
+            "tox_docker.plugin.get_docker_client",
+            return_value=NotARealDockerClient(api),
+        ):
+            with pytest.raises(PullStalled):
+                stream_pull(make_config("db", "postgres:16", pull_stall_timeout=0.2))
+    finally:
+        hang.set()
@@ -0,0 +1,106 @@
+from typing import Any, Dict
+from unittest.mock import MagicMock, patch
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from tox_docker.labels import (
+    DONT_STOP_LABEL,
+    HOST_LABEL,
+    is_orphaned,
+    NAME_LABEL,
+    PID_LABEL,
+    PID_NAMESPACE,
+    PID_NAMESPACE_LABEL,
+    PID_START_LABEL,
+    POOL_LABEL,
+    process_start_time,
+)
+from tox_docker.plugin import docker_reap
+
+
+@pytest.fixture(scope="module")
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+def owned_by(pid: int, **labels: str) -> Dict[str, str]:
+    return dict(
+        {
+            PID_LABEL: str(pid),
+            HOST_LABEL: socket.gethostname(),
+            PID_NAMESPACE_LABEL: PID_NAMESPACE,
+            NAME_LABEL: "db",
+        },
+        **labels,
+    )
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="pids aren't probed on Windows")
+def test_containers_of_dead_processes_are_orphaned(dead_pid: int) -> None:
+    assert is_orphaned(owned_by(dead_pid))
+    assert not is_orphaned(owned_by(os.getpid()))
+
+    # not ours to judge
+    assert not is_orphaned(owned_by(dead_pid, **{HOST_LABEL: "another-host"}))
+    assert not is_orphaned({})
+
+    # left running on purpose
+    assert not is_orphaned(owned_by(dead_pid, **{POOL_LABEL: "1"}))
+    assert not is_orphaned(owned_by(dead_pid, **{DONT_STOP_LABEL: "1"}))
+    assert is_orphaned(owned_by(dead_pid, **{DONT_STOP_LABEL: "1"}), force=True)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="pids aren't probed on Windows")
+def test_pids_in_other_pid_namespaces_are_only_judged_by_force(dead_pid: int) -> None:
+    # eg a CI job container sharing the host's name, where the pid may well
+    # belong to a tox process which is still running
+    elsewhere = owned_by(dead_pid, **{PID_NAMESPACE_LABEL: "other-boot/pid:[1]"})
+    assert not is_orphaned(elsewhere)
+    assert is_orphaned(elsewhere, force=True)
+
+    # labelled before pid namespaces were
+    unlabelled = owned_by(dead_pid)
+    del unlabelled[PID_NAMESPACE_LABEL]
+    assert not is_orphaned(unlabelled)
+
+
+@pytest.mark.skipif(
+    not process_start_time(os.getpid()), reason="process start times are unknown"
+)
+def test_a_reused_pid_is_not_mistaken_for_the_owner() -> None:
+    started = process_start_time(os.getpid())
+    assert not is_orphaned(owned_by(os.getpid(), **{PID_START_LABEL: started}))
+    assert is_orphaned(owned_by(os.getpid(), **{PID_START_LABEL: f"{started}0"}))
+
+
+def make_container(labels: Dict[str, str]) -> Any:
+    container = MagicMock()
+    container.attrs = {"Labels": labels}
+    return container
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="pids aren't probed on Windows")
+def test_orphans_are_found_with_one_request_and_removed(dead_pid: int) -> None:
+    orphan = make_container(owned_by(dead_pid))
+    alive = make_container(owned_by(os.getpid()))
+    network = MagicMock(attrs={"Labels": owned_by(dead_pid)})
+    docker = MagicMock()
+    docker.containers.list.return_value = [orphan, alive]
+    docker.networks.list.return_value = [network]
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        docker_reap()
+
+    filters = {"label": f"{HOST_LABEL}={socket.gethostname()}"}
+    docker.containers.list.assert_called_once_with(
+        all=True, sparse=True, filters=filters
+    )
+    orphan.remove.assert_called_once_with(v=True, force=True)
+    alive.remove.assert_not_called()
+    network.remove.assert_called_once_with()
@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import json
+
+from tox_docker.plugin import submit
+from tox_docker.report import current_env, TimingReport
+
+
+def test_timings_are_totalled_per_env_and_container() -> None:
+    report = TimingReport()
+    current_env.set("py311")
+    report.record("db", "pull", 0, 2.0)
+    report.record("db", "start", 2, 0.5)
+    report.record("db", "start", 3, 0.25)
+    report.record("cache", "create", 0, 0.1)
+
+    assert report.totals() == {
+        ("py311", "db"): {"pull": 2.0, "start": 0.75},
+        ("py311", "cache"): {"create": 0.1},
+    }
+
+
+def test_summary_is_a_table_of_phases() -> None:
+    report = TimingReport()
+    current_env.set("py311")
+    report.record("db", "pull", 0, 2.0)
+    report.record("db", "healthy", 2, 10.0)
+
+    assert report.summary() == [
+        "env    container  pull   healthy",
+        "py311  db         2.00s  10.00s",
+    ]
+
+
+def test_report_is_written_as_json(tmp_path: Path) -> None:
+    report = TimingReport()
+    current_env.set("py311")
+    report.record("db", "remove", 100, 1.5)
+
+    report.write(str(tmp_path / "report.json"))
+    data = json.loads((tmp_path / "report.json").read_text())
+
+    assert data["timings"] == [
+        {
+            "env": "py311",
+            "container": "db",
+            "phase": "remove",
+            "started": 100,
+            "duration": 1.5,
+        }
+    ]
+    assert data["totals"] == [
+        {"env": "py311", "container": "db", "phases": {"remove": 1.5}}
+    ]
+
+
+def test_worker_threads_know_the_current_env() -> None:
+    current_env.set("py311")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert submit(executor, current_env.get).result() == "py311"
@@ -0,0 +1,116 @@
+from typing import Any, Dict
+from unittest.mock import MagicMock, patch
+
+from docker.errors import ImageNotFound
+from tox.tox_env.errors import Fail
+from tox.tox_env.runner import RunToxEnv
+import pytest
+
+from tox_docker.plugin import (
+    docker_pull,
+    docker_resolve_images,
+    ImageNotPresent,
+    normalize_ref,
+    tox_before_run_commands,
+)
+from tox_docker.tests.util import make_config
+
+
+def summary(image_id: str, *tags: str) -> Dict[str, Any]:
+    return {"Id": image_id, "RepoTags": list(tags), "Created": 1700000000}
+
+
+@pytest.mark.parametrize(
+    "ref,expected",
+    [
+        ("postgres", "postgres:latest"),
+        ("postgres:16", "postgres:16"),
+        ("docker.io/library/postgres:16", "postgres:16"),
+        ("localhost:5000/app", "localhost:5000/app:latest"),
+    ],
+)
+def test_normalize_ref(ref: str, expected: str) -> None:
+    assert normalize_ref(ref) == expected
+
+
+def test_images_are_resolved_with_one_list_call() -> None:
+    configs = [
+        make_config("db", "docker.io/library/postgres:16"),
+        make_config("cache", "redis:7"),
+    ]
+    docker = MagicMock()
+    docker.api.images.return_value = [
+        summary("sha256:old"),
+        summary("sha256:aaa", "postgres:16", "postgres:latest"),
+    ]
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        docker_resolve_images(configs)
+
+    docker.api.images.assert_called_once_with()
+    docker.images.get.assert_not_called()
+    assert configs[0].runnable_image is not None
+    assert configs[1].runnable_image is None
+    assert all(config.image_listed for config in configs)
+
+
+def test_images_missing_from_the_list_are_pulled_without_inspecting() -> None:
+    config = make_config("db", "postgres:16")
+    docker = MagicMock()
+    docker.api.images.return_value = []
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker), patch(
+        "tox_docker.plugin.docker_pull_with_retries"
+    ) as pull:
+        docker_resolve_images([config])
+        docker_pull(config)
+
+    docker.images.get.assert_not_called()
+    assert config.runnable_image is pull.return_value
+
+
+def test_pull_policy_always_skips_resolution() -> None:
+    config = make_config("db", "postgres:16", pull_policy="always")
+    docker = MagicMock()
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        docker_resolve_images([config])
+    docker.api.images.assert_not_called()
+    assert config.runnable_image is None
+
+
+def test_pull_policy_never_does_not_pull() -> None:
+    config = make_config("db", "postgres:16", pull_policy="never")
+    docker = MagicMock()
+    docker.images.get.side_effect = ImageNotFound("no such image")
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        with pytest.raises(ImageNotPresent):
+            docker_pull(config)
+    docker.api.pull.assert_not_called()
+
+
+def test_pull_policy_never_fails_for_images_missing_from_the_list() -> None:
+    config = make_config("db", "postgres:16", pull_policy="never")
+    docker = MagicMock()
+    docker.api.images.return_value = []
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        docker_resolve_images([config])
+        with pytest.raises(ImageNotPresent):
+            docker_pull(config)
+    docker.images.get.assert_not_called()
+    docker.api.pull.assert_not_called()
+
+
+def test_missing_images_fail_the_testenv() -> None:
+    tox_env = MagicMock(spec=RunToxEnv)
+    tox_env.name = "py"
+    missing = ImageNotPresent("'postgres:16' is not present locally")
+
+    with patch("tox_docker.plugin.load_container_configs", return_value=[]):
+        with patch("tox_docker.plugin.start_containers", side_effect=missing):
+            with patch("tox_docker.plugin.clean_up_containers") as clean_up:
+                with pytest.raises(Fail, match="is not present locally"):
+                    tox_before_run_commands(tox_env)
+    clean_up.assert_called_once_with(tox_env)
@@ -0,0 +1,39 @@
+import pytest
+
+from tox_docker.config import Ulimit
+from tox_docker.plugin import resource_limits
+from tox_docker.tests.util import make_config
+
+
+def test_no_limits_by_default() -> None:
+    assert resource_limits(make_config("es", "elasticsearch:8")) == {}
+
+
+def test_limits_are_passed_to_docker() -> None:
+    config = make_config(
+        "es",
+        "elasticsearch:8",
+        mem_limit="1g",
+        cpus=1.5,
+        cpu_shares=512,
+        cpuset_cpus="0-1",
+        shm_size="256m",
+        ulimits=[Ulimit("nofile=1024:2048"), Ulimit("memlock=-1")],
+    )
+    assert resource_limits(config) == {
+        "mem_limit": "1g",
+        "nano_cpus": 1500000000,
+        "cpu_shares": 512,
+        "cpuset_cpus": "0-1",
+        "shm_size": "256m",
+        "ulimits": [
+            {"Name": "nofile", "Soft": 1024, "Hard": 2048},
+            {"Name": "memlock", "Soft": -1, "Hard": -1},
+        ],
+    }
+
+
+@pytest.mark.parametrize("config_line", ["nofile", "nofile=lots", "NOFILE=1"])
+def test_ulimit_parsing_rejects_invalid_ulimits(config_line: str) -> None:
+    with pytest.raises(ValueError):
+        Ulimit(config_line)
@@ -0,0 +1,75 @@
+from typing import Any, Iterator, Set
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from tox_docker.config import ContainerConfig
+from tox_docker.plugin import (
+    _shared_containers,
+    acquire_shared_container,
+    release_shared_container,
+    SharedContainer,
+    stop_shared_containers,
+)
+from tox_docker.tests.util import make_config
+
+
+def session_config(**kwargs: Any) -> ContainerConfig:
+    config = make_config("db", "postgres", scope="session", **kwargs)
+    config.runnable_image = MagicMock()
+    return config
+
+
+@pytest.fixture
+def shared(request: pytest.FixtureRequest) -> Iterator[SharedContainer]:
+    expected: Set[str] = getattr(request, "param", set())
+    _shared_containers["db"] = SharedContainer(expected)
+    yield _shared_containers["db"]
+    del _shared_containers["db"]
+
+
+def test_session_container_is_started_once(shared: SharedContainer) -> None:
+    with patch("tox_docker.plugin.docker_run") as docker_run:
+        one = acquire_shared_container(session_config(), None, "py1")
+        two = acquire_shared_container(session_config(), None, "py2")
+
+    assert docker_run.call_count == 1
+    assert one is two
+    assert shared.users == {"py1", "py2"}
+
+
+def test_session_container_is_released_by_last_user(shared: SharedContainer) -> None:
+    with patch("tox_docker.plugin.docker_run"):
+        container = acquire_shared_container(session_config(), None, "py1")
+        acquire_shared_container(session_config(), None, "py2")
+
+    assert release_shared_container(session_config(), "py1") is None
+    assert release_shared_container(session_config(), "py2") is container
+    assert shared.container is None
+
+
+@pytest.mark.parametrize("shared", [{"py1", "py2"}], indirect=True)
+def test_session_container_waits_for_expected_users(shared: SharedContainer) -> None:
+    with patch("tox_docker.plugin.docker_run") as docker_run:
+        container = acquire_shared_container(session_config(), None, "py1")
+        assert release_shared_container(session_config(), "py1") is None
+
+        # py2 hasn't run yet, so it gets the same container
+        assert acquire_shared_container(session_config(), None, "py2") is container
+        assert release_shared_container(session_config(), "py2") is container
+
+    assert docker_run.call_count == 1
+
+
+@pytest.mark.parametrize("stop", [True, False])
+def test_session_containers_left_at_exit_are_stopped_as_configured(
+    shared: SharedContainer, stop: bool
+) -> None:
+    with patch("tox_docker.plugin.docker_run") as docker_run:
+        acquire_shared_container(session_config(stop=stop), None, "py1")
+
+    stop_shared_containers()
+
+    container = docker_run.return_value
+    assert container.remove.called == stop
+    assert shared.container is None
@@ -0,0 +1,114 @@
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+from docker.errors import ImageNotFound
+import pytest
+
+from tox_docker.config import ContainerConfig
+from tox_docker.plugin import (
+    docker_find_snapshot,
+    docker_initialize,
+    InitCommandFailed,
+    SNAPSHOT_REPOSITORY,
+    snapshot_tag,
+)
+from tox_docker.tests.util import make_config
+
+
+def postgres_config(**kwargs: Any) -> ContainerConfig:
+    config = make_config("db", "postgres:16", **kwargs)
+    config.runnable_image = MagicMock(id="sha256:aaa")
+    return config
+
+
+def test_snapshot_tag_depends_on_init_commands() -> None:
+    migrate = postgres_config(init_commands=["migrate"])
+    seed = postgres_config(init_commands=["migrate", "seed"])
+
+    assert snapshot_tag(migrate) == snapshot_tag(
+        postgres_config(init_commands=["migrate"])
+    )
+    assert snapshot_tag(migrate) != snapshot_tag(seed)
+    assert snapshot_tag(migrate).startswith("db-")
+
+
+def test_init_commands_run_then_container_is_committed() -> None:
+    config = postgres_config(init_commands=["migrate", "seed"], snapshot=True)
+    config.created = True
+    container = MagicMock()
+    container.exec_run.return_value = (0, b"")
+
+    with patch("tox_docker.plugin.get_docker_client"):
+        docker_initialize(config, container)
+
+    assert [c.args[0] for c in container.exec_run.call_args_list] == [
+        ["sh", "-c", "migrate"],
+        ["sh", "-c", "seed"],
+    ]
+    container.commit.assert_called_once_with(
+        repository=SNAPSHOT_REPOSITORY, tag=snapshot_tag(config)
+    )
+
+
+def test_failing_init_command_is_reported() -> None:
+    config = postgres_config(init_commands=["migrate", "seed"], snapshot=True)
+    config.created = True
+    container = MagicMock()
+    container.exec_run.return_value = (3, b"relation exists\n")
+
+    with pytest.raises(InitCommandFailed, match="relation exists"):
+        docker_initialize(config, container)
+
+    assert container.exec_run.call_count == 1
+    container.commit.assert_not_called()
+
+
+def test_containers_from_a_snapshot_are_not_initialized_again() -> None:
+    config = postgres_config(init_commands=["migrate"], snapshot=True)
+    tag = snapshot_tag(config)
+    docker = MagicMock()
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        docker_find_snapshot(config)
+    docker.images.get.assert_called_once_with(f"{SNAPSHOT_REPOSITORY}:{tag}")
+    assert config.runnable_image is docker.images.get.return_value
+
+    config.created = True
+    container = MagicMock()
+    docker_initialize(config, container)
+    container.exec_run.assert_not_called()
+    container.commit.assert_not_called()
+
+
+def test_missing_snapshot_starts_from_the_original_image() -> None:
+    config = postgres_config(snapshot=True)
+    image = config.runnable_image
+    docker = MagicMock()
+    docker.images.get.side_effect = ImageNotFound("no snapshot")
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        docker_find_snapshot(config)
+
+    assert config.runnable_image is image
+    assert not config.from_snapshot
+
+
+def test_snapshot_replaces_stale_snapshots() -> None:
+    config = postgres_config(init_commands=["migrate"], snapshot=True)
+    config.created = True
+    container = MagicMock()
+    container.exec_run.return_value = (0, b"")
+    current = f"{SNAPSHOT_REPOSITORY}:{snapshot_tag(config)}"
+    stale = f"{SNAPSHOT_REPOSITORY}:db-0123456789abcdef"
+    docker = MagicMock()
+    docker.api.images.return_value = [
+        {"RepoTags": [current]},
+        {"RepoTags": [stale]},
+        # another container's snapshot, or not one of ours at all
+        {"RepoTags": [f"{SNAPSHOT_REPOSITORY}:db-cache-0123456789abcdef"]},
+        {"RepoTags": [f"{SNAPSHOT_REPOSITORY}:db-latest"]},
+    ]
+
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        docker_initialize(config, container)
+
+    docker.api.images.assert_called_once_with(name=SNAPSHOT_REPOSITORY)
+    docker.api.remove_image.assert_called_once_with(stale)
@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+import threading
+
+from docker.errors import APIError, NotFound
+import pytest
+
+from tox_docker.labels import ENV_LABEL, NAME_LABEL, SESSION_ID, SESSION_LABEL
+from tox_docker.plugin import (
+    _env_states,
+    clean_up_containers,
+    EnvState,
+    stop_containers,
+    tear_down,
+)
+from tox_docker.tests.util import make_config
+
+
+def test_containers_are_removed_concurrently() -> None:
+    barrier = threading.Barrier(3, timeout=5)
+    containers = []
+    for i in range(3):
+        container = MagicMock()
+        container.remove.side_effect = lambda **kwargs: barrier.wait()
+        containers.append((make_config(f"c{i}"), container))
+
+    # deadlocks (and times out) unless all three are removed at the same time
+    stop_containers(containers)
+
+
+def test_stop_timeout_stops_before_removing() -> None:
+    container = MagicMock()
+    stop_containers([(make_config("db", stop_timeout=5), container)])
+
+    container.stop.assert_called_once_with(timeout=5)
+    container.remove.assert_called_once_with(v=True, force=True)
+
+
+def test_already_removed_containers_are_ignored() -> None:
+    container = MagicMock()
+    container.remove.side_effect = NotFound("gone")
+    stop_containers([(make_config("db"), container)])
+
+
+def test_teardown_reuses_container_handles_from_startup() -> None:
+    container = MagicMock()
+    config = make_config("db")
+    state = EnvState([config])
+    state.containers = [(config, container)]
+    network = MagicMock()
+    state.networks = [network]
+    _env_states["py"] = state
+    tox_env = SimpleNamespace(
+        name="py",
+        conf=None,  # would fail if teardown tried to re-parse the config
+        options=SimpleNamespace(docker_background_teardown=False),
+    )
+
+    docker = MagicMock()
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        clean_up_containers(tox_env)  # type: ignore
+
+    container.remove.assert_called_once_with(v=True, force=True)
+    assert "py" not in _env_states
+
+    # the testenv's own network is removed once its containers are gone,
+    # without looking up networks by name
+    network.remove.assert_called_once_with()
+    docker.networks.list.assert_not_called()
+
+
+def test_teardown_finds_containers_by_label_if_startup_failed() -> None:
+    config = make_config("db")
+    _env_states["py"] = EnvState([config])
+    tox_env = SimpleNamespace(
+        name="py", options=SimpleNamespace(docker_background_teardown=False)
+    )
+
+    container = MagicMock()
+    container.attrs = {"Labels": {NAME_LABEL: "db"}}
+    docker = MagicMock()
+    docker.containers.list.return_value = [container]
+    with patch("tox_docker.plugin.get_docker_client", return_value=docker):
+        clean_up_containers(tox_env)  # type: ignore
+
+    docker.containers.list.assert_called_once_with(
+        all=True,
+        sparse=True,
+        filters={"label": [f"{SESSION_LABEL}={SESSION_ID}", f"{ENV_LABEL}=py"]},
+    )
+    container.remove.assert_called_once_with(v=True, force=True)
+
+
+def test_networks_of_containers_left_running_are_kept() -> None:
+    kept, removed = MagicMock(id="kept"), MagicMock(id="removed")
+    kept_network = MagicMock(containers=[kept, removed])
+    other_network = MagicMock(containers=[removed])
+
+    tear_down(
+        [(make_config("db", stop=False), kept), (make_config("web"), removed)],
+        networks=[kept_network, other_network],
+    )
+
+    kept.remove.assert_not_called()
+    kept_network.disconnect.assert_not_called()
+    kept_network.remove.assert_not_called()
+    other_network.remove.assert_called_once_with()
+
+
+def test_background_teardown_failures_are_logged(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    container = MagicMock()
+    container.remove.side_effect = APIError("removal failed")
+    config = make_config("db")
+    state = EnvState([config])
+    state.containers = [(config, container)]
+    _env_states["py"] = state
+    tox_env = SimpleNamespace(
+        name="py", options=SimpleNamespace(docker_background_teardown=True)
+    )
+    reaper = ThreadPoolExecutor()
+
+    with patch("tox_docker.plugin.get_reaper", return_value=reaper):
+        clean_up_containers(tox_env)  # type: ignore
+    reaper.shutdown(wait=True)
+
+    assert "tearing down 'py' failed: removal failed" in caplog.text
@@ -1,5 +1,9 @@
 import os
 
+import pytest
+
+from tox_docker.config import Volume
+
 
 def test_the_image_is_healthy() -> None:
     # the healthcheck creates a file "healthy" in the volume from within
@@ -7,3 +11,51 @@ def test_the_image_is_healthy() -> None:
     # and thus the bind mount worked as expected
     volume = os.environ["VOLUME_DIR"]
     assert "healthy" in os.listdir(volume)
+
+
+def test_tmpfs_volume_parsing() -> None:
+    mount = Volume("tmpfs:size=512m,mode=1777:/var/lib/postgresql/data").docker_mount
+    assert mount["Type"] == "tmpfs"
+    assert mount["Target"] == "/var/lib/postgresql/data"
+    assert mount["TmpfsOptions"] == {"SizeBytes": 512 * 1024 * 1024, "Mode": 0o1777}
+
+    mount = Volume("tmpfs::/data").docker_mount
+    assert mount["Type"] == "tmpfs"
+    assert "TmpfsOptions" not in mount
+
+
+@pytest.mark.parametrize(
+    "config_line",
+    [
+        "tmpfs:size=lots:/data",
+        "tmpfs:mode=999:/data",
+        "tmpfs:uid=1000:/data",
+        "tmpfs:size=1g:relative/path",
+        "tmpfs:size=1g:/host/path:/data",
+    ],
+)
+def test_tmpfs_volume_parsing_rejects_invalid_options(config_line: str) -> None:
+    with pytest.raises(ValueError):
+        Volume(config_line)
+
+
+def test_named_volume_parsing() -> None:
+    mount = Volume("volume:ro,nocopy:pgdata:/var/lib/postgresql/data").docker_mount
+    assert mount["Type"] == "volume"
+    assert mount["Source"] == "pgdata"
+    assert mount["ReadOnly"] is True
+    assert mount["VolumeOptions"] == {"NoCopy": True}
+
+
+@pytest.mark.parametrize(
+    "config_line",
+    [
+        "volume:rw:/not/a/name:/data",
+        "volume:rw,ro:pgdata:/data",
+        "volume:rw:pgdata:data",
+        "overlay:rw:pgdata:/data",
+    ],
+)
+def test_named_volume_parsing_rejects_invalid_volumes(config_line: str) -> None:
+    with pytest.raises(ValueError):
+        Volume(config_line)
@@ -1,10 +1,11 @@
+from typing import Any, Optional
 import os
 
 from docker.models.containers import Container
 import docker
 import pytest
 
-from tox_docker.config import runas_name
+from tox_docker.config import ContainerConfig, Image, runas_name
 
 
 def find_container(instance_name: str) -> Container:
@@ -21,3 +22,21 @@ def find_container(instance_name: str) -> Container:
             return container
 
     pytest.fail(f"No running container with instance name {running_name!r}")
+
+
+def make_config(
+    name: str = "db", image: Optional[str] = "", **kwargs: Any
+) -> ContainerConfig:
+    """
+    Return the config of a container `name`, with any other settings given
+
+    Its image is named after the container unless `image` is given; pass
+    None for a container built from a `dockerfile` instead.
+
+    """
+    kwargs.setdefault("dockerfile", None)
+    kwargs.setdefault("dockerfile_target", "")
+    kwargs.setdefault("stop", True)
+    return ContainerConfig(
+        name=name, image=Image(image or name) if image is not None else None, **kwargs
+    )